@@ -0,0 +1,120 @@
+"""
+Decisions per second and decision latency of the NumPy policy server, see
+grpc_server.policy_server, serving many concurrent flows with one forward
+pass per state and with batched forward passes.
+
+A client process plays the Mockets flows: every flow sends a state, waits
+for its action, waits for the network round trip and sends the next one.
+The server runs in this process and reports its batching metrics. The
+policy is a SAC actor with net_arch=[400, 300] and random weights.
+
+Run from the project's root folder: python -m benchmarks.batched_inference
+"""
+import argparse
+import asyncio
+import logging
+import multiprocessing
+import os
+import tempfile
+import time
+
+import numpy as np
+
+import grpc_server.policy_server as policy_server
+from benchmarks.policy_serving import random_policy
+
+logging.basicConfig(level=logging.WARNING)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--flows", type=int, default=32)
+    parser.add_argument("--states", type=int, default=200, help="States per flow")
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--max-delay-ms", type=float, default=2.0)
+    parser.add_argument("--rtt-ms", type=float, default=5.0,
+                        help="Time a flow waits between an action and its next state")
+    parser.add_argument("--history-horizon", type=int, default=10)
+    parser.add_argument("--port", type=int, default=50074)
+
+    return parser.parse_args()
+
+
+async def flow(stub, states, rtt, latencies, seed):
+    from protos import congestion_control_pb2
+
+    rng = np.random.default_rng(seed)
+    answered = asyncio.Queue()
+
+    async def requests():
+        for index in range(states):
+            status = congestion_control_pb2.CommunicationState(
+                curr_window_size=float(rng.integers(10, 100)),
+                sent_bytes_timeframe=float(rng.integers(0, 100)),
+                acked_bytes_timeframe=float(rng.integers(0, 100)),
+                last_rtt=float(rng.integers(10, 200)),
+                timestamp=1000 + 20 * index)
+            start = time.perf_counter()
+            yield status
+            await answered.get()
+            latencies.append(time.perf_counter() - start)
+            await asyncio.sleep(rtt)
+
+    async for action in stub.OptimizeCongestionControl(requests()):
+        answered.put_nowait(action)
+
+
+async def flows_main(port, flows, states, rtt):
+    import grpc
+    from protos import congestion_control_pb2_grpc
+
+    latencies = []
+    async with grpc.aio.insecure_channel(f"localhost:{port}") as channel:
+        await channel.channel_ready()
+        stub = congestion_control_pb2_grpc.CongestionControlStub(channel)
+        start = time.perf_counter()
+        await asyncio.gather(*(flow(stub, states, rtt, latencies, seed) for seed in range(flows)))
+        elapsed = time.perf_counter() - start
+
+    return len(latencies) / elapsed, np.array(latencies) * 1e6
+
+
+def client(port, flows, states, rtt, results):
+    """Plays the Mockets flows"""
+    results.put(asyncio.run(flows_main(port, flows, states, rtt)))
+
+
+async def measure(policy, port, batch_size, args):
+    server, service = policy_server.create_server(policy, port, batch_size,
+                                                  args.max_delay_ms / 1e3)
+    await server.start()
+
+    context = multiprocessing.get_context("spawn")
+    results = context.Queue()
+    client_process = context.Process(target=client, daemon=True,
+                                     args=(port, args.flows, args.states, args.rtt_ms / 1e3, results))
+    client_process.start()
+    throughput, latencies = await asyncio.get_running_loop().run_in_executor(None, results.get)
+    client_process.join()
+    await server.stop(None)
+
+    return throughput, latencies, service.metrics()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        policy_path = os.path.join(directory, "policy.npz")
+        random_policy(args.history_horizon, policy_path)
+        policy = policy_server.ServedPolicy.load(policy_path)
+
+    print(f"{args.flows} flows, {args.rtt_ms} ms between an action and the next state")
+    print(f"{'batch':>6}{'decisions/s':>13}{'p50 us':>10}{'p99 us':>10}"
+          f"{'server p99 us':>15}{'mean fill':>11}")
+    for port, batch_size in enumerate(args.batch_sizes, args.port):
+        throughput, latencies, metrics = asyncio.run(measure(policy, port, batch_size, args))
+        fill = metrics['batching']['batch_fill'] if 'batching' in metrics else 1.0
+        print(f"{batch_size:>6}{throughput:>13.0f}{np.percentile(latencies, 50):>10.0f}"
+              f"{np.percentile(latencies, 99):>10.0f}{metrics['decision_latency']['p99_us']:>15.0f}"
+              f"{fill:>11.2f}")
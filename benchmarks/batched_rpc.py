@@ -0,0 +1,125 @@
+"""
+Throughput and server CPU cost of the states sent one per message with
+OptimizeCongestionControl and packed in CommunicationStateBatch messages
+with OptimizeCongestionControlBatched.
+
+A client process plays Mockets and streams the states as fast as gRPC flow
+control lets it, the main process plays the env and answers every state
+with an action. The CPU time of the server process is read from /proc.
+
+Run from the project's root folder: python -m benchmarks.batched_rpc
+"""
+import argparse
+import logging
+import multiprocessing
+import os
+import time
+from multiprocessing import Process
+
+import numpy as np
+
+import grpc_server.congestion_control_server as cc_server
+from grpc_server import state_record
+from grpc_server.backpressure import BLOCK
+from grpc_server.channels import SHARED_MEMORY_TRANSPORT, TRANSPORTS, make_channel
+
+logging.basicConfig(level=logging.WARNING)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--samples", type=int, default=5000)
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 10, 50])
+    parser.add_argument("--delta-encoded", action="store_true")
+    parser.add_argument("--transport", type=str, default=SHARED_MEMORY_TRANSPORT,
+                        choices=TRANSPORTS)
+    parser.add_argument("--port", type=int, default=50072)
+
+    return parser.parse_args()
+
+
+def states(samples):
+    records = np.zeros((samples, state_record.RECORD_WIDTH))
+    # CommunicationState fields are integers
+    records[:, :state_record.STREAM_ID] = np.random.default_rng(0).integers(
+        0, 1000, (samples, state_record.STREAM_ID))
+    records[:, state_record.FIELD_NAMES.index("finished")] = 0
+    return records
+
+
+def client(port, samples, batch_size, delta_encoded):
+    """Plays Mockets: stream every state, then read every action"""
+    import grpc
+    from protos import congestion_control_pb2, congestion_control_pb2_grpc
+
+    records = states(samples)
+    with grpc.insecure_channel(f"localhost:{port}") as channel:
+        stub = congestion_control_pb2_grpc.CongestionControlStub(channel)
+        if batch_size is None:
+            requests = (congestion_control_pb2.CommunicationState(
+                **dict(zip(state_record.FIELD_NAMES,
+                           record[:state_record.STREAM_ID].astype(int).tolist())))
+                for record in records)
+            responses = stub.OptimizeCongestionControl(requests, wait_for_ready=True)
+        else:
+            requests = (state_record.encode_batch(records[start:start + batch_size],
+                                                  delta_encoded)
+                        for start in range(0, samples, batch_size))
+            responses = stub.OptimizeCongestionControlBatched(requests, wait_for_ready=True)
+        for _ in responses:
+            pass
+
+
+def cpu_seconds(pid):
+    with open(f"/proc/{pid}/stat") as stat:
+        # utime and stime follow the command name, which can hold spaces
+        fields = stat.read().rsplit(")", 1)[1].split()
+    return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+
+
+def measure(server, port, samples, batch_size, delta_encoded):
+    """Samples per second and server CPU microseconds per sample"""
+    process, state_channel, action_channel = server
+    client_process = multiprocessing.get_context("spawn").Process(
+        target=client, args=(port, samples, batch_size, delta_encoded), daemon=True)
+    client_process.start()
+
+    # Wait for the first state so the client start-up is left out
+    record = state_channel.get(timeout=30)
+    start = time.perf_counter()
+    cpu_start = cpu_seconds(process.pid)
+    for sample in range(samples):
+        if sample:
+            record = state_channel.get(timeout=30)
+        action_channel.put((record[state_record.STREAM_ID], record[state_record.SEQUENCE], 1444))
+    elapsed = time.perf_counter() - start
+    cpu = cpu_seconds(process.pid) - cpu_start
+    client_process.join()
+
+    return samples / elapsed, cpu / samples * 1e6
+
+
+if __name__ == "__main__":
+    args = parse_args()
+
+    state_channel = make_channel(args.transport, state_record.RECORD_WIDTH)
+    action_channel = make_channel(args.transport, 3)
+    # A buffer as large as the biggest batch lets a batch be queued at once
+    server_process = Process(target=cc_server.run,
+                             args=(action_channel, state_channel, args.port,
+                                   BLOCK, max(args.batch_sizes)),
+                             daemon=True)
+    server_process.start()
+    server = server_process, state_channel, action_channel
+
+    print(f"{'rpc':<15}{'samples/s':>12}{'server us/sample':>18}")
+    for batch_size in [None] + args.batch_sizes:
+        throughput, cpu_us = measure(server, args.port, args.samples,
+                                     batch_size, args.delta_encoded)
+        name = "per-message" if batch_size is None else f"batch {batch_size}"
+        print(f"{name:<15}{throughput:>12.0f}{cpu_us:>18.1f}")
+
+    server_process.terminate()
+    server_process.join()
+    state_channel.close()
+    action_channel.close()
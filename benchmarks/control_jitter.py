@@ -0,0 +1,198 @@
+"""
+Action latency distribution of the control loop with a learner training on
+the same machine, with the processes sharing the CPUs as they are started by
+default and isolated, see envs.utils.isolation.
+
+The gRPC server process answers a client playing Mockets, which sends a
+state every --interval-ms and measures how long the action answering it,
+matched by its sequence id, takes to come back. The server decides on one
+state every --decision-interval, the env loop in this process answers it
+with a SAC-sized torch actor; the states in between are answered by the
+server on its own. Learner processes run gradient steps of SAC-sized
+networks meanwhile.
+
+Isolated, the server, the env loop and the learners get their own CPUs when
+there are enough of them, and the server runs at a higher priority than the
+env loop, itself above the learners. Torch is capped to --torch-threads in
+every process.
+
+Run from the project's root folder: python -m benchmarks.control_jitter
+"""
+import argparse
+import logging
+import multiprocessing
+import os
+import time
+from multiprocessing import Process
+
+import numpy as np
+import torch
+
+import grpc_server.congestion_control_server as cc_server
+from envs.utils.features import OBSERVATION_LENGTH
+from envs.utils.isolation import isolate
+from grpc_server import state_record
+from grpc_server.channels import QUEUE_TRANSPORT, TRANSPORTS, make_channel
+
+logging.basicConfig(level=logging.WARNING)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--states", type=int, default=2000)
+    parser.add_argument("--interval-ms", type=float, default=5.0)
+    parser.add_argument("--decision-interval", type=int, default=4)
+    parser.add_argument("--learners", type=int, default=2)
+    parser.add_argument("--transport", type=str, default=QUEUE_TRANSPORT, choices=TRANSPORTS)
+    parser.add_argument("--server-cpus", type=str, default=None)
+    parser.add_argument("--env-cpus", type=str, default=None)
+    parser.add_argument("--learner-cpus", type=str, default=None)
+    parser.add_argument("--server-nice", type=int, default=-10)
+    parser.add_argument("--env-nice", type=int, default=-5)
+    parser.add_argument("--learner-nice", type=int, default=10)
+    parser.add_argument("--server-realtime-priority", type=int, default=None,
+                        help="SCHED_FIFO priority of the server when isolated")
+    parser.add_argument("--torch-threads", type=int, default=1)
+    parser.add_argument("--port", type=int, default=50075)
+
+    return parser.parse_args()
+
+
+def default_cpu_sets(args):
+    """Server, env loop and learner CPUs, None where there are too few CPUs"""
+    cpus = sorted(os.sched_getaffinity(0))
+    if len(cpus) >= 3:
+        defaults = (str(cpus[0]), str(cpus[1]), ",".join(map(str, cpus[2:])))
+    elif len(cpus) == 2:
+        defaults = (str(cpus[0]), str(cpus[0]), str(cpus[1]))
+    else:
+        defaults = (None, None, None)
+
+    return tuple(given if given is not None else default for given, default in
+                 zip((args.server_cpus, args.env_cpus, args.learner_cpus), defaults))
+
+
+def mlp(sizes):
+    layers = []
+    for inputs, outputs in zip(sizes[:-1], sizes[1:]):
+        layers += [torch.nn.Linear(inputs, outputs), torch.nn.ReLU()]
+    return torch.nn.Sequential(*layers[:-1])
+
+
+def learner(cpus, nice, torch_threads):
+    """Gradient steps of a SAC-sized critic on batches of 256, forever"""
+    isolate(cpus, nice, torch_threads=torch_threads, name="learner")
+    critic = mlp([OBSERVATION_LENGTH + 1, 400, 300, 1])
+    optimizer = torch.optim.Adam(critic.parameters())
+    batch = torch.randn(256, OBSERVATION_LENGTH + 1)
+    while True:
+        loss = critic(batch).pow(2).mean()
+        optimizer.zero_grad()
+        loss.backward()
+        optimizer.step()
+
+
+def client(port, states, interval, results):
+    """Plays Mockets: a state every interval, whatever the actions"""
+    import threading
+
+    import grpc
+    from protos import congestion_control_pb2, congestion_control_pb2_grpc
+
+    sent = np.zeros(states + 1)
+    latencies = np.full(states + 1, np.nan)
+
+    def requests():
+        start = time.perf_counter()
+        for sequence_id in range(1, states + 1):
+            delay = start + sequence_id * interval - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            sent[sequence_id] = time.perf_counter()
+            yield congestion_control_pb2.CommunicationState(
+                curr_window_size=10, sent_bytes_timeframe=10, acked_bytes_timeframe=10,
+                last_rtt=50, timestamp=int(time.time() * 1000), sequence_id=sequence_id)
+        # Leave the last actions the time to come back
+        time.sleep(1)
+
+    with grpc.insecure_channel(f"localhost:{port}") as channel:
+        stub = congestion_control_pb2_grpc.CongestionControlStub(channel)
+        for action in stub.OptimizeCongestionControl(requests(), wait_for_ready=True):
+            latencies[action.sequence_id] = time.perf_counter() - sent[action.sequence_id]
+    results.put(latencies[1:] * 1e6)
+
+
+def measure(args, port, isolated):
+    server_cpus, env_cpus, learner_cpus = default_cpu_sets(args) if isolated else (None, None, None)
+    server_nice, env_nice, learner_nice = (args.server_nice, args.env_nice, args.learner_nice) \
+        if isolated else (None, None, None)
+    torch_threads = args.torch_threads if isolated else None
+    realtime_priority = args.server_realtime_priority if isolated else None
+
+    learners = [Process(target=learner, args=(learner_cpus, learner_nice, torch_threads), daemon=True)
+                for _ in range(args.learners)]
+    for learner_process in learners:
+        learner_process.start()
+
+    state_channel = make_channel(args.transport, state_record.RECORD_WIDTH)
+    action_channel = make_channel(args.transport, 3)
+    server = Process(target=cc_server.run, daemon=True, kwargs=dict(
+        action_queue=action_channel, state_queue=state_channel, port=port,
+        decision_interval=args.decision_interval, cpus=server_cpus, nice=server_nice,
+        realtime_priority=realtime_priority))
+    server.start()
+
+    # The env loop runs in this process, set back afterwards
+    default_cpus = os.sched_getaffinity(0)
+    default_threads = torch.get_num_threads()
+    if isolated:
+        isolate(env_cpus, env_nice, torch_threads=torch_threads, name="env loop")
+    context = multiprocessing.get_context("spawn")
+    results = context.Queue()
+    client_process = context.Process(target=client, args=(port, args.states, args.interval_ms / 1e3, results),
+                                     daemon=True)
+    client_process.start()
+
+    actor = mlp([OBSERVATION_LENGTH, 400, 300, 1])
+    observation = torch.randn(1, OBSERVATION_LENGTH)
+    decisions = 0
+    with torch.no_grad():
+        while decisions < args.states // args.decision_interval:
+            record = state_channel.get(timeout=60)
+            if record[state_record.INTERMEDIATE]:
+                continue
+            actor(observation)
+            action_channel.put((record[state_record.STREAM_ID], record[state_record.SEQUENCE], 10000))
+            decisions += 1
+
+    latencies = results.get(timeout=120)
+    client_process.join()
+    for process in [server] + learners:
+        process.terminate()
+        process.join()
+    state_channel.close()
+    action_channel.close()
+    if isolated:
+        isolate(default_cpus, 0, torch_threads=default_threads, name="env loop")
+
+    return latencies
+
+
+def report(name, latencies):
+    latencies = latencies[~np.isnan(latencies)]
+    print(f"{name:<32}{len(latencies):>8}{np.percentile(latencies, 50):>10.0f}"
+          f"{np.percentile(latencies, 99):>10.0f}{np.percentile(latencies, 99.9):>10.0f}"
+          f"{latencies.max():>10.0f}{latencies.std():>10.0f}")
+
+
+if __name__ == "__main__":
+    args = parse_args()
+
+    print(f"{os.cpu_count()} CPUs, CPU sets (server, env, learner) when isolated: {default_cpu_sets(args)}")
+    print(f"{'action latency (us)':<32}{'count':>8}{'p50':>10}{'p99':>10}{'p99.9':>10}{'max':>10}{'std':>10}")
+    for port, isolated in enumerate((False, True), args.port):
+        latencies = measure(args, port, isolated)
+        decided = np.arange(len(latencies)) % args.decision_interval == 0
+        mode = "isolated" if isolated else "shared"
+        report(f"{mode}, decided by the env", latencies[decided])
+        report(f"{mode}, answered by the server", latencies[~decided])
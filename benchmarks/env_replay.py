@@ -0,0 +1,73 @@
+"""
+Steps per second of CongestionControlEnv, end to end through the gRPC
+server, on the same replayed states every episode, see
+simulator.network.ReplayNetwork, to catch performance regressions of the
+hot path of the env.
+
+The states are simulated, or taken from an episode of --recording, and sent
+as soon as the previous one is answered. A fixed action is taken every step,
+so every episode goes through the same steps: the benchmark fails, with a
+non-zero exit code, when their returns differ. The step latency histograms
+of the env are printed for the last episode.
+
+Run from the project's root folder: python -m benchmarks.env_replay
+"""
+import argparse
+import logging
+import pprint
+import sys
+import time
+
+import numpy as np
+
+from envs.env import CongestionControlEnv
+from grpc_server.channels import QUEUE_TRANSPORT, TRANSPORTS
+
+# The env logs every episode at the INFO level
+logging.getLogger().setLevel(logging.WARNING)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--episodes", type=int, default=3)
+    parser.add_argument("--states", type=int, default=1000)
+    parser.add_argument("--recording", type=str, default=None)
+    parser.add_argument("--episode", type=int, default=0)
+    parser.add_argument("--transport", type=str, default=QUEUE_TRANSPORT, choices=TRANSPORTS)
+    parser.add_argument("--history-horizon", type=int, default=None)
+    parser.add_argument("--normalize", action="store_true")
+    parser.add_argument("--decision-interval", type=int, default=None)
+    parser.add_argument("--port", type=int, default=50085)
+
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    env = CongestionControlEnv(
+        network_backend="replay", grpc_port=args.port, max_time_steps_per_episode=args.states,
+        simulator_kwargs=dict(recording=args.recording, episode=args.episode, states=args.states),
+        transport=args.transport, history_horizon=args.history_horizon, normalize_observations=args.normalize,
+        decision_interval=args.decision_interval, persistent_server=True, step_timing=True)
+
+    returns = []
+    print(f"{'episode':<10}{'steps':>8}{'steps/s':>10}{'return':>14}")
+    for episode in range(args.episodes):
+        env.reset()
+        steps, episode_return, done = 0, 0.0, False
+        start = time.perf_counter()
+        while not done:
+            _, reward, done, info = env.step(np.array([0.01]))
+            steps += 1
+            episode_return += reward
+        elapsed = time.perf_counter() - start
+        returns.append(episode_return)
+        print(f"{episode:<10}{steps:>8}{steps / elapsed:>10.0f}{episode_return:>14.6f}")
+    print("Step latency of the last episode (us):")
+    pprint.pprint(info.get('step_latency'))
+    env.reset()
+    env.close()
+
+    if not np.allclose(returns, returns[0]):
+        print(f"Returns differ between episodes: {returns}")
+        sys.exit(1)
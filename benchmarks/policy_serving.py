@@ -0,0 +1,194 @@
+"""
+Decision latency of the NumPy policy served inside the gRPC server, see
+grpc_server.policy_server, against the torch policy answering the states
+the server publishes on its channels, as the env loop does. Parity of the
+actions of both is tested in tests/test_policy_parity.py.
+
+Without --model a SAC actor with net_arch=[400, 300] and random weights is
+used, with a history horizon of 10 and random normalization statistics.
+
+A client process plays Mockets: it sends a state, waits for its action and
+measures the round trip.
+
+Run from the project's root folder: python -m benchmarks.policy_serving
+"""
+import argparse
+import logging
+import multiprocessing
+import os
+import tempfile
+import time
+from multiprocessing import Process
+
+import gym
+import numpy as np
+import torch
+from stable_baselines3 import SAC
+
+import grpc_server.congestion_control_server as cc_server
+import grpc_server.policy_server as policy_server
+from envs.utils.features import OBSERVATION_LENGTH
+from envs.utils.history import RunningNormalizer
+from grpc_server import state_record
+from grpc_server.channels import SHARED_MEMORY_TRANSPORT, TRANSPORTS, make_channel
+
+logging.basicConfig(level=logging.WARNING)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--model", type=str, default=None)
+    parser.add_argument("--normalization", type=str, default=None)
+    parser.add_argument("--history-horizon", type=int, default=10)
+    parser.add_argument("--states", type=int, default=2000)
+    parser.add_argument("--transport", type=str, default=SHARED_MEMORY_TRANSPORT,
+                        choices=TRANSPORTS)
+    parser.add_argument("--port", type=int, default=50073)
+
+    return parser.parse_args()
+
+
+class SpacesEnv(gym.Env):
+    """Only carries the spaces of CongestionControlEnv to build a model"""
+
+    def __init__(self, observation_length):
+        self.observation_space = gym.spaces.Box(low=-float("inf"), high=float("inf"),
+                                                shape=(observation_length,))
+        self.action_space = gym.spaces.Box(low=-1, high=+1, shape=(1,), dtype=np.float32)
+
+
+def random_policy(history_horizon, path):
+    """Random SAC actor and normalization exported to path"""
+    observation_length = OBSERVATION_LENGTH if history_horizon is None \
+        else history_horizon * (OBSERVATION_LENGTH + 1)
+    torch.manual_seed(0)
+    model = SAC("MlpPolicy", SpacesEnv(observation_length), buffer_size=1,
+                policy_kwargs=dict(net_arch=[400, 300]), device="cpu")
+    rng = np.random.default_rng(0)
+    normalizer = RunningNormalizer(observation_length)
+    normalizer.mean = rng.normal(0, 10, observation_length)
+    normalizer.var = rng.uniform(1, 100, observation_length)
+    policy = policy_server.ServedPolicy(policy_server.NumpyActor.from_sac(model), history_horizon,
+                                        normalizer=normalizer)
+    policy.save(path)
+
+    return model
+
+
+def forward_latencies(function, observations):
+    latencies = np.zeros(len(observations))
+    for index, observation in enumerate(observations):
+        start = time.perf_counter()
+        function(observation)
+        latencies[index] = time.perf_counter() - start
+    return latencies * 1e6
+
+
+def client(port, states, results):
+    """Plays Mockets: send a state once the previous one is answered"""
+    import queue
+
+    import grpc
+    from protos import congestion_control_pb2, congestion_control_pb2_grpc
+
+    rng = np.random.default_rng(2)
+    answered = queue.Queue()
+    round_trips = np.zeros(states)
+
+    def requests():
+        for index in range(states):
+            status = congestion_control_pb2.CommunicationState(
+                curr_window_size=float(rng.integers(10, 100)),
+                sent_bytes_timeframe=float(rng.integers(0, 100)),
+                acked_bytes_timeframe=float(rng.integers(0, 100)),
+                last_rtt=float(rng.integers(10, 200)),
+                timestamp=1000 + 20 * index)
+            start = time.perf_counter()
+            yield status
+            answered.get()
+            round_trips[index] = time.perf_counter() - start
+
+    with grpc.insecure_channel(f"localhost:{port}") as channel:
+        stub = congestion_control_pb2_grpc.CongestionControlStub(channel)
+        for action in stub.OptimizeCongestionControl(requests(), wait_for_ready=True):
+            answered.put(action)
+    results.put(round_trips * 1e6)
+
+
+def measure_client(port, states):
+    context = multiprocessing.get_context("spawn")
+    results = context.Queue()
+    client_process = context.Process(target=client, args=(port, states, results), daemon=True)
+    client_process.start()
+    return client_process, results
+
+
+def embedded_latencies(policy_path, port, states):
+    server = Process(target=policy_server.run, args=(policy_path, port), daemon=True)
+    server.start()
+    client_process, results = measure_client(port, states)
+    round_trips = results.get(timeout=300)
+    client_process.join()
+    server.terminate()
+    server.join()
+
+    return round_trips
+
+
+def env_loop_latencies(model, policy, transport, port, states):
+    """Server publishing states on its channels, answered with torch here"""
+    state_channel = make_channel(transport, state_record.RECORD_WIDTH)
+    action_channel = make_channel(transport, 3)
+    server = Process(target=cc_server.run, args=(action_channel, state_channel, port), daemon=True)
+    server.start()
+    client_process, results = measure_client(port, states)
+
+    builder = policy_server.ObservationBuilder(policy)
+    action, _ = model.predict(builder.reset(), deterministic=True)
+    for index in range(states):
+        record = state_channel.get(timeout=30)
+        builder.update(record)
+        if index > 0:
+            action, _ = model.predict(builder.observation(action), deterministic=True)
+        action_channel.put((record[state_record.STREAM_ID], record[state_record.SEQUENCE],
+                            builder.cwnd(action)))
+
+    round_trips = results.get(timeout=300)
+    client_process.join()
+    server.terminate()
+    server.join()
+    state_channel.close()
+    action_channel.close()
+
+    return round_trips
+
+
+def report(name, latencies):
+    # The first decisions warm up the connection and the caches
+    latencies = latencies[len(latencies) // 10:]
+    print(f"{name:<30}{latencies.mean():>10.1f}{np.percentile(latencies, 50):>10.1f}"
+          f"{np.percentile(latencies, 99):>10.1f}")
+
+
+if __name__ == "__main__":
+    args = parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        policy_path = os.path.join(directory, "policy.npz")
+        if args.model is None:
+            model = random_policy(args.history_horizon, policy_path)
+        else:
+            policy_server.export(args.model, policy_path, args.normalization, args.history_horizon)
+            model = SAC.load(args.model, device="cpu")
+        policy = policy_server.ServedPolicy.load(policy_path)
+
+        observations = np.random.default_rng(3).normal(
+            0, 3, (args.states, policy.actor.observation_length)).astype(np.float32)
+        print(f"{'latency (us)':<30}{'mean':>10}{'p50':>10}{'p99':>10}")
+        report("torch forward", forward_latencies(
+            lambda observation: model.predict(observation, deterministic=True), observations))
+        report("numpy forward", forward_latencies(policy.actor, observations))
+        report("env loop + torch round trip",
+               env_loop_latencies(model, policy, args.transport, args.port, args.states))
+        report("embedded numpy round trip",
+               embedded_latencies(policy_path, args.port + 1, args.states))
@@ -0,0 +1,129 @@
+"""
+Latency from the start of an episode to its first state reaching the env,
+with a gRPC server started every episode, as CongestionControlEnv does by
+default, and with a persistent server receiving a new stream per episode.
+
+A client process plays Mockets: every episode it opens a new connection and
+sends one CommunicationState. The cost of launching Mockets itself is the
+same in both modes and left out.
+
+Run from the project's root folder: python -m benchmarks.reset_latency
+"""
+import argparse
+import logging
+import multiprocessing
+import time
+from multiprocessing import Process
+
+import numpy as np
+
+import grpc_server.congestion_control_server as cc_server
+from grpc_server import state_record
+from grpc_server.channels import QUEUE_TRANSPORT, TRANSPORTS, make_channel
+
+logging.basicConfig(level=logging.WARNING)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--episodes", type=int, default=20)
+    parser.add_argument("--transport", type=str, default=QUEUE_TRANSPORT,
+                        choices=TRANSPORTS)
+    parser.add_argument("--port", type=int, default=50071)
+
+    return parser.parse_args()
+
+
+def client(commands):
+    """Plays Mockets: one connection and one state per command"""
+    import grpc
+    from protos import congestion_control_pb2, congestion_control_pb2_grpc
+
+    # Retry quickly while a new server is binding the port
+    options = [("grpc.initial_reconnect_backoff_ms", 5),
+               ("grpc.min_reconnect_backoff_ms", 5),
+               ("grpc.max_reconnect_backoff_ms", 5)]
+    status = congestion_control_pb2.CommunicationState(timestamp=1000)
+    for port in iter(commands.get, None):
+        with grpc.insecure_channel(f"localhost:{port}", options) as channel:
+            stub = congestion_control_pb2_grpc.CongestionControlStub(channel)
+            try:
+                for _ in stub.OptimizeCongestionControl(iter([status]),
+                                                        wait_for_ready=True):
+                    pass
+            except grpc.RpcError:
+                # The server of the episode was stopped before answering
+                pass
+
+
+def start_server(transport, port):
+    state_channel = make_channel(transport, state_record.RECORD_WIDTH)
+    action_channel = make_channel(transport, 3)
+    process = Process(target=cc_server.run,
+                      args=(action_channel, state_channel, port),
+                      daemon=True)
+    process.start()
+
+    return process, state_channel, action_channel
+
+
+def stop_server(process, state_channel, action_channel):
+    process.terminate()
+    process.join()
+    process.close()
+    state_channel.close()
+    action_channel.close()
+
+
+def first_state(commands, port, state_channel, action_channel,
+                stale_stream_id):
+    """Start a connection and answer its first state, dropping stale ones"""
+    commands.put(port)
+    while True:
+        record = state_channel.get(timeout=30)
+        if record[state_record.STREAM_ID] > stale_stream_id:
+            break
+    stream_id = int(record[state_record.STREAM_ID])
+    action_channel.put((stream_id, record[state_record.SEQUENCE], 1444))
+
+    return stream_id
+
+
+def measure(commands, transport, port, episodes, persistent):
+    latencies = np.zeros(episodes)
+    server = None
+    stream_id = 0
+    for episode in range(episodes):
+        start = time.perf_counter()
+        if server is None or not persistent:
+            if server is not None:
+                stop_server(*server)
+            server = start_server(transport, port)
+            stream_id = 0
+        stream_id = first_state(commands, port, *server[1:], stream_id)
+        latencies[episode] = time.perf_counter() - start
+    stop_server(*server)
+
+    # The first episode starts the server in both modes
+    return latencies[1:] * 1e3
+
+
+if __name__ == "__main__":
+    args = parse_args()
+
+    commands = multiprocessing.get_context("spawn").Queue()
+    client_process = multiprocessing.get_context("spawn").Process(
+        target=client, args=(commands,), daemon=True)
+    client_process.start()
+
+    print(f"{'server':<15}{'mean ms':>10}{'p50 ms':>10}{'max ms':>10}")
+    for persistent in (False, True):
+        latencies = measure(commands, args.transport, args.port,
+                            args.episodes, persistent)
+        print(f"{'persistent' if persistent else 'per episode':<15}"
+              f"{latencies.mean():>10.1f}"
+              f"{np.percentile(latencies, 50):>10.1f}"
+              f"{latencies.max():>10.1f}")
+
+    commands.put(None)
+    client_process.join()
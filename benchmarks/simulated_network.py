@@ -0,0 +1,85 @@
+"""
+Speed of CongestionControlEnv on the simulated network, see simulator, and
+what a fixed window gets out of the simulated bottleneck.
+
+Every episode holds one window, from a few packets to well past the
+bandwidth-delay product of the starting link, with the action the env turns
+into that window. The goodput should grow with the window up to the capacity
+left by the cross-traffic, and the RTT with the queue once the window is
+past it. Simulated seconds per wall clock second are reported along with the
+steps per second.
+
+Run from the project's root folder: python -m benchmarks.simulated_network
+"""
+import argparse
+import logging
+import time
+
+import numpy as np
+
+from envs.env import CongestionControlEnv
+from envs.utils import constants
+from envs.utils.constants import State
+from envs.utils.features import STATE_INDEX
+
+# The env logs every episode at the INFO level
+logging.getLogger().setLevel(logging.WARNING)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--steps", type=int, default=300)
+    parser.add_argument("--windows-kb", type=float, nargs="+", default=[5, 15, 25, 50, 100])
+    parser.add_argument("--bandwidth", type=float, default=1.0)
+    parser.add_argument("--delay", type=float, default=100)
+    parser.add_argument("--loss", type=float, default=0)
+    parser.add_argument("--interval-ms", type=int, default=100)
+    parser.add_argument("--no-cross-traffic", action="store_true")
+    parser.add_argument("--port", type=int, default=50081)
+
+    return parser.parse_args()
+
+
+def action_for(env, cwnd):
+    """Action moving the current window of the env to cwnd bytes"""
+    current = env.last_state[STATE_INDEX[State.CURR_WINDOW_SIZE]] * constants.UNIT_FACTOR
+    if current == 0:
+        return np.zeros(1)
+    return np.clip([cwnd / current - 1], -1, 1)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    env = CongestionControlEnv(
+        network_backend="simulator", grpc_port=args.port, max_time_steps_per_episode=args.steps,
+        timestamp_interval_ms=args.interval_ms, bandwidth_start=args.bandwidth, delay_start=args.delay,
+        loss_start=args.loss, bandwidth_var=args.bandwidth, delay_var=args.delay, loss_var=args.loss,
+        variation_interval_test=args.steps * args.interval_ms, persistent_server=True,
+        simulator_kwargs=dict(cross_traffic=not args.no_cross_traffic))
+
+    bdp_kb = args.bandwidth * 125 * 2 * args.delay / constants.UNIT_FACTOR
+    print(f"{args.bandwidth} Mbps, {args.delay} ms delay, {args.loss}% loss, BDP {bdp_kb:.1f} KB")
+    print(f"{'window (KB)':<14}{'steps/s':>10}{'sim s/s':>10}{'goodput KB/s':>14}{'srtt ms':>10}{'retransmissions':>17}")
+    for window_kb in args.windows_kb:
+        env.reset()
+        goodput, srtt, retransmissions = [], [], 0
+        start = time.perf_counter()
+        first_timestamp = None
+        done = False
+        while not done:
+            _, _, done, info = env.step(action_for(env, window_kb * constants.UNIT_FACTOR))
+            if first_timestamp is None:
+                first_timestamp = env.previous_timestamp
+            statistics = info['current_statistics']
+            goodput.append(statistics.goodput)
+            srtt.append(statistics.srtt)
+            retransmissions += statistics.retransmissions
+        elapsed = time.perf_counter() - start
+        simulated = env.previous_timestamp - first_timestamp
+        # Leave the first quarter of the episode out, the window is reached
+        # and the queue builds up meanwhile
+        steady = len(goodput) // 4
+        print(f"{window_kb:<14g}{len(goodput) / elapsed:>10.0f}{simulated / elapsed:>10.1f}"
+              f"{np.mean(goodput[steady:]):>14.1f}{np.mean(srtt[steady:]):>10.0f}{retransmissions:>17.0f}")
+    env.reset()
+    env.close()
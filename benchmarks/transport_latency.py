@@ -0,0 +1,101 @@
+"""
+Round-trip latency of a state/action exchange between the server and the env
+process for each transport, mimicking what CongestionControlService and
+CongestionControlEnv do with every CommunicationState.
+
+Run from the project's root folder: python -m benchmarks.transport_latency
+"""
+import argparse
+import logging
+import time
+from multiprocessing import Process, Queue
+
+import numpy as np
+
+from envs.utils.constants import Parameters
+from grpc_server import state_record
+from grpc_server.channels import TRANSPORTS, make_channel
+from protos import congestion_control_pb2
+
+logging.basicConfig(level=logging.INFO)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--messages", type=int, default=20000)
+    parser.add_argument("--rates", type=float, nargs="+",
+                        default=[0, 10000, 1000],
+                        help="States per second, 0 sends back to back")
+    parser.add_argument("--transports", type=str, nargs="+",
+                        default=list(TRANSPORTS))
+    parser.add_argument("--capacity", type=int, default=64)
+
+    return parser.parse_args()
+
+
+def server(state_channel, action_channel, messages, rate, results):
+    """Plays the servicer: publish a state and wait for its action"""
+    status = congestion_control_pb2.CommunicationState()
+    interval = 1 / rate if rate > 0 else 0
+    round_trips = np.zeros(messages)
+
+    next_send = time.perf_counter()
+    for i in range(messages):
+        status.timestamp = i
+        start = time.perf_counter()
+        state_channel.put(state_record.decode(status))
+        action = int(action_channel.get()[0])
+        round_trips[i] = time.perf_counter() - start
+
+        if interval:
+            next_send += interval
+            while time.perf_counter() < next_send:
+                pass
+
+    results.put(round_trips)
+
+
+def env(state_channel, action_channel, messages):
+    """Plays the env: fetch a state and answer with an action"""
+    timestamp = state_record.OFFSET[Parameters.TIMESTAMP]
+    record = np.zeros(state_record.RECORD_WIDTH)
+    for _ in range(messages):
+        record[:] = state_channel.get(timeout=30)
+        action_channel.put((int(record[timestamp]),))
+
+
+def measure(transport, messages, rate, capacity):
+    state_channel = make_channel(transport, state_record.RECORD_WIDTH, capacity)
+    action_channel = make_channel(transport, 1, capacity)
+    results = Queue()
+
+    process = Process(target=server,
+                      args=(state_channel, action_channel,
+                            messages, rate, results))
+    process.start()
+    env(state_channel, action_channel, messages)
+    round_trips = results.get()
+    process.join()
+
+    state_channel.close()
+    action_channel.close()
+
+    # Skip warm up exchanges
+    return round_trips[len(round_trips) // 10:] * 1e6
+
+
+if __name__ == "__main__":
+    args = parse_args()
+
+    print(f"{'transport':<15}{'rate/s':>10}{'mean us':>10}{'p50 us':>10}"
+          f"{'p99 us':>10}{'p99.9 us':>10}")
+    for rate in args.rates:
+        for transport in args.transports:
+            round_trips = measure(transport, args.messages, rate,
+                                  args.capacity)
+            print(f"{transport:<15}"
+                  f"{'max' if rate == 0 else int(rate):>10}"
+                  f"{round_trips.mean():>10.1f}"
+                  f"{np.percentile(round_trips, 50):>10.1f}"
+                  f"{np.percentile(round_trips, 99):>10.1f}"
+                  f"{np.percentile(round_trips, 99.9):>10.1f}")
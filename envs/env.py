@@ -1,7 +1,9 @@
 import time
-from multiprocessing import Queue, Process
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing import Process
 import queue
 import os
+from typing import Optional
 import numpy as np
 import logging
 from gym import Env
@@ -9,15 +11,28 @@ from gym.spaces import Box
 from stable_baselines3.common.type_aliases import GymObs, GymStepReturn
 
 import grpc_server.congestion_control_server as cc_server
+from grpc_server import state_record
+from grpc_server.backpressure import BLOCK, POLICIES
+from grpc_server.fallback import DISCARD, FALLBACKS, HOLD, LATE_ACTIONS
+from grpc_server.interpolation import INTERPOLATIONS
+from grpc_server.channels import QUEUE_TRANSPORT, make_channel
+from grpc_server.tracing import ENV_TRACE_DTYPE, TraceWriter, now_us
 from envs.utils import constants
 import math
 from envs.utils.constants import Parameters, State,Statistic
+from envs.utils.features import OBSERVATION_LENGTH, STATE_INDEX, StateRecord, record_features
+from envs.utils.history import ObservationHistory, RunningNormalizer
+from envs.utils.isolation import isolate
+from envs.utils.recorder import EpisodeRecorder
+from envs.utils.reward import start_traffic, step_reward, target_goodput, varied_traffic
+from envs.utils.statistics import StreamingStatistics
+from envs.utils.timing import StageTimer
+from simulator.network import CONTAINERNET, NETWORK_BACKENDS, make_network
 
 import pprint
 import docker
 import netifaces as ni
 import rpyc
-from statistics import fmean, stdev
 
 logging.basicConfig(level=logging.INFO)
 
@@ -26,10 +41,6 @@ def writable_bytes(cwnd: float, inflight_bytes: float) -> float:
     return cwnd - inflight_bytes
 
 
-def throughput(sent_bytes: float, delta: float) -> float:
-    return sent_bytes if delta == 0 else sent_bytes/delta
-
-
 def exponential_moving_average(current_ema: float, value: float,
                                alpha=constants.ALPHA) -> float:
     if current_ema == 0.0:
@@ -38,11 +49,28 @@ def exponential_moving_average(current_ema: float, value: float,
         return (1 - alpha) * current_ema + alpha * value
 
 
-def _state_parameters_intersection():
-    parameters_values = set([parameter.value for parameter in Parameters])
-    state_values = set([state_parameter.value for state_parameter in State])
+# Precomputed rows of the state array
+_CURR_WINDOW_SIZE = STATE_INDEX[State.CURR_WINDOW_SIZE]
+_RETRANSMISSIONS = STATE_INDEX[State.RETRANSMISSIONS]
+_ACKED_BYTES_TIMEFRAME = STATE_INDEX[State.ACKED_BYTES_TIMEFRAME]
+
+# Offsets of the Mockets parameters in a state record
+_TIMESTAMP = state_record.OFFSET[Parameters.TIMESTAMP]
+_FINISHED = state_record.OFFSET[Parameters.FINISHED]
+_STREAM_ID = state_record.STREAM_ID
+_DROPPED_STATES = state_record.DROPPED_STATES
+_MERGED_STATES = state_record.MERGED_STATES
+_SEQUENCE = state_record.SEQUENCE
+_DEADLINE_MISSES = state_record.DEADLINE_MISSES
+_INTERMEDIATE = state_record.INTERMEDIATE
+_RECEIVED_US = state_record.RECEIVED_US
+_CLOCK_OFFSET = state_record.CLOCK_OFFSET
 
-    return parameters_values & state_values
+# Stages of a step timed when step_timing is enabled, "policy" is the time
+# spent outside the env between two steps
+STEP_STAGES = ("policy", "put_action", "variation_poll", "state_wait", "statistics", "reward", "observation")
+(_POLICY_STAGE, _PUT_ACTION_STAGE, _VARIATION_POLL_STAGE, _STATE_WAIT_STAGE,
+ _STATISTICS_STAGE, _REWARD_STAGE, _OBSERVATION_STAGE) = range(len(STEP_STAGES))
 
 
 def eval_or_train(is_testing):
@@ -56,7 +84,7 @@ class CongestionControlEnv(Env):
             mockets_server_ip: str = "10.0.2.1",
             grpc_port: int = 50051,
             mininet_port: int = 18861,
-            observation_length: int = len(State) * len(Statistic),
+            observation_length: int = OBSERVATION_LENGTH,
             is_testing: bool = False,
             max_duration: int = 80,
             max_time_steps_per_episode: int = 200,
@@ -71,17 +99,160 @@ class CongestionControlEnv(Env):
             variation_range_end: int = 20,
             variation_interval_test = 10,
             kbytes_testing = 500,
-            random_seed = 1
+            random_seed = 1,
+            statistics_window: int = None,
+            history_horizon: int = None,
+            normalize_observations: bool = False,
+            normalization_clip: float = 10.0,
+            normalization_path: str = None,
+            transport: str = QUEUE_TRANSPORT,
+            channel_capacity: int = 64,
+            persistent_server: bool = False,
+            warm_standby: bool = False,
+            backpressure: str = BLOCK,
+            state_buffer_size: int = 1,
+            action_deadline_ms: float = None,
+            fallback_action: str = HOLD,
+            late_actions: str = DISCARD,
+            step_timing: bool = False,
+            decision_interval: int = None,
+            decision_interval_ms: float = None,
+            interpolation: str = HOLD,
+            ramp_limit: float = 0.1,
+            adaptive_update_interval: bool = False,
+            min_update_interval_ms: int = 1,
+            max_update_interval_ms: int = 1000,
+            trace_path: str = None,
+            metrics_port: int = None,
+            server_cpus: str = None,
+            server_nice: int = None,
+            server_realtime_priority: int = None,
+            env_cpus: str = None,
+            env_nice: int = None,
+            torch_threads: int = None,
+            network_backend: str = CONTAINERNET,
+            simulator_kwargs: dict = None,
+            record_path: str = None,
+            record_chunk_rows: int = 65536,
+            mockets_sender_container: str = "mn.lh1",
+            mockets_receiver_container: str = "mn.rh1"
     ):
         """
         :param eps: the epsilon bound for correct value
         :param episode_length: the length of each episode in timesteps
         :param observation_lenght: the lenght of the observations
+        :param statistics_window: number of most recent samples the state
+            statistics are computed over, None for the whole episode
+        :param history_horizon: number of past observations and actions
+            stacked in each observation, same layout as the Zoo HistoryWrapper
+        :param normalize_observations: normalize the (stacked) observations
+            with running statistics, same as VecNormalize(norm_obs=True).
+            Unlike VecNormalize, the learner only sees normalized
+            observations: an off-policy algorithm stores them normalized
+            with the statistics of the time they were collected, where
+            VecNormalize stores the original ones and normalizes them again
+            with the current statistics when sampling. The original
+            observation is returned by get_original_obs() and as
+            "original_obs" in the info of every step
+        :param normalization_clip: absolute bound of normalized observations
+        :param normalization_path: file the normalization statistics are
+            saved to after every training episode and loaded from when testing
+        :param transport: how states and actions travel between the gRPC
+            server and the env, "queue" or "shared_memory"
+        :param channel_capacity: records held by shared memory channels
+        :param persistent_server: start the gRPC server once and keep it
+            across episodes, every Mockets connection being a new stream,
+            instead of starting a new server process every episode
+        :param warm_standby: prepare the next episode in the background as
+            soon as reset() is called, the Mockets processes and the link
+            are ready by the time its first step runs
+        :param backpressure: what the server does with the states Mockets
+            sends while the env is busy once state_buffer_size of them are
+            pending, "block", "drop_oldest" or "coalesce"
+        :param state_buffer_size: states buffered per stream by the server
+        :param action_deadline_ms: time the env has to answer a state before
+            the server sends a fallback action to Mockets, None to always wait
+        :param fallback_action: action sent when the deadline is missed,
+            "hold" the current window or apply an "aimd" step
+        :param late_actions: what to do with the action of a state answered
+            by a fallback, "discard" it or "apply" it as soon as it arrives
+        :param step_timing: record latency histograms of the stages of every
+            step, summarized in the info of the last step of an episode and
+            logged by report()
+        :param decision_interval: states per decision of the agent, the
+            server answers the states in between on its own, None to decide
+            on every state unless decision_interval_ms is set
+        :param decision_interval_ms: time between two decisions, the
+            interval ends with whichever of the two limits is reached first
+        :param interpolation: window the server sends between two
+            decisions, "hold" the last action, "interpolate" linearly towards
+            it or "ramp" towards it by at most ramp_limit of the window per
+            state. Every state of the interval updates the statistics and
+            its bytes and retransmissions count in the reward
+        :param ramp_limit: largest window change per state when ramping
+        :param adaptive_update_interval: let the server ask Mockets, through
+            the actions, for the shortest interval between states the agent
+            keeps up with, starting from timestamp_interval_ms
+        :param min_update_interval_ms: shortest interval the server asks for
+        :param max_update_interval_ms: longest interval the server asks for
+        :param trace_path: trace the hops of every state, the server writes
+            them to trace_path + ".server" and the env to trace_path +
+            ".env-<grpc_port>", see grpc_server.tracing
+        :param metrics_port: serve the Prometheus metrics of the gRPC server
+            process on http://127.0.0.1:<metrics_port>/metrics
+        :param server_cpus: CPUs the gRPC server process runs on, e.g. "0"
+            or "0-1", see envs.utils.isolation.parse_cpus
+        :param server_nice: nice level of the gRPC server process, negative
+            to run it before the env and the learner
+        :param server_realtime_priority: SCHED_FIFO priority of the gRPC
+            server process, from 1 to 99
+        :param env_cpus: CPUs the process of the env runs on, shared with
+            the learner stepping it
+        :param env_nice: nice level of the process of the env
+        :param torch_threads: intra-op threads of torch in the process of
+            the env, so the gradient updates leave the other cores alone
+        :param network_backend: network the flow runs on, "containernet",
+            "simulator", a fluid model of the sender and the bottleneck
+            needing no containers, see simulator.network.SimulatedNetwork,
+            or "replay", the same states every episode whatever the actions,
+            see simulator.network.ReplayNetwork. Without containers time
+            runs as fast as the agent answers, the link variation follows
+            the timestamps of the states
+        :param simulator_kwargs: parameters of the SimulatedNetwork, e.g.
+            queue_packets, action_delay_ms or cross_traffic, or of the
+            ReplayNetwork, e.g. recording and episode
+        :param record_path: record every state of every episode, with the
+            link, action, window and reward, to record_path + "/env-<grpc_port>",
+            see envs.utils.recorder
+        :param record_chunk_rows: states per chunk of the recording
+        :param mockets_sender_container: container running the Mockets sender
+        :param mockets_receiver_container: container running the Mockets
+            receiver
         """
         self.current_traffic_patterns = None
         self.action_space = Box(low=-1, high=+1, shape=(1,), dtype=np.float32)
         self.observation_space = Box(low=-float("inf"), high=float("inf"), shape=(observation_length, ))
 
+        self.history = None
+        if history_horizon is not None:
+            self.history = ObservationHistory(
+                history_horizon,
+                observation_length,
+                self.action_space.shape[0],
+                dtype=self.observation_space.dtype
+            )
+            self.observation_space = Box(low=-float("inf"), high=float("inf"), shape=(self.history.size, ))
+
+        self.normalizer = None
+        self.normalization_path = normalization_path
+        self._reset_normalization_updated = False
+        # Last observation before normalization
+        self._original_observation = None
+        if normalize_observations:
+            self.normalizer = RunningNormalizer(self.observation_space.shape, clip=normalization_clip)
+            if is_testing and normalization_path is not None:
+                self.normalizer.load(normalization_path)
+
         np.random.seed(random_seed)
         self.current_step = 0
         self.total_steps = 0
@@ -105,36 +276,125 @@ class CongestionControlEnv(Env):
         self.kbytes_testing = kbytes_testing
         self.previous_timestamp = 0
         self.timestamp_interval_ms = timestamp_interval_ms
-        self.mockets_raw_observations = dict((param, 0.0) for param in Parameters)
-        self.processed_observations_history = dict((param, [0.0]) for param in State)
-
-        self.state_statistics = dict((stats, dict((stat, 0.0) for stat in Statistic)) for stats in State)
-        self.last_state = dict((param, 0.0) for param in State)
+        # Last state record, see grpc_server.state_record, timestamp in seconds
+        self.mockets_raw_observations = np.zeros(state_record.RECORD_WIDTH)
+        self.statistics_window = statistics_window
+        self.state_statistics_engine = StreamingStatistics(len(State), window=statistics_window)
+
+        # Rows follow STATE_INDEX and columns STATISTIC_INDEX, the array is
+        # updated in place by the statistics engine
+        self.state_statistics = self.state_statistics_engine.statistics
+        self.last_state = np.zeros(len(State))
+        # States are written in place, cast to the observation space as
+        # DummyVecEnv stores them, reset() and step() return copies
+        self._state_buffer = np.zeros(observation_length, self.observation_space.dtype)
+        self._observation_length = observation_length
         self.acked_bytes = None
         self._mockets_receiver_ip = mockets_server_ip
 
         self.grpc_port = grpc_port
 
-        # Bind to Docker Client
-        self.docker_client = docker.from_env()
-        # Get containers
-        self.mockets_sender = self.docker_client.containers.get("mn.lh1")
-        self.mockets_receiver = self.docker_client.containers.get("mn.rh1")
-        self.bg_sender = self.docker_client.containers.get("mn.lh2")
-        self.bg_receiver = self.docker_client.containers.get("mn.rh2")
-        self.host_address = ni.ifaddresses('docker0')[ni.AF_INET][0]['addr']
-        self.mininet_connection = rpyc.connect(self.host_address, mininet_port)
-        self.timed_link_update = rpyc.async_(self.mininet_connection.root.timed_link_update)
+        if network_backend not in NETWORK_BACKENDS:
+            raise ValueError(f"Unknown network backend {network_backend}, choose one of {NETWORK_BACKENDS}")
+        self.network_backend = network_backend
+        # Stand-in for the topology when running without containers
+        self.local_network = None
+        if network_backend != CONTAINERNET:
+            self.local_network = make_network(network_backend, self._clock, **(simulator_kwargs or {}))
+            self.mininet = self.local_network
+            self.timed_link_update = self.local_network.timed_link_update
+        else:
+            # Bind to Docker Client
+            self.docker_client = docker.from_env()
+            # Get containers
+            self.mockets_sender = self.docker_client.containers.get(mockets_sender_container)
+            self.mockets_receiver = self.docker_client.containers.get(mockets_receiver_container)
+            self.bg_sender = self.docker_client.containers.get("mn.lh2")
+            self.bg_receiver = self.docker_client.containers.get("mn.rh2")
+            self.host_address = ni.ifaddresses('docker0')[ni.AF_INET][0]['addr']
+            self.mininet_connection = rpyc.connect(self.host_address, mininet_port)
+            self.mininet = self.mininet_connection.root
+            self.timed_link_update = rpyc.async_(self.mininet.timed_link_update)
         self.current_mice_flows_kbs = None
         # Prevent zombie Mockets/Mgen processes running on the container
         self.cleanup_containers()
 
         # Run server in a different process
         self._server_process = None
+        # Served by the hub of a CongestionControlVectorEnv instead
+        self._hub_attached = False
         # Observation queue where the server will publish
         self._state_queue = None
         # Action queue where the agent will publish the action
         self._action_queue = None
+        self.transport = transport
+        self.channel_capacity = channel_capacity
+        self.persistent_server = persistent_server
+        # Stream of the current Mockets connection, states of streams up to
+        # the stale one are left over by previous connections and dropped
+        self._stream_id = 0
+        self._stale_stream_id = 0
+        self.warm_standby = warm_standby
+        if backpressure not in POLICIES:
+            raise ValueError(f"Unknown backpressure policy {backpressure}, choose one of {POLICIES}")
+        self.backpressure = backpressure
+        self.state_buffer_size = state_buffer_size
+        if fallback_action not in FALLBACKS:
+            raise ValueError(f"Unknown fallback action {fallback_action}, choose one of {FALLBACKS}")
+        if late_actions not in LATE_ACTIONS:
+            raise ValueError(f"Unknown late actions policy {late_actions}, choose one of {LATE_ACTIONS}")
+        self.action_deadline_ms = action_deadline_ms
+        self.fallback_action = fallback_action
+        self.late_actions = late_actions
+        self.step_timer = StageTimer(STEP_STAGES) if step_timing else None
+        if decision_interval is not None and decision_interval < 1:
+            raise ValueError(f"Decision interval must be positive, got {decision_interval}")
+        if interpolation not in INTERPOLATIONS:
+            raise ValueError(f"Unknown interpolation {interpolation}, choose one of {INTERPOLATIONS}")
+        self.decision_interval = decision_interval
+        self.decision_interval_ms = decision_interval_ms
+        self.interpolation = interpolation
+        self.ramp_limit = ramp_limit
+        if adaptive_update_interval and not 1 <= min_update_interval_ms <= max_update_interval_ms:
+            raise ValueError(f"Invalid update interval range [{min_update_interval_ms}, {max_update_interval_ms}] ms")
+        self.adaptive_update_interval = adaptive_update_interval
+        self.min_update_interval_ms = min_update_interval_ms
+        self.max_update_interval_ms = max_update_interval_ms
+        # Acked bytes, retransmissions and number of the states received
+        # since the last decision
+        self._interval_acked_bytes = 0
+        self._interval_retransmissions = 0
+        self._interval_states = 0
+        self.trace_path = trace_path
+        self.metrics_port = metrics_port
+        self.server_cpus = server_cpus
+        self.server_nice = server_nice
+        self.server_realtime_priority = server_realtime_priority
+        if env_cpus is not None or env_nice is not None or torch_threads is not None:
+            isolate(env_cpus, env_nice, torch_threads=torch_threads, name="env")
+        self._trace = None if trace_path is None \
+            else TraceWriter(f"{trace_path}.env-{grpc_port}", ENV_TRACE_DTYPE)
+        self._recorder = None if record_path is None \
+            else EpisodeRecorder(os.path.join(record_path, f"env-{grpc_port}"), record_chunk_rows)
+        # Window of the action sent by the first half of the step
+        self._sent_cwnd = 0
+        # Time the last state was taken from the channel, only kept when
+        # tracing
+        self._state_dequeued_us = 0
+        # perf_counter_ns of the end of the last step and of the reception of
+        # the last state, only kept when timing steps
+        self._step_end_ns = None
+        self._state_received_ns = None
+        self._stage_start_ns = None
+        # Action sent by the first half of the step
+        self._sent_action = None
+        # Second half of a step started by step_async
+        self._pending_step = None
+        self._receiver_executor = None
+        # Preparation of the next episode running in the background
+        self._standby = None
+        self._standby_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='marlin_standby') \
+            if warm_standby else None
 
         self.parameter_fetch_error = False
         self._max_duration = max_duration
@@ -147,6 +407,8 @@ class CongestionControlEnv(Env):
         self.delay_var = delay_var
         self.loss_var = loss_var
         self.variation_pending = None
+        # Step the link variation was applied at, None until it is
+        self.variation_step = None
 
         self._traffic_timer = None
         self.episode_training_script = None
@@ -156,11 +418,40 @@ class CongestionControlEnv(Env):
         self.last_step_timestamp = None
 
 
-    def __del__(self):
+    def close(self):
         """Book-keeping to release resources"""
-        if self._server_process is not None:
+        self._wait_standby()
+        if self._trace is not None:
+            self._trace.flush()
+        if self._recorder is not None:
+            self._recorder.close()
+        self._stop_server()
+
+    def __del__(self):
+        self.close()
+
+    def _stop_server(self):
+        """Stop Mockets and the gRPC server, or detach from the hub"""
+        if self._has_server():
             self.cleanup_containers()
+            self._close_server()
+            self._hub_attached = False
+
+    def _has_server(self) -> bool:
+        return self._server_process is not None or self._hub_attached
+
+    def attach_to_hub(self, state_queue, action_queue):
+        """
+        Exchange states and actions with a gRPC server shared with other envs
+        instead of starting one, the server is kept across episodes
+        """
+        self._state_queue = state_queue
+        self._action_queue = action_queue
+        self._hub_attached = True
+        self.persistent_server = True
 
+    def _close_server(self):
+        if self._server_process is not None:
             logging.info("Closing GRPC Server...")
             self._server_process.terminate()
             self._server_process.join()
@@ -175,6 +466,10 @@ class CongestionControlEnv(Env):
         self.cleanup_mockets()
 
     def cleanup_mockets(self):
+        if self.local_network is not None:
+            self.local_network.stop_sender()
+            return
+
         shutdown_mockets = ['sh', '-c', "ps -ef | grep 'mockets' | grep -v grep | awk '{print $2}' | xargs -r kill -9"]
 
         logging.info(f"Closing process for {eval_or_train(self._is_testing)}")
@@ -204,95 +499,121 @@ class CongestionControlEnv(Env):
             target=cc_server.run,
             args=(self._action_queue,
                   self._state_queue,
-                  port), name='marlin_grpc')
+                  port) + self._server_settings(), name='marlin_grpc')
         self._server_process.daemon = True
         self._server_process.start()
 
+    def _server_settings(self) -> tuple:
+        """Arguments of cc_server.run following the port, times in seconds"""
+        return (self.backpressure,
+                self.state_buffer_size,
+                None if self.action_deadline_ms is None else self.action_deadline_ms / constants.UNIT_FACTOR,
+                self.fallback_action,
+                self.late_actions,
+                self.decision_interval,
+                None if self.decision_interval_ms is None else self.decision_interval_ms / constants.UNIT_FACTOR,
+                self.interpolation,
+                self.ramp_limit,
+                self.adaptive_update_interval,
+                self.timestamp_interval_ms,
+                self.min_update_interval_ms,
+                self.max_update_interval_ms,
+                self.trace_path,
+                self.metrics_port,
+                self.server_cpus,
+                self.server_nice,
+                self.server_realtime_priority)
+
     def _process_additional_params(self):
-        if self.previous_timestamp == 0:
-            delta = 0
-        else:
-            delta = self.mockets_raw_observations[Parameters.TIMESTAMP] - self.previous_timestamp
-
-        self.processed_observations_history[State.THROUGHPUT].append(throughput(
-            self.mockets_raw_observations[Parameters.SENT_BYTES_TIMEFRAME],
-            delta  # Throughput KB/Sec
-        ))
-        self.processed_observations_history[State.GOODPUT].append(throughput(
-            self.mockets_raw_observations[Parameters.ACKED_BYTES_TIMEFRAME],
-            delta  # Throughput KB/Sec
-        ))
-
-        # Every packet is 1KB so every KB in timeframe sent is also a packet
-        # sent
-        self.processed_observations_history[State.PACKETS_TRANSMITTED].append(
-            math.ceil(self.mockets_raw_observations[Parameters.SENT_BYTES_TIMEFRAME]/constants.PACKET_SIZE_KB)
-        )
+        # Statistics are updated in place with the newest sample
+        self.state_statistics_engine.update(self.last_state)
 
-        # Gather statistics from the observation history, dictionaries from
-        # observation history share the same first level key of state statistics
-        for key, value in self.processed_observations_history.items():
-            # Skip RTT Fetch if communication is finished and value was not
-            # computed
-            self.last_state[key] = value[-1]
-            self.state_statistics[key][Statistic.LAST] = value[-1]
-            self.state_statistics[key][Statistic.EMA] = \
-                exponential_moving_average(self.state_statistics[key][
-                                               Statistic.EMA], value[-1])
-            self.state_statistics[key][Statistic.MIN] = min(value[1:]) if len(value) > 2 else value[-1]
-            self.state_statistics[key][Statistic.MAX] = max(value[1:]) if len(value) > 2 else value[-1]
-            self.state_statistics[key][Statistic.MEAN] = fmean(value[1:]) if len(value) > 2 else value[-1]
-            self.state_statistics[key][Statistic.STD] = stdev(value[1:]) if len(value) > 2 else value[-1]
-            self.state_statistics[key][Statistic.DIFF] = value[-1] - value[-2] if len(value) > 2 else value[-1]
-
-    def _fetch_param_and_update_stats(self) -> int:
+    def _fetch_param_and_update_stats(self) -> Optional[float]:
+        """
+        Take the next state, None when none comes in time: the episode is
+        then truncated and Mockets restarted by the next reset(), on the
+        thread calling it, as this may run in the receiver thread of
+        step_async
+        """
         while True:
             try:
                 obs = self._state_queue.get(timeout=30)
             except queue.Empty as error:
                 logging.info(f"Parameter Fetch: Timeout occurred")
-                logging.info("Restarting Service!!")
+                logging.info("Ending the episode, Mockets is restarted on reset")
                 self.parameter_fetch_error = True
                 self.current_step = self.max_time_steps_per_episode
-                self._cleanup()
-                self._start_mockets_processes()
+                return None
             else:
+                if obs[_STREAM_ID] <= self._stale_stream_id:
+                    logging.debug(f"Dropping state of stale stream {int(obs[_STREAM_ID])}")
+                    continue
                 break
 
-        self.mockets_raw_observations = obs
-        self.mockets_raw_observations[Parameters.TIMESTAMP] /= constants.UNIT_FACTOR
-
-        for value in _state_parameters_intersection():
-            self.processed_observations_history[State(value)].append(self.mockets_raw_observations[Parameters(value)])
+        if self.step_timer is not None:
+            self._state_received_ns = time.perf_counter_ns()
+        if self._trace is not None:
+            self._state_dequeued_us = now_us()
+        self._stream_id = int(obs[_STREAM_ID])
+        self.mockets_raw_observations[:] = obs
+        if self._recorder is not None:
+            self._recorder.record_state(self.mockets_raw_observations, self.current_bandwidth,
+                                        self.current_delay, self.current_loss)
+        # Same features as the policy server and the dataset export
+        timestamp = record_features(self.mockets_raw_observations, self.previous_timestamp, self.last_state)
+        self.mockets_raw_observations[_TIMESTAMP] = timestamp
 
         # Return Timestamp in Seconds
-        return self.mockets_raw_observations[Parameters.TIMESTAMP]
+        return timestamp
 
     def _is_finished(self):
-        return self.mockets_raw_observations[Parameters.FINISHED] or (self._is_testing and self.acked_bytes >= self.kbytes_testing)
+        return self.mockets_raw_observations[_FINISHED] or (self._is_testing and self.acked_bytes >= self.kbytes_testing)
 
     def _get_state(self) -> np.array:
         logging.debug("FETCHING STATE..")
 
-        if not self._is_finished():
-            timestamp = self._fetch_param_and_update_stats()
-            self._process_additional_params()
-            self.acked_bytes += self.state_statistics[State.ACKED_BYTES_TIMEFRAME][Statistic.LAST]
-
-            self.previous_timestamp = timestamp
-
-            logging.debug(f"STATE: {self.state_statistics}")
+        # No state comes anymore once a fetch timed out, until the reset
+        if not self._is_finished() and not self.parameter_fetch_error:
+            self._interval_acked_bytes = 0
+            self._interval_retransmissions = 0
+            self._interval_states = 0
+            # States between two decisions were answered by the server, they
+            # are aggregated up to the next one to decide on
+            while True:
+                timestamp = self._fetch_param_and_update_stats()
+                if timestamp is None:
+                    break
+                self._process_additional_params()
+                self.acked_bytes += self.last_state[_ACKED_BYTES_TIMEFRAME]
+                self._interval_acked_bytes += self.last_state[_ACKED_BYTES_TIMEFRAME]
+                self._interval_retransmissions += self.last_state[_RETRANSMISSIONS]
+                self._interval_states += 1
+
+                self.previous_timestamp = timestamp
+                if not self.mockets_raw_observations[_INTERMEDIATE] or self._is_finished():
+                    break
+
+            # Formatting the statistics is costly, only done when debugging
+            logging.debug("STATE: %s", self.state_statistics)
         else:
             logging.debug("SKIPPING STATE FETCH")
 
-        return np.array([self.state_statistics[State(param.value)][Statistic(
-            stat.value)] for param in State for stat in Statistic])
+        # Statistics are laid out State-major as the observation
+        self._state_buffer[:] = self.state_statistics.reshape(-1)
+
+        return self._state_buffer
 
     def _next_state(self) -> np.array:
         return self._get_state()
 
     def _put_action(self, action):
-        self._action_queue.put(action)
+        sequence = self.mockets_raw_observations[_SEQUENCE]
+        if self._trace is not None:
+            self._trace.append(self._stream_id, int(sequence),
+                               int(self.mockets_raw_observations[_RECEIVED_US]),
+                               self._state_dequeued_us, now_us(), action)
+        # Tagged with the state it answers
+        self._action_queue.put((self._stream_id, sequence, action))
 
     def _get_reward(self) -> float:
         reward = self.reward()
@@ -303,7 +624,7 @@ class CongestionControlEnv(Env):
     # New CWND by throttle action return the amount of BYTES the CWND can be set
     def _cwnd_update_throttle(self, percentage) -> int:
         # New CWND in Bytes
-        current_cwnd = self.state_statistics[State.CURR_WINDOW_SIZE][Statistic.LAST]
+        current_cwnd = self.last_state[_CURR_WINDOW_SIZE]
         cwnd = math.ceil((current_cwnd + percentage * current_cwnd) * constants.UNIT_FACTOR)
 
         if cwnd < constants.PACKET_SIZE_KB * constants.UNIT_FACTOR:
@@ -314,6 +635,13 @@ class CongestionControlEnv(Env):
             return cwnd
 
     def _run_mockets_ep_client(self):
+        if self.local_network is not None:
+            self.local_network.start_sender(
+                self.grpc_port,
+                update_interval_ms=self.timestamp_interval_ms if self.timestamp_interval_ms > 0 else None,
+                episode_bytes=self.kbytes_testing * 1000 if self._is_testing else None)
+            return
+
         # Add logging
         logs = self._run_mockets_sender(self._mockets_receiver_ip,
                                         self.grpc_port,
@@ -329,6 +657,10 @@ class CongestionControlEnv(Env):
                 break
 
     def _run_mockets_receiver(self):
+        if self.local_network is not None:
+            # The local sender needs no receiver
+            return
+
         logging.info("Launching Mockets Receiver...")
         logs = self.mockets_receiver.exec_run(
             './bin/driver -m server '
@@ -343,35 +675,67 @@ class CongestionControlEnv(Env):
                 logging.info(f"Server ready to accept connections!")
                 break
 
+    def _clock(self) -> float:
+        """
+        Time of the reward and of the variation of a local network, in
+        seconds: the timestamp of the last state, so the rewards can be
+        computed again from a recording, see envs.utils.reward
+        """
+        return self.previous_timestamp
+
     def _init_background_traffic_timers(self):
-        instant = time.time()
+        instant = self._clock()
         self._traffic_timer = instant
         self.last_step_timestamp = instant
 
     def _cleanup(self):
         # You gotta clean your stuff sometimes
-        self.__del__()
+        if self.persistent_server and self._has_server():
+            # Keep the server, only the Mockets connection is closed
+            self.cleanup_containers()
+            self._stale_stream_id = self._stream_id
+        else:
+            self._stop_server()
+
+    def _start_server(self):
+        self._state_queue = make_channel(self.transport, state_record.RECORD_WIDTH, self.channel_capacity)
+        # Actions are (stream id, sequence, cwnd) records
+        self._action_queue = make_channel(self.transport, 3, self.channel_capacity)
+        # A new server numbers its streams from 1
+        self._stream_id = 0
+        self._stale_stream_id = 0
+
+        self._run_grpc_server(self.grpc_port)
 
     def _start_mockets_processes(self, reset_time=True):
         logging.info("-------------------------------------")
         logging.info(f"STARTED EPISODE {self.num_resets} {eval_or_train(self._is_testing)}")
-        self._state_queue = Queue()
-        self._action_queue = Queue()
-
-        self._run_grpc_server(self.grpc_port)
+        if not self._has_server():
+            self._start_server()
         self._run_mockets_receiver()
         self._run_mockets_ep_client()
 
         logging.info(f"Current variation at {self.variation_interval}s")
         logging.info("All commands executed. Episode started!")
 
+    def statistics_summary(self) -> dict:
+        """State statistics keyed by State and Statistic, for logging"""
+        return dict(
+            (state, dict(zip(Statistic, self.state_statistics[row].tolist())))
+            for state, row in STATE_INDEX.items()
+        )
+
     def report(self):
         time_taken = time.time() - self.episode_start_time
         logging.info(f"EPISODE {self.num_resets} {eval_or_train(self._is_testing)} COMPLETED")
-        logging.info(f"Stats: {pprint.pformat(self.state_statistics)}")
+        logging.info(f"Stats: {pprint.pformat(self.statistics_summary())}")
         logging.info(f"Steps taken during episode: {self.current_step}")
         logging.info(f"Return accumulated: {self.episode_return}")
         logging.info(f"Acked bytes since beginning: {self.acked_bytes}")
+        logging.info(f"Action deadlines missed: {int(self.mockets_raw_observations[_DEADLINE_MISSES])}")
+        logging.info(f"Clock offset from Mockets: {self.mockets_raw_observations[_CLOCK_OFFSET]} ms")
+        if self.step_timer is not None:
+            logging.info(f"Step latency: {pprint.pformat(self.step_timer.summary())}")
         logging.info(f"Time taken: {time_taken}")
         logging.info("-------------------------------------")
 
@@ -380,19 +744,88 @@ class CongestionControlEnv(Env):
             with open(f"logs/evaluation_time.log",
                       "w+") as log:
                 log.write(str(time_taken))
+        elif self.normalizer is not None and self.normalization_path is not None:
+            logging.info("Saving Normalization Statistics")
+            self.normalizer.save(self.normalization_path)
+
+        if self._trace is not None:
+            self._trace.flush()
+        if self._recorder is not None:
+            self._recorder.end_episode(dict(
+                episode_return=float(self.episode_return),
+                acked_kbytes=float(self.acked_bytes or 0),
+                deadline_misses=int(self.mockets_raw_observations[_DEADLINE_MISSES]),
+                parameter_fetch_error=self.parameter_fetch_error,
+                variation_step=self.variation_step,
+            ))
+
+    def _episode_metadata(self) -> dict:
+        """Settings of the episode starting, kept in the index of the recording"""
+        return dict(
+            env_episode=self.num_resets,
+            is_testing=self._is_testing,
+            network_backend=self.network_backend,
+            start_time=time.time(),
+            link_start=[self.bandwidth_start, self.delay_start, self.loss_start],
+            link_variation=[self.bandwidth_var, self.delay_var, self.loss_var],
+            variation_interval=self.variation_interval,
+            traffic_patterns=[float(rate) for rate in self.current_traffic_patterns],
+            mice_flows_kbs=float(self.current_mice_flows_kbs),
+            timestamp_interval_ms=self.timestamp_interval_ms,
+            decision_interval=self.decision_interval,
+            decision_interval_ms=self.decision_interval_ms,
+            kbytes_testing=self.kbytes_testing if self._is_testing else None,
+            statistics_window=self.statistics_window,
+            history_horizon=None if self.history is None else self.history.horizon,
+        )
+
+    def _prepare_episode(self):
+        """Restart Mockets and set the link of the next episode, run in the background"""
+        self.cleanup_containers()
+        self._set_start_link()
+        self._run_mockets_receiver()
+        self._run_mockets_ep_client()
+        logging.info(f"Episode {self.num_resets} on standby")
+
+    def _wait_standby(self):
+        if self._standby is not None:
+            standby, self._standby = self._standby, None
+            standby.result()
+
+    def _set_start_link(self):
+        self.mininet.manual_link_update(
+            bandwidth=self.current_bandwidth,
+            delay=f"{self.current_delay}ms",
+            loss=self.current_loss
+        )
 
     def reset(self) -> GymObs:
+        if self._pending_step is not None:
+            # Let the step in flight finish before tearing its episode down
+            self.step_wait()
         self.report()
-        self._cleanup()
-
-        self.mockets_raw_observations = dict((param, 0.0) for param in Parameters)
-        self.processed_observations_history = dict((param, [0.0]) for param in State)
-        self.state_statistics = dict((stats, dict((stat, 0.0) for stat in Statistic)) for stats in State)
-        self.last_state = dict((param, 0.0) for param in State)
+        self._wait_standby()
+        if not self.warm_standby:
+            self._cleanup()
+        elif self.persistent_server and self._has_server():
+            self._stale_stream_id = self._stream_id
+        else:
+            # Mockets is killed by the standby preparation, only the server
+            # has to be replaced here
+            self._close_server()
+            self._start_server()
+
+        self.mockets_raw_observations.fill(0.0)
+        self.state_statistics_engine.reset()
+        self.last_state.fill(0.0)
+        if self.step_timer is not None:
+            self.step_timer.reset()
+            self._step_end_ns = None
 
         self.parameter_fetch_error = False
 
         self.current_step = 0
+        self.variation_step = None
         self.num_resets += 1
         self.episode_return = 0
         self.target_episode = 0
@@ -401,54 +834,73 @@ class CongestionControlEnv(Env):
         self.current_bandwidth = self.bandwidth_start
         self.current_delay = self.delay_start
         self.current_loss = self.loss_start
-        self.mininet_connection.root.manual_link_update(
-            bandwidth=self.current_bandwidth,
-            delay=f"{self.current_delay}ms",
-            loss=self.current_loss
-        )
+        if self.warm_standby:
+            self._standby = self._standby_executor.submit(self._prepare_episode)
+        else:
+            self._set_start_link()
         self.variation_interval = self.variation_interval_test
 
-        initial_state = np.array(
-            [
-                self.state_statistics[State(param.value)][Statistic(stat.value)]
-                for param in State for stat in Statistic
-            ]
-        )
+        initial_state = self._observation(np.zeros(self._observation_length), None, False)
         self.acked_bytes = 0
-        self.current_mice_flows_kbs = self.bandwidth_start * .08
-        self.current_traffic_patterns = [
-            self.bandwidth_start * 125  * .4,
-            self.bandwidth_start * 125  * .8,
-            self.bandwidth_start * 125  * .4,
-            self.bandwidth_start * 125  * .208
-        ]
+        self.current_mice_flows_kbs, self.current_traffic_patterns = start_traffic(self.bandwidth_start)
         logging.info("Traffic patterns: " + str(self.current_traffic_patterns))
 
         return initial_state
 
+    def _observation(self, state: np.ndarray, action, terminated: bool) -> np.ndarray:
+        """Stack and normalize the state if requested, action is None on reset"""
+        observation = state
+        if self.history is not None:
+            if action is None:
+                observation = self.history.reset(state)
+            else:
+                observation = self.history.append(state, action)
+
+        if self.normalizer is not None:
+            self._original_observation = observation
+            if not self._is_testing:
+                self._update_normalization(observation, action is None, terminated)
+            observation = self.normalizer.normalize(observation)
+
+        # The stacking and normalization outputs and the state are buffers
+        # written again by the next steps, the caller may keep observations
+        return observation.copy()
+
+    def get_original_obs(self) -> Optional[np.ndarray]:
+        """
+        Copy of the last observation returned by reset() or step() before
+        normalization, as VecNormalize.get_original_obs(), None unless
+        normalize_observations
+        """
+        if self._original_observation is None:
+            return None
+        return self._original_observation.astype(self.observation_space.dtype)
+
+    def _update_normalization(self, observation, is_reset, terminated):
+        if is_reset:
+            if not self._reset_normalization_updated:
+                self.normalizer.update(observation)
+            self._reset_normalization_updated = False
+        elif terminated:
+            # VecNormalize never sees terminal observations, it updates with
+            # the following reset one, always zeros, before normalizing them
+            self.normalizer.update(0.0)
+            self._reset_normalization_updated = True
+        else:
+            self.normalizer.update(observation)
+
     def reward(self):
-        elapsed_time_in_period = float(time.time() - self._traffic_timer) % 8
-        current_bandwidth_kbs = self.current_bandwidth * 125
-        target_goodput = current_bandwidth_kbs - self.current_mice_flows_kbs
-        time_since_last = time.time() - self.last_step_timestamp
-
-        if 0 <= elapsed_time_in_period <= 2:
-            target_goodput = target_goodput - self.current_traffic_patterns[0]
-        elif 2 < elapsed_time_in_period <= 4:
-            target_goodput = target_goodput - self.current_traffic_patterns[1]
-        elif 4 < elapsed_time_in_period <= 6:
-            target_goodput = target_goodput - self.current_traffic_patterns[2]
-        elif 6 < elapsed_time_in_period < 8:
-            target_goodput = target_goodput - self.current_traffic_patterns[3]
-
-        self.effective_episode += self.state_statistics[State.ACKED_BYTES_TIMEFRAME][Statistic.LAST]
+        now = self._clock()
+        target = target_goodput(now - self._traffic_timer, self.current_bandwidth,
+                                self.current_mice_flows_kbs, self.current_traffic_patterns)
+        time_since_last = now - self.last_step_timestamp
+
+        # Every state received since the last decision counts
+        self.effective_episode += self._interval_acked_bytes
         # Count loss for target
-        self.target_episode += target_goodput * time_since_last * (1 - self.current_loss / 100)
-        retransmissions_penalty = 1 + self.state_statistics[State.RETRANSMISSIONS][Statistic.LAST] * (1 - self.current_loss/100)
-        if self.effective_episode > self.target_episode:
-            reward = - retransmissions_penalty / 2
-        else:
-            reward = - retransmissions_penalty / (1 + (self.effective_episode / self.target_episode))
+        self.target_episode += target * time_since_last * (1 - self.current_loss / 100)
+        reward = step_reward(self.effective_episode, self.target_episode,
+                             self._interval_retransmissions, self.current_loss)
 
         logging.debug(f"Time since last {time_since_last}, Effective {self.effective_episode}, Target {self.target_episode}  Reward {reward}")
 
@@ -464,25 +916,65 @@ class CongestionControlEnv(Env):
         self.current_bandwidth = self.bandwidth_var
         self.current_delay = self.delay_var
         self.current_loss = self.loss_var
-        self.current_mice_flows_kbs *= self.bandwidth_var / self.bandwidth_start
-        self.current_traffic_patterns = [
-            self.bandwidth_var * 125 * .8,
-            self.bandwidth_var * 125  * .208,
-            self.bandwidth_var * 125  * .8,
-            self.bandwidth_var * 125  * 0.208
-        ]
+        self.current_mice_flows_kbs, self.current_traffic_patterns = varied_traffic(
+            self.bandwidth_start, self.bandwidth_var, self.current_mice_flows_kbs)
+        self.variation_step = self.current_step
         logging.info("Traffic patterns: " + str(self.current_traffic_patterns))
-        instant = time.time()
+        instant = self._clock()
         self._traffic_timer = instant
 
     def step(self, action) -> GymStepReturn:
+        self._send_action(action)
+
+        return self._receive_step()
+
+    def step_async(self, action) -> None:
+        """
+        Send the action right away and wait for the next state in the
+        background, step_wait() returns the step. The caller can meanwhile
+        work on other envs, e.g. run their policy.
+        """
+        if self._pending_step is not None:
+            raise RuntimeError("step_async() called again before step_wait()")
+
+        self._send_action(action)
+        if self._receiver_executor is None:
+            self._receiver_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='marlin_receiver')
+        self._pending_step = self._receiver_executor.submit(self._receive_step)
+
+    def step_wait(self) -> GymStepReturn:
+        """Step started by the last step_async()"""
+        if self._pending_step is None:
+            raise RuntimeError("step_wait() called without step_async()")
+
+        pending_step, self._pending_step = self._pending_step, None
+        return pending_step.result()
+
+    def _send_action(self, action) -> None:
+        """First half of a step, up to the action reaching the server"""
+        timer = self.step_timer
+        if timer is not None:
+            step_start_ns = time.perf_counter_ns()
+            if self._step_end_ns is not None:
+                timer.record(_POLICY_STAGE, step_start_ns - self._step_end_ns)
+
         self.current_step += 1
         self.total_steps += 1
         #TODO: Try to move this step to reset() method somehow
         if self.current_step == 1:
-            self._start_mockets_processes()
+            if self._standby is not None:
+                logging.info("-------------------------------------")
+                logging.info(f"STARTED EPISODE {self.num_resets} {eval_or_train(self._is_testing)}")
+                self._wait_standby()
+            else:
+                self._start_mockets_processes()
+            if self._recorder is not None:
+                self._recorder.start_episode(self._episode_metadata())
             # New Mockets takes seconds before establishing connection
             self.state = self._next_state()
+            if self._recorder is not None:
+                # No action leads to the first state
+                self._recorder.record_step(np.nan, 0, np.nan)
             self.variation_pending = self.timed_link_update(
                 delay_start=f"{self.delay_start}ms",
                 bandwidth_start=self.bandwidth_start,
@@ -496,28 +988,72 @@ class CongestionControlEnv(Env):
             self.episode_start_time = time.time()
 
         cwnd_value = self._cwnd_update_throttle(action[0])
+        self._sent_cwnd = cwnd_value
 
+        if timer is not None:
+            stage_start_ns = time.perf_counter_ns()
         # CWND value must be in Bytes
         self._put_action(cwnd_value)
+        if timer is not None:
+            stage_end_ns = time.perf_counter_ns()
+            timer.record(_PUT_ACTION_STAGE, stage_end_ns - stage_start_ns)
+            stage_start_ns = stage_end_ns
 
         # Apply link variation if necessary
         if self.variation_pending and self.variation_pending.ready:
             self.variation_pending = None
             self.update_link_properties()
-
-        # Action delay in ms
-        self.action_delay = (time.time() - self.previous_timestamp) * constants.UNIT_FACTOR
+        if timer is not None:
+            stage_end_ns = time.perf_counter_ns()
+            timer.record(_VARIATION_POLL_STAGE, stage_end_ns - stage_start_ns)
+            self._stage_start_ns = stage_end_ns
+            self._state_received_ns = None
+
+        self._sent_action = action
+
+    def _receive_step(self) -> GymStepReturn:
+        """Second half of a step, from waiting for the next state on"""
+        timer = self.step_timer
+        if timer is not None:
+            stage_start_ns = self._stage_start_ns
+        action = self._sent_action
+
+        # Action delay in ms, from the state being sent by Mockets, its
+        # timestamp brought to the clock of the host
+        self.action_delay = (time.time() - self.previous_timestamp) * constants.UNIT_FACTOR \
+            - self.mockets_raw_observations[_CLOCK_OFFSET]
         self.state = self._next_state()
+        if timer is not None:
+            stage_end_ns = time.perf_counter_ns()
+            # No state is received once the episode is finished
+            if self._state_received_ns is not None:
+                timer.record(_STATE_WAIT_STAGE, self._state_received_ns - stage_start_ns)
+                stage_start_ns = self._state_received_ns
+            timer.record(_STATISTICS_STAGE, stage_end_ns - stage_start_ns)
+            stage_start_ns = stage_end_ns
 
         reward = self._get_reward()
+        if self._recorder is not None:
+            self._recorder.record_step(action[0], self._sent_cwnd, reward)
+        if timer is not None:
+            stage_end_ns = time.perf_counter_ns()
+            timer.record(_REWARD_STAGE, stage_end_ns - stage_start_ns)
 
         info = {
-            'current_statistics': self.last_state,
+            'current_statistics': StateRecord._make(self.last_state.tolist()),
             'action': action[0],
             'reward': reward,
             'action_delay': self.action_delay,
             'start_time': self.episode_start_time,
-            'parameter_fetch_error': self.parameter_fetch_error
+            'parameter_fetch_error': self.parameter_fetch_error,
+            # States of the episode dropped or merged by the server so far
+            'dropped_states': int(self.mockets_raw_observations[_DROPPED_STATES]),
+            'merged_states': int(self.mockets_raw_observations[_MERGED_STATES]),
+            'deadline_misses': int(self.mockets_raw_observations[_DEADLINE_MISSES]),
+            # States aggregated by the step, more than one between decisions
+            'interval_states': self._interval_states,
+            # Host clock minus Mockets clock, plus the fastest transit
+            'clock_offset_ms': self.mockets_raw_observations[_CLOCK_OFFSET]
         }
 
         terminated = True if self._is_finished() else False
@@ -526,9 +1062,20 @@ class CongestionControlEnv(Env):
             info["TimeLimit.truncated"] = not terminated
             terminated = True
 
-        self.last_step_timestamp = time.time()
+        self.last_step_timestamp = self._clock()
+
+        if timer is not None:
+            stage_start_ns = time.perf_counter_ns()
+        observation = self._observation(self.state, action, terminated)
+        if self.normalizer is not None:
+            info['original_obs'] = self.get_original_obs()
+        if timer is not None:
+            self._step_end_ns = time.perf_counter_ns()
+            timer.record(_OBSERVATION_STAGE, self._step_end_ns - stage_start_ns)
+            if terminated:
+                info['step_latency'] = timer.summary()
 
-        return self.state, reward, terminated, info
+        return observation, reward, terminated, info
 
     def render(self, mode: str = "console") -> None:
         pass
@@ -1,15 +1,18 @@
+import logging
 from typing import Union, Optional
 
 import gym
 import optuna
 from stable_baselines3.common.callbacks import BaseCallback
 from stable_baselines3.common.logger import TensorBoardOutputFormat
+from stable_baselines3.common.save_util import load_from_pkl
 from stable_baselines3.common.vec_env import VecEnv
 
-from envs.utils.constants import State
 from stable_baselines3.common.callbacks import EvalCallback
 import time
 
+from envs.utils.dataset import buffer_transitions, prefill_replay_buffer
+
 
 class TrainingCallback(BaseCallback):
     """
@@ -44,24 +47,24 @@ class TrainingCallback(BaseCallback):
 
         for info in self.locals["infos"]:
             if 'current_statistics' in info:
-                self._throughput_sum += info['current_statistics'][State.THROUGHPUT]
-                self._goodput_sum += info['current_statistics'][State.GOODPUT]
-                self._rtt_sum += info['current_statistics'][State.LAST_RTT]
-                self._retransmissions_sum += info['current_statistics'][State.RETRANSMISSIONS]
-                self._cwnd_sum += info['current_statistics'][State.CURR_WINDOW_SIZE]
+                self._throughput_sum += info['current_statistics'].throughput
+                self._goodput_sum += info['current_statistics'].goodput
+                self._rtt_sum += info['current_statistics'].last_rtt
+                self._retransmissions_sum += info['current_statistics'].retransmissions
+                self._cwnd_sum += info['current_statistics'].curr_window_size
                 self._delay_sum += info['action_delay']
 
                 step_logger = {
                     "training/observations/throughput_KB": info[
-                        'current_statistics'][State.THROUGHPUT],
+                        'current_statistics'].throughput,
                     "training/observations/goodput_KB": info[
-                        'current_statistics'][State.GOODPUT],
+                        'current_statistics'].goodput,
                     "training/observations/rtt_ms": info[
-                        'current_statistics'][State.LAST_RTT],
+                        'current_statistics'].last_rtt,
                     "training/observations/retransmissions": info[
-                        'current_statistics'][State.RETRANSMISSIONS],
+                        'current_statistics'].retransmissions,
                     "training/observations/current_window_size_KB": info[
-                        'current_statistics'][State.CURR_WINDOW_SIZE],
+                        'current_statistics'].curr_window_size,
                     'training/action': info['action'],
                     'training/action_delay_ms': info['action_delay'],
                     'training/rewards': info['reward']
@@ -110,6 +113,44 @@ class TrainingCallback(BaseCallback):
         return True
 
 
+class PrefillReplayBufferCallback(BaseCallback):
+    """
+    Callback filling the replay buffer of an off-policy agent with the
+    transitions of a replay buffer exported from recordings, see
+    envs.utils.dataset, before training starts.
+
+    The prefilled transitions count towards ``learning_starts``, so the
+    warm-up collecting random actions is shortened by as many steps, and
+    update the observation statistics of ``VecNormalize``.
+
+    :param path: pickled replay buffer
+    :param pretrain_steps: gradient steps taken on the prefilled
+        transitions before collecting any
+    """
+
+    def __init__(self, path: str, pretrain_steps: int = 0, verbose=0):
+        super(PrefillReplayBufferCallback, self).__init__(verbose)
+        self.path = path
+        self.pretrain_steps = pretrain_steps
+
+    def _on_training_start(self) -> None:
+        transitions = buffer_transitions(load_from_pkl(self.path, self.verbose))
+        added = prefill_replay_buffer(self.model.replay_buffer, transitions)
+        self.model.learning_starts = max(self.model.learning_starts - added, 0)
+
+        vec_normalize = self.model.get_vec_normalize_env()
+        if added and vec_normalize is not None and vec_normalize.norm_obs and vec_normalize.training:
+            vec_normalize.obs_rms.update(transitions.observations[-added:])
+
+        logging.info(f"Prefilled the replay buffer with {added} transitions of {self.path}, "
+                     f"learning starts after {self.model.learning_starts} steps")
+        if self.pretrain_steps > 0 and added:
+            self.model.train(gradient_steps=self.pretrain_steps, batch_size=self.model.batch_size)
+
+    def _on_step(self) -> bool:
+        return True
+
+
 class EpisodeEvalCallback(EvalCallback):
     """
     Callback for evaluating an agent.
@@ -31,6 +31,8 @@ class Parameters(Enum):
 
     ACKED_BYTES_TIMEFRAME = 19
 
+    SEQUENCE_ID = 20
+
 
 class Statistic(Enum):
     LAST = 1
@@ -74,3 +76,27 @@ CWND_UPPER_LIMIT_BYTES = 150000
 LINK_BANDWIDTH_KB = 150
 PACKET_SIZE_KB = 1.444
 UNIT_FACTOR = 1000
+
+# CommunicationState fields of protos/congestion_control.proto and the
+# Parameters they carry
+COMMUNICATION_STATE_FIELDS = {
+    "curr_window_size": Parameters.CURR_WINDOW_SIZE,
+    "cumulative_sent_bytes": Parameters.SENT_BYTES,
+    "cumulative_rcv_bytes": Parameters.RCV_BYTES,
+    "cumulative_sent_good_bytes": Parameters.SENT_GOOD_BYTES,
+    "sent_bytes_timeframe": Parameters.SENT_BYTES_TIMEFRAME,
+    "sent_good_bytes_timeframe": Parameters.SENT_GOOD_BYTES_TIMEFRAME,
+    "unack_bytes": Parameters.UNACK_BYTES,
+    "cumulative_retransmissions": Parameters.CUMULATIVE_RETRANSMISSIONS,
+    "retransmissions": Parameters.RETRANSMISSIONS,
+    "ema_retransmissions": Parameters.EMA_RETRANSMISSIONS,
+    "last_rtt": Parameters.LAST_RTT,
+    "min_rtt": Parameters.MIN_RTT,
+    "max_rtt": Parameters.MAX_RTT,
+    "srtt": Parameters.SRTT,
+    "var_rtt": Parameters.VAR_RTT,
+    "timestamp": Parameters.TIMESTAMP,
+    "finished": Parameters.FINISHED,
+    "acked_bytes_timeframe": Parameters.ACKED_BYTES_TIMEFRAME,
+    "sequence_id": Parameters.SEQUENCE_ID,
+}
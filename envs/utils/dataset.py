@@ -0,0 +1,231 @@
+"""
+Transitions of recorded episodes, see envs.utils.recorder, for off-policy
+training without collecting them again
+
+The observations are rebuilt from the recorded states the way the env built
+them: the same state features, StreamingStatistics over the states of the
+episode and, with a history horizon, the ObservationHistory stacking of the
+observations and actions. The actions and rewards are the recorded ones. An
+episode ends terminated when Mockets finished it, or in testing once its
+bytes were acked, truncated by the step limit otherwise, as SB3 tells them
+apart with ``TimeLimit.truncated``.
+
+Observations are left unnormalized, as SB3 stores them in its replay buffer
+when training under VecNormalize: the normalization of the env itself,
+normalize_observations, is not reproduced.
+
+Export recordings to a replay buffer SB3 loads, or to plain arrays with a
+.npz output:
+python -m envs.utils.dataset logs/recording/env-50051 --history-horizon 10 --output logs/replay_buffer.pkl
+"""
+import argparse
+import logging
+from typing import Iterable, NamedTuple, Optional
+
+import numpy as np
+from gym.spaces import Box
+from stable_baselines3.common.buffers import ReplayBuffer
+from stable_baselines3.common.save_util import save_to_pkl
+
+from envs.utils import constants
+from envs.utils.constants import Parameters, State
+from envs.utils.features import OBSERVATION_LENGTH, STATE_INDEX, state_features
+from envs.utils.history import ObservationHistory
+from envs.utils.recorder import Recording
+from envs.utils.statistics import StreamingStatistics
+from grpc_server import state_record
+
+_ACKED_BYTES_TIMEFRAME = STATE_INDEX[State.ACKED_BYTES_TIMEFRAME]
+
+_TIMESTAMP = state_record.OFFSET[Parameters.TIMESTAMP]
+_FINISHED = state_record.OFFSET[Parameters.FINISHED]
+
+# Spaces of CongestionControlEnv
+ACTION_SPACE = Box(low=-1, high=+1, shape=(1,), dtype=np.float32)
+
+
+class Transitions(NamedTuple):
+    """One row per step, the observation before it and the one it led to"""
+    observations: np.ndarray
+    actions: np.ndarray
+    rewards: np.ndarray
+    next_observations: np.ndarray
+    # Last step of an episode, terminated or truncated
+    dones: np.ndarray
+    # Last step of an episode truncated by the step limit
+    timeouts: np.ndarray
+
+    def __len__(self) -> int:
+        return len(self.rewards)
+
+
+def observation_space(history_horizon: Optional[int] = None) -> Box:
+    """Observation space of the env, stacking history_horizon observations and actions"""
+    size = OBSERVATION_LENGTH if history_horizon is None \
+        else history_horizon * (OBSERVATION_LENGTH + ACTION_SPACE.shape[0])
+    return Box(low=-float("inf"), high=float("inf"), shape=(size,))
+
+
+def episode_transitions(recording: Recording, index: int, history_horizon: Optional[int] = None,
+                        statistics_window: Optional[int] = None,
+                        previous_timestamp: float = 0.0) -> Transitions:
+    """
+    Transitions of the index-th episode of a recording, the env settings
+    have to be the ones it was recorded with.
+
+    :param previous_timestamp: see state_features
+    """
+    entry = recording.episodes[index]
+    columns = recording.episode(index, ("decision", "state", "action", "reward"))
+    decisions = np.flatnonzero(columns["decision"])
+    features = state_features(columns["state"], previous_timestamp)
+    space = observation_space(history_horizon)
+    history = None if history_horizon is None \
+        else ObservationHistory(history_horizon, OBSERVATION_LENGTH, ACTION_SPACE.shape[0], dtype=space.dtype)
+
+    # Observations returned by reset and after every step, the first state
+    # of the episode only feeds the statistics
+    steps = max(len(decisions) - 1, 0)
+    observations = np.zeros((steps + 1,) + space.shape, space.dtype)
+    if history is not None:
+        observations[0] = history.reset(np.zeros(OBSERVATION_LENGTH))
+    statistics = StreamingStatistics(len(State), window=statistics_window)
+    start = 0
+    for step, decision in enumerate(decisions):
+        # States of the decision interval the step aggregated
+        for state in features[start:decision + 1]:
+            statistics.update(state)
+        start = decision + 1
+        if step == 0:
+            continue
+        observation = statistics.statistics.reshape(-1)
+        if history is not None:
+            observation = history.append(observation, columns["action"][decision])
+        observations[step] = observation
+
+    last_state = columns["state"][-1] if len(decisions) else np.zeros(state_record.RECORD_WIDTH)
+    terminated = bool(last_state[_FINISHED])
+    if entry.get("is_testing") and entry.get("kbytes_testing") is not None:
+        terminated |= features[:, _ACKED_BYTES_TIMEFRAME].sum() >= entry["kbytes_testing"]
+    dones = np.zeros(steps, np.float32)
+    timeouts = np.zeros(steps, np.float32)
+    if steps:
+        dones[-1] = 1
+        timeouts[-1] = not terminated
+
+    return Transitions(observations=observations[:-1],
+                       actions=columns["action"][decisions[1:], None].astype(ACTION_SPACE.dtype),
+                       rewards=columns["reward"][decisions[1:]].astype(np.float32),
+                       next_observations=observations[1:],
+                       dones=dones,
+                       timeouts=timeouts)
+
+
+def recording_transitions(paths: Iterable[str], history_horizon: Optional[int] = None,
+                          statistics_window: Optional[int] = None) -> Transitions:
+    """
+    Transitions of every finished episode of the recordings, those a
+    parameter fetch error restarted Mockets in are left out.
+    """
+    episodes = []
+    for path in paths:
+        recording = Recording(path)
+        previous = None
+        previous_timestamp = 0.0
+        for index, entry in enumerate(recording.episodes):
+            for setting, value in (("history_horizon", history_horizon), ("statistics_window", statistics_window)):
+                if setting in entry and entry[setting] != value:
+                    logging.warning(f"Episode {entry['episode']} of {path} was recorded with {setting} "
+                                    f"{entry[setting]}, rebuilding its observations with {value}")
+            # The first state of an episode follows the last state of the
+            # previous episodes of the env, one without states keeps it
+            if previous is None or entry.get("env_episode") is None \
+                    or entry.get("env_episode") != previous.get("env_episode", 0) + 1:
+                previous_timestamp = 0.0
+            previous = entry
+            if not entry.get("parameter_fetch_error"):
+                episodes.append(episode_transitions(recording, index, history_horizon, statistics_window,
+                                                    previous_timestamp))
+            if entry["stop"] > entry["start"]:
+                previous_timestamp = recording.rows("state", entry["stop"] - 1,
+                                                    entry["stop"])[0, _TIMESTAMP] / constants.UNIT_FACTOR
+
+    if not episodes:
+        space = observation_space(history_horizon)
+        return Transitions(np.zeros((0,) + space.shape, space.dtype), np.zeros((0, 1), ACTION_SPACE.dtype),
+                           np.zeros(0, np.float32), np.zeros((0,) + space.shape, space.dtype),
+                           np.zeros(0, np.float32), np.zeros(0, np.float32))
+    return Transitions(*(np.concatenate(arrays) for arrays in zip(*episodes)))
+
+
+def buffer_transitions(replay_buffer: ReplayBuffer) -> Transitions:
+    """Transitions held by a replay buffer, oldest first"""
+    size = replay_buffer.buffer_size if replay_buffer.full else replay_buffer.pos
+    order = np.roll(np.arange(size), -replay_buffer.pos) if replay_buffer.full else np.arange(size)
+
+    def flat(array: np.ndarray) -> np.ndarray:
+        return array[order].reshape((size * replay_buffer.n_envs,) + array.shape[2:])
+
+    return Transitions(flat(replay_buffer.observations), flat(replay_buffer.actions),
+                       flat(replay_buffer.rewards), flat(replay_buffer.next_observations),
+                       flat(replay_buffer.dones), flat(replay_buffer.timeouts))
+
+
+def prefill_replay_buffer(replay_buffer: ReplayBuffer, transitions: Transitions) -> int:
+    """
+    Add the transitions to a replay buffer, spread over its envs, the most
+    recent ones when they do not all fit. Returns the transitions added.
+    """
+    if replay_buffer.optimize_memory_usage:
+        raise ValueError("Prefilling a replay buffer optimizing memory usage is not supported")
+    if transitions.observations.shape[1:] != replay_buffer.obs_shape:
+        raise ValueError(f"Observations of shape {transitions.observations.shape[1:]} do not fit a replay buffer "
+                         f"of shape {replay_buffer.obs_shape}, check the history horizon")
+
+    n_envs = replay_buffer.n_envs
+    rows = min(len(transitions) // n_envs, replay_buffer.buffer_size)
+    if rows == 0:
+        return 0
+    kept = slice(len(transitions) - rows * n_envs, len(transitions))
+    positions = (replay_buffer.pos + np.arange(rows)) % replay_buffer.buffer_size
+    for name in Transitions._fields:
+        array = getattr(transitions, name)[kept]
+        getattr(replay_buffer, name)[positions] = array.reshape((rows, n_envs) + array.shape[1:])
+    replay_buffer.full = replay_buffer.full or replay_buffer.pos + rows >= replay_buffer.buffer_size
+    replay_buffer.pos = int((replay_buffer.pos + rows) % replay_buffer.buffer_size)
+
+    return rows * n_envs
+
+
+def to_replay_buffer(transitions: Transitions, history_horizon: Optional[int] = None,
+                     buffer_size: Optional[int] = None) -> ReplayBuffer:
+    """SB3 replay buffer holding the transitions, just large enough by default"""
+    replay_buffer = ReplayBuffer(buffer_size or max(len(transitions), 1), observation_space(history_horizon),
+                                 ACTION_SPACE, device="cpu", handle_timeout_termination=True)
+    prefill_replay_buffer(replay_buffer, transitions)
+
+    return replay_buffer
+
+
+def parse_args(args: Optional[Iterable[str]] = None):
+    parser = argparse.ArgumentParser(description="Export recorded episodes to a replay buffer")
+    parser.add_argument("paths", type=str, nargs="+", help="recordings of the env")
+    parser.add_argument("--output", type=str, required=True,
+                        help="pickled SB3 ReplayBuffer, or arrays of the transitions with a .npz extension")
+    parser.add_argument("--history-horizon", type=int, default=None,
+                        help="observations stacked by the env or by the HistoryWrapper of the Zoo")
+    parser.add_argument("--statistics-window", type=int, default=None)
+    parser.add_argument("--buffer-size", type=int, default=None)
+
+    return parser.parse_args(args)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    transitions = recording_transitions(args.paths, args.history_horizon, args.statistics_window)
+    if args.output.endswith(".npz"):
+        np.savez(args.output, **transitions._asdict())
+    else:
+        save_to_pkl(args.output, to_replay_buffer(transitions, args.history_horizon, args.buffer_size))
+    print(f"{len(transitions)} transitions of {int(transitions.dones.sum())} episodes, "
+          f"{int(transitions.timeouts.sum())} truncated, written to {args.output}")
@@ -0,0 +1,104 @@
+"""
+Integer layout of the state features and of their statistics, and the
+features of the state records, shared by the env, the policy server and
+the dataset export so they compute the same observations
+"""
+import math
+from typing import NamedTuple
+
+import numpy as np
+
+from envs.utils import constants
+from envs.utils.constants import Parameters, State, Statistic
+from grpc_server import state_record
+
+# Row of each State and column of each Statistic in the statistics array
+STATE_INDEX = dict((state, index) for index, state in enumerate(State))
+STATISTIC_INDEX = dict((stat, index) for index, stat in enumerate(Statistic))
+
+# States read straight from the Mockets parameters, as (row, parameter)
+RAW_STATE_PARAMETERS = tuple(
+    (STATE_INDEX[state], Parameters(state.value))
+    for state in State if state.value in Parameters._value2member_map_
+)
+
+OBSERVATION_LENGTH = len(State) * len(Statistic)
+
+# Rows of the raw States and their offsets in a state record, gathered with
+# a single fancy indexing
+RAW_STATE_ROWS = np.array([row for row, _ in RAW_STATE_PARAMETERS])
+RAW_STATE_OFFSETS = np.array([state_record.OFFSET[parameter] for _, parameter in RAW_STATE_PARAMETERS])
+
+_THROUGHPUT = STATE_INDEX[State.THROUGHPUT]
+_GOODPUT = STATE_INDEX[State.GOODPUT]
+_PACKETS_TRANSMITTED = STATE_INDEX[State.PACKETS_TRANSMITTED]
+_TIMESTAMP = state_record.OFFSET[Parameters.TIMESTAMP]
+_SENT_BYTES_TIMEFRAME = state_record.OFFSET[Parameters.SENT_BYTES_TIMEFRAME]
+_ACKED_BYTES_TIMEFRAME = state_record.OFFSET[Parameters.ACKED_BYTES_TIMEFRAME]
+
+
+def record_features(record: np.ndarray, previous_timestamp: float, out: np.ndarray) -> float:
+    """
+    Write the last value of every State of a state record to out, returns
+    the timestamp of the record in seconds.
+
+    Throughput and goodput are the bytes of the timeframe over the time
+    since the previous state, the bytes themselves when no time elapsed or
+    there is no previous state.
+
+    :param record: grpc_server.state_record layout, timestamp in milliseconds
+    :param previous_timestamp: timestamp in seconds of the state received
+        before, 0 for none
+    :param out: len(State) values, in State order
+    """
+    out[RAW_STATE_ROWS] = record[RAW_STATE_OFFSETS]
+
+    timestamp = record[_TIMESTAMP] / constants.UNIT_FACTOR
+    delta = 0 if previous_timestamp == 0 else timestamp - previous_timestamp
+    sent_bytes = record[_SENT_BYTES_TIMEFRAME]
+    acked_bytes = record[_ACKED_BYTES_TIMEFRAME]
+    # KB/s
+    out[_THROUGHPUT] = sent_bytes if delta == 0 else sent_bytes / delta
+    out[_GOODPUT] = acked_bytes if delta == 0 else acked_bytes / delta
+    # Every packet is 1KB so every KB in timeframe sent is also a packet sent
+    out[_PACKETS_TRANSMITTED] = math.ceil(sent_bytes / constants.PACKET_SIZE_KB)
+
+    return timestamp
+
+
+def state_features(records: np.ndarray, previous_timestamp: float = 0.0) -> np.ndarray:
+    """
+    record_features of consecutive state records, one row per record.
+
+    :param previous_timestamp: timestamp in seconds of the state received
+        before the first record, 0 for none: the env keeps it across
+        episodes and measures the throughput of the first state of an
+        episode since the last state of the previous one
+    """
+    features = np.zeros((len(records), len(State)))
+    for record, out in zip(records, features):
+        previous_timestamp = record_features(record, previous_timestamp, out)
+
+    return features
+
+
+class StateRecord(NamedTuple):
+    """Last value of every State, in State order"""
+    curr_window_size: float
+    sent_bytes_timeframe: float
+    sent_good_bytes_timeframe: float
+    unack_bytes: float
+    retransmissions: float
+    last_rtt: float
+    min_rtt: float
+    max_rtt: float
+    srtt: float
+    var_rtt: float
+    acked_bytes_timeframe: float
+    throughput: float
+    goodput: float
+    packets_transmitted: float
+
+
+assert StateRecord._fields == tuple(state.name.lower() for state in State), \
+    "StateRecord fields must follow the State order"
@@ -0,0 +1,139 @@
+"""
+Frame stacking and observation normalization fused inside the environment
+"""
+import pickle
+
+import numpy as np
+
+
+class ObservationHistory:
+    """
+    Ring buffer of the last ``horizon`` observations and actions.
+
+    The stacked output has the same layout as ``utils.wrappers.HistoryWrapper``
+    from RL Baselines3 Zoo: the observations from oldest to newest followed by
+    the actions from oldest to newest, zero padded at the start of an episode.
+    Every frame is stored twice, at ``i`` and ``i + horizon``, so the last
+    ``horizon`` frames are always a contiguous view and nothing is rolled.
+    Outputs alternate between two buffers, the one returned by the previous
+    call stays valid while the next one is written.
+    """
+
+    def __init__(self,
+                 horizon: int,
+                 observation_length: int,
+                 action_length: int,
+                 dtype=np.float32):
+        if horizon < 1:
+            raise ValueError(f"History horizon must be positive, got {horizon}")
+
+        self.horizon = horizon
+        self.observation_length = observation_length
+        self.action_length = action_length
+        self.size = horizon * (observation_length + action_length)
+
+        self._observations = np.zeros((2 * horizon, observation_length), dtype)
+        self._actions = np.zeros((2 * horizon, action_length), dtype)
+        self._next_slot = 0
+
+        self._outputs = np.zeros((2, self.size), dtype)
+        self._output_index = 0
+
+    def _stack(self) -> np.ndarray:
+        self._output_index ^= 1
+        output = self._outputs[self._output_index]
+        split = self.horizon * self.observation_length
+        window = slice(self._next_slot, self._next_slot + self.horizon)
+
+        output[:split] = self._observations[window].reshape(-1)
+        output[split:] = self._actions[window].reshape(-1)
+
+        return output
+
+    def _write(self, observation: np.ndarray, action) -> None:
+        slot = self._next_slot
+        self._observations[slot] = observation
+        self._observations[slot + self.horizon] = observation
+        self._actions[slot] = action
+        self._actions[slot + self.horizon] = action
+        self._next_slot = (slot + 1) % self.horizon
+
+    def reset(self, observation: np.ndarray) -> np.ndarray:
+        """Flush the history and stack the first observation"""
+        self._observations.fill(0)
+        self._actions.fill(0)
+        self._next_slot = 0
+        self._write(observation, 0)
+
+        return self._stack()
+
+    def append(self, observation: np.ndarray, action: np.ndarray) -> np.ndarray:
+        """Push the newest observation with the action that led to it"""
+        self._write(observation, action)
+
+        return self._stack()
+
+
+class RunningNormalizer:
+    """
+    Running mean and variance normalization of the observations.
+
+    Mirrors ``VecNormalize`` from Stable Baselines3 with ``norm_obs=True`` on
+    a single environment: statistics start from the same priors and are
+    updated with the same formulas, one observation at a time, and outputs
+    are cast to float32, so the output is identical to wrapping the
+    environment.
+    """
+
+    def __init__(self,
+                 shape,
+                 clip: float = 10.0,
+                 epsilon: float = 1e-8,
+                 count_prior: float = 1e-4):
+        self.mean = np.zeros(shape, np.float64)
+        self.var = np.ones(shape, np.float64)
+        self.count = count_prior
+        self.clip = clip
+        self.epsilon = epsilon
+
+        shape = tuple(np.atleast_1d(shape))
+        self._normalized = np.zeros(shape, np.float64)
+        self._outputs = np.zeros((2,) + shape, np.float32)
+        self._output_index = 0
+
+    def update(self, observation: np.ndarray) -> None:
+        # Same operations and order as RunningMeanStd with a batch of one,
+        # done in place
+        delta = observation - self.mean
+        total_count = self.count + 1
+
+        delta_term = np.square(delta)
+        delta_term *= self.count
+        delta_term /= total_count
+        self.var *= self.count
+        self.var += delta_term
+        self.var /= total_count
+
+        delta /= total_count
+        self.mean += delta
+        self.count = total_count
+
+    def normalize(self, observation: np.ndarray) -> np.ndarray:
+        normalized = self._normalized
+        np.subtract(observation, self.mean, out=normalized)
+        normalized /= np.sqrt(self.var + self.epsilon)
+        np.clip(normalized, -self.clip, self.clip, out=normalized)
+
+        self._output_index ^= 1
+        output = self._outputs[self._output_index]
+        output[:] = normalized
+
+        return output
+
+    def save(self, path: str) -> None:
+        with open(path, "wb") as file_handler:
+            pickle.dump((self.mean, self.var, self.count), file_handler)
+
+    def load(self, path: str) -> None:
+        with open(path, "rb") as file_handler:
+            self.mean, self.var, self.count = pickle.load(file_handler)
@@ -0,0 +1,100 @@
+"""
+CPU sets, scheduling priority and torch threads of the processes of the
+control loop, so the gRPC server, the env and the learner don't preempt each
+other
+"""
+import logging
+import os
+from typing import Callable, Iterable, Optional, Set, Union
+
+CpuSet = Union[str, int, Iterable[int]]
+
+
+def parse_cpus(cpus: Optional[CpuSet]) -> Optional[Set[int]]:
+    """CPUs of a list like "0-3,6", a single CPU or an iterable of CPUs"""
+    if cpus is None:
+        return None
+    if isinstance(cpus, int):
+        return {cpus}
+    if not isinstance(cpus, str):
+        return set(int(cpu) for cpu in cpus)
+
+    parsed = set()
+    for part in cpus.replace(" ", "").split(","):
+        if not part:
+            continue
+        first, _, last = part.partition("-")
+        parsed.update(range(int(first), int(last or first) + 1))
+    if not parsed:
+        raise ValueError(f"Empty CPU list {cpus!r}")
+
+    return parsed
+
+
+def _apply(pid: int, function: Callable, *args) -> None:
+    """Call function(tid, *args) for every thread of a process"""
+    # Affinity, nice level and scheduling policy are set per thread on Linux
+    try:
+        tids = [int(tid) for tid in os.listdir(f"/proc/{pid or os.getpid()}/task")]
+    except OSError:
+        tids = [pid]
+    for tid in tids:
+        try:
+            function(tid, *args)
+        except ProcessLookupError:
+            # The thread exited meanwhile
+            pass
+
+
+def isolate(cpus: Optional[CpuSet] = None, nice: Optional[int] = None,
+            realtime_priority: Optional[int] = None,
+            torch_threads: Optional[int] = None, pid: int = 0,
+            name: str = "process") -> None:
+    """
+    Pin a process, the calling one by default, to a CPU set and set its
+    scheduling priority.
+
+    Every thread already running is set, threads started afterwards inherit
+    the CPU set and priority of the one starting them. CPUs the process is not
+    allowed to run on are left out of the set. Raising the priority, with a
+    negative nice level or a SCHED_FIFO realtime priority, needs the
+    CAP_SYS_NICE capability: without it a warning is logged and the process
+    keeps running at its current priority.
+
+    :param cpus: CPUs to run on, see parse_cpus, None to keep them
+    :param nice: nice level, from -20 (highest priority) to 19
+    :param realtime_priority: SCHED_FIFO priority, from 1 to 99, the
+        process then runs before any process of the default policy
+    :param torch_threads: intra-op threads torch runs on, only applied to
+        the calling process
+    :param pid: process to isolate, 0 for the calling one
+    :param name: name of the process in the logs
+    """
+    cpus = parse_cpus(cpus)
+    if cpus is not None:
+        allowed = cpus & os.sched_getaffinity(pid)
+        if allowed != cpus:
+            logging.warning(f"CPUs {sorted(cpus - allowed)} are not available to the {name}")
+        if allowed:
+            _apply(pid, os.sched_setaffinity, allowed)
+            logging.info(f"Pinned the {name} to CPUs {sorted(allowed)}")
+
+    if nice is not None:
+        try:
+            _apply(pid, lambda tid: os.setpriority(os.PRIO_PROCESS, tid, nice))
+            logging.info(f"Set the nice level of the {name} to {nice}")
+        except PermissionError:
+            logging.warning(f"Not allowed to set the nice level of the {name} to {nice}")
+
+    if realtime_priority is not None:
+        try:
+            _apply(pid, os.sched_setscheduler, os.SCHED_FIFO, os.sched_param(realtime_priority))
+            logging.info(f"Set the realtime priority of the {name} to {realtime_priority}")
+        except PermissionError:
+            logging.warning(f"Not allowed to set the realtime priority of the {name}")
+
+    if torch_threads is not None:
+        import torch
+
+        torch.set_num_threads(torch_threads)
+        logging.info(f"Capped torch to {torch_threads} threads in the {name}")
@@ -0,0 +1,275 @@
+"""
+Episodes of the env recorded to memory-mapped column files
+
+Every state the env takes from the server is a row: the state record, as it
+comes from the channel, the link it was received on and the action, window
+and reward of the step it belongs to. Columns are preallocated ``.npy``
+files of ``chunk_rows`` rows mapped in memory, a directory per chunk, so
+recording a state is a few assignments to mapped pages and reading back
+maps the files without copying them. ``episodes.jsonl`` indexes the rows of
+every finished episode with its link and traffic settings.
+
+A recording keeps growing across runs writing to the same directory, each
+run starting a new chunk. Summarize one with:
+python -m envs.utils.recorder logs/recording/env-50051
+"""
+import argparse
+import json
+import os
+from typing import Dict, Iterable, List, Optional
+
+import numpy as np
+
+from grpc_server import state_record
+
+# Name, dtype and shape of every row of a column
+COLUMNS = (
+    ("episode", np.int32, ()),
+    ("step", np.int32, ()),
+    # Last state of a step, the one the agent decides on next and the
+    # reward is given for. Intermediate states of a decision interval come
+    # before it
+    ("decision", np.bool_, ()),
+    # grpc_server.state_record layout, timestamp in milliseconds
+    ("state", np.float64, (state_record.RECORD_WIDTH,)),
+    # Action of the step leading to the state and the window it was turned
+    # into, NaN and 0 for the first state of an episode
+    ("action", np.float32, ()),
+    ("cwnd", np.int64, ()),
+    # Reward of the step, NaN on the states before the last one of a step
+    ("reward", np.float64, ()),
+    # Link the state was received on, Mbps, ms and percent
+    ("bandwidth", np.float64, ()),
+    ("delay", np.float64, ()),
+    ("loss", np.float64, ()),
+)
+
+_COLUMN_TYPES = dict((name, (dtype, shape)) for name, dtype, shape in COLUMNS)
+
+_LAYOUT = "recording.json"
+_INDEX = "episodes.jsonl"
+
+
+def _chunk_directory(path: str, chunk: int) -> str:
+    return os.path.join(path, f"chunk-{chunk:06d}")
+
+
+class EpisodeRecorder:
+    """
+    Appends the states of the episodes of an env to a recording.
+
+    An episode is written between ``start_episode`` and ``end_episode``,
+    ``record_state`` adds a state and ``record_step`` completes the states
+    added since the previous step with its action and reward. The pages
+    are flushed to disk once the episode ends.
+
+    Episodes are kept in a single chunk when they fit: one starts in a new
+    chunk when the rows left in the current one are fewer than the longest
+    episode recorded so far.
+
+    :param path: directory of the recording, created if needed
+    :param chunk_rows: rows of a chunk, taken from the recording when it
+        exists
+    """
+
+    def __init__(self, path: str, chunk_rows: int = 65536):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        layout_path = os.path.join(path, _LAYOUT)
+        if os.path.exists(layout_path):
+            with open(layout_path) as file_handler:
+                chunk_rows = json.load(file_handler)["chunk_rows"]
+        else:
+            with open(layout_path, "w") as file_handler:
+                json.dump(dict(chunk_rows=chunk_rows, columns=[
+                    dict(name=name, dtype=np.dtype(dtype).str, shape=list(shape)) for name, dtype, shape in COLUMNS
+                ]), file_handler)
+        self.chunk_rows = chunk_rows
+
+        # Rows and episodes already recorded, the run starts a new chunk
+        episodes = read_index(path)
+        self.next_episode = max((episode["episode"] for episode in episodes), default=-1) + 1
+        stop = max((episode["stop"] for episode in episodes), default=0)
+        self._row = -(-stop // chunk_rows) * chunk_rows
+        self._longest_episode = max((episode["stop"] - episode["start"] for episode in episodes), default=0)
+
+        self._chunk = None
+        self._memmaps: List[np.memmap] = []
+        self._columns: Dict[str, np.ndarray] = {}
+        # Chunks created by this recorder, the others are overwritten
+        self._created = set()
+        self._episode = None
+        self._metadata = None
+        self._episode_start = 0
+        # First row of the states of the current step, and the step
+        self._step_start = 0
+        self._step = 0
+
+    def _open_chunk(self, chunk: int) -> None:
+        self._flush()
+        directory = _chunk_directory(self.path, chunk)
+        os.makedirs(directory, exist_ok=True)
+        mode = "r+" if chunk in self._created else "w+"
+        self._memmaps = [np.lib.format.open_memmap(os.path.join(directory, f"{name}.npy"), mode=mode,
+                                                   dtype=dtype, shape=(self.chunk_rows,) + shape)
+                         for name, dtype, shape in COLUMNS]
+        # Plain arrays on the mapped pages, assigning to them skips the
+        # memmap subclass
+        self._columns = dict((name, memmap.view(np.ndarray)) for (name, _, _), memmap in zip(COLUMNS, self._memmaps))
+        self._created.add(chunk)
+        self._chunk = chunk
+
+    def _flush(self) -> None:
+        for memmap in self._memmaps:
+            memmap.flush()
+
+    def start_episode(self, metadata: Optional[dict] = None) -> int:
+        """Start recording an episode, metadata are JSON values kept in the index, returns its number"""
+        if self._episode is not None:
+            self.end_episode()
+        left = self.chunk_rows - self._row % self.chunk_rows
+        if left < min(self.chunk_rows, self._longest_episode):
+            self._row += left
+        self._episode = self.next_episode
+        self.next_episode += 1
+        self._metadata = metadata or {}
+        self._episode_start = self._row
+        self._step_start = self._row
+        self._step = 0
+
+        return self._episode
+
+    def record_state(self, record: np.ndarray, bandwidth: float, delay: float, loss: float) -> None:
+        if self._episode is None:
+            return
+        chunk, offset = divmod(self._row, self.chunk_rows)
+        if chunk != self._chunk:
+            self._open_chunk(chunk)
+        columns = self._columns
+        columns["episode"][offset] = self._episode
+        columns["step"][offset] = self._step
+        columns["decision"][offset] = False
+        columns["state"][offset] = record
+        columns["bandwidth"][offset] = bandwidth
+        columns["delay"][offset] = delay
+        columns["loss"][offset] = loss
+        self._row += 1
+
+    def record_step(self, action: float, cwnd: int, reward: float) -> None:
+        """Complete the states recorded since the previous step"""
+        if self._episode is None or self._row == self._step_start:
+            return
+        for chunk in range(self._step_start // self.chunk_rows, (self._row - 1) // self.chunk_rows + 1):
+            if chunk != self._chunk:
+                # A step straddling two chunks
+                self._open_chunk(chunk)
+            start = max(self._step_start - chunk * self.chunk_rows, 0)
+            stop = min(self._row - chunk * self.chunk_rows, self.chunk_rows)
+            self._columns["action"][start:stop] = action
+            self._columns["cwnd"][start:stop] = cwnd
+            self._columns["reward"][start:stop] = np.nan
+        last = (self._row - 1) % self.chunk_rows
+        self._columns["reward"][last] = reward
+        self._columns["decision"][last] = True
+        self._step_start = self._row
+        self._step += 1
+
+    def end_episode(self, summary: Optional[dict] = None) -> None:
+        """Index the episode being recorded, with summary added to its metadata"""
+        if self._episode is None:
+            return
+        self._flush()
+        entry = dict(episode=self._episode, start=self._episode_start, stop=self._row, steps=self._step)
+        entry.update(self._metadata)
+        entry.update(summary or {})
+        with open(os.path.join(self.path, _INDEX), "a") as file_handler:
+            file_handler.write(json.dumps(entry) + "\n")
+        self._longest_episode = max(self._longest_episode, self._row - self._episode_start)
+        self._episode = None
+
+    def close(self) -> None:
+        self.end_episode()
+        self._flush()
+        self._memmaps = []
+        self._columns = {}
+        self._chunk = None
+
+
+def read_index(path: str) -> List[dict]:
+    """Entries of the finished episodes of a recording"""
+    index_path = os.path.join(path, _INDEX)
+    if not os.path.exists(index_path):
+        return []
+    with open(index_path) as file_handler:
+        return [json.loads(line) for line in file_handler if line.strip()]
+
+
+class Recording:
+    """
+    Read access to a recording, columns are memory-mapped read only.
+
+    ``episode(i)`` returns the columns of an episode as views of the mapped
+    files, copied only for an episode straddling two chunks, ``column``
+    concatenates a column over all the finished episodes.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(os.path.join(path, _LAYOUT)) as file_handler:
+            self.chunk_rows = json.load(file_handler)["chunk_rows"]
+        self.episodes = read_index(path)
+        self._chunks: Dict[int, Dict[str, np.ndarray]] = {}
+
+    def __len__(self) -> int:
+        return len(self.episodes)
+
+    def _chunk(self, chunk: int) -> Dict[str, np.ndarray]:
+        if chunk not in self._chunks:
+            directory = _chunk_directory(self.path, chunk)
+            self._chunks[chunk] = dict((name, np.load(os.path.join(directory, f"{name}.npy"), mmap_mode="r"))
+                                       for name, _, _ in COLUMNS)
+        return self._chunks[chunk]
+
+    def rows(self, name: str, start: int, stop: int) -> np.ndarray:
+        """Rows [start, stop) of a column"""
+        if stop <= start:
+            # An episode without states, its start may be a chunk never written
+            dtype, shape = _COLUMN_TYPES[name]
+            return np.empty((0,) + shape, dtype=dtype)
+        first, last = start // self.chunk_rows, max(stop - 1, start) // self.chunk_rows
+        parts = [self._chunk(chunk)[name][max(start - chunk * self.chunk_rows, 0):
+                                          min(stop - chunk * self.chunk_rows, self.chunk_rows)]
+                 for chunk in range(first, last + 1)]
+        return parts[0] if len(parts) == 1 else np.concatenate(parts)
+
+    def episode(self, index: int, columns: Optional[Iterable[str]] = None) -> Dict[str, np.ndarray]:
+        """Columns of the index-th finished episode, all of them by default"""
+        entry = self.episodes[index]
+        names = [name for name, _, _ in COLUMNS] if columns is None else columns
+        return dict((name, self.rows(name, entry["start"], entry["stop"])) for name in names)
+
+    def column(self, name: str) -> np.ndarray:
+        """A column over every finished episode, in the order they were recorded"""
+        return np.concatenate([self.rows(name, entry["start"], entry["stop"]) for entry in self.episodes])
+
+
+def parse_args(args: Optional[Iterable[str]] = None):
+    parser = argparse.ArgumentParser(description="Summarize a recording of the env")
+    parser.add_argument("path", type=str)
+
+    return parser.parse_args(args)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    recording = Recording(args.path)
+    print(f"{len(recording)} episodes, {sum(entry['stop'] - entry['start'] for entry in recording.episodes)} states")
+    print(f"{'episode':>8}{'states':>8}{'steps':>8}{'return':>10}{'bandwidth':>11}{'delay':>8}{'loss':>6}")
+    for index, entry in enumerate(recording.episodes):
+        columns = recording.episode(index, ("reward", "bandwidth", "delay", "loss"))
+        rewards = columns["reward"][~np.isnan(columns["reward"])]
+        # Link of the last state, NaN for an episode without states
+        bandwidth, delay, loss = (columns[name][-1] if len(columns[name]) else np.nan
+                                  for name in ("bandwidth", "delay", "loss"))
+        print(f"{entry['episode']:>8}{entry['stop'] - entry['start']:>8}{entry['steps']:>8}{rewards.sum():>10.2f}"
+              f"{bandwidth:>11g}{delay:>8g}{loss:>6g}")
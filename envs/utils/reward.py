@@ -0,0 +1,191 @@
+"""
+Reward of the env as a function of the trace of an episode
+
+The reward of a step compares the bytes acked since the start of the
+episode with a target: the goodput left to the flow by the MGEN traffic,
+integrated over the time between steps, both taken from the timestamps of
+the states. The traffic follows a pattern of four slots of TRAFFIC_SLOT_S
+seconds repeated since the start of the episode and restarted by the link
+variation. Steps past the target are rewarded -penalty / 2, the others
+-penalty / (1 + acked / target), the penalty growing with the
+retransmissions of the step.
+
+``step_reward`` is the reward of one step as the env computes it,
+``episode_rewards`` the rewards of every step of an episode at once, from a
+RewardTrace taken from a recording by ``episode_trace``. Relabel the episodes
+of a recording and compare with the recorded rewards:
+python -m envs.utils.reward logs/recording/env-50051
+"""
+import argparse
+from typing import Iterable, List, NamedTuple, Optional, Sequence, Tuple
+
+import numpy as np
+
+from envs.utils import constants
+from envs.utils.constants import Parameters
+from envs.utils.recorder import Recording
+from grpc_server import state_record
+
+# Period of the pattern of the MGEN traffic and length of each of its slots
+TRAFFIC_PERIOD_S = 8
+TRAFFIC_SLOT_S = 2
+
+_TIMESTAMP = state_record.OFFSET[Parameters.TIMESTAMP]
+_ACKED_BYTES_TIMEFRAME = state_record.OFFSET[Parameters.ACKED_BYTES_TIMEFRAME]
+_RETRANSMISSIONS = state_record.OFFSET[Parameters.RETRANSMISSIONS]
+
+
+def start_traffic(bandwidth_mbps: float) -> Tuple[float, List[float]]:
+    """Mice flows and traffic pattern in KB/s at the start of an episode"""
+    return bandwidth_mbps * .08, [
+        bandwidth_mbps * 125 * .4,
+        bandwidth_mbps * 125 * .8,
+        bandwidth_mbps * 125 * .4,
+        bandwidth_mbps * 125 * .208
+    ]
+
+
+def varied_traffic(bandwidth_start: float, bandwidth_var: float,
+                   mice_flows_kbs: float) -> Tuple[float, List[float]]:
+    """Mice flows and traffic pattern in KB/s once the link varied"""
+    return mice_flows_kbs * (bandwidth_var / bandwidth_start), [
+        bandwidth_var * 125 * .8,
+        bandwidth_var * 125 * .208,
+        bandwidth_var * 125 * .8,
+        bandwidth_var * 125 * .208
+    ]
+
+
+def target_goodput(elapsed: float, bandwidth_mbps: float, mice_flows_kbs: float,
+                   traffic_patterns: Sequence[float]) -> float:
+    """Goodput in KB/s left to the flow, elapsed seconds since the traffic started"""
+    elapsed_in_period = float(elapsed) % TRAFFIC_PERIOD_S
+    target = bandwidth_mbps * 125 - mice_flows_kbs
+
+    if 0 <= elapsed_in_period <= 2:
+        target = target - traffic_patterns[0]
+    elif 2 < elapsed_in_period <= 4:
+        target = target - traffic_patterns[1]
+    elif 4 < elapsed_in_period <= 6:
+        target = target - traffic_patterns[2]
+    elif 6 < elapsed_in_period < 8:
+        target = target - traffic_patterns[3]
+
+    return target
+
+
+def step_reward(acked_kbytes: float, target_kbytes: float, retransmissions: float, loss_percent: float) -> float:
+    """
+    Reward of a step, with the KB acked and the target since the start of
+    the episode and the retransmissions of the step
+    """
+    retransmissions_penalty = 1 + retransmissions * (1 - loss_percent / 100)
+    if acked_kbytes > target_kbytes:
+        return - retransmissions_penalty / 2
+    return - retransmissions_penalty / (1 + (acked_kbytes / target_kbytes))
+
+
+class RewardTrace(NamedTuple):
+    """What the rewards of an episode depend on, one row per step"""
+    # Timestamp in seconds of the state the first step follows
+    start: float
+    # Timestamp in seconds of the last state of every step
+    timestamps: np.ndarray
+    # KB acked and retransmissions of the states of every step
+    acked_kbytes: np.ndarray
+    retransmissions: np.ndarray
+    # Link of every step, Mbps and percent
+    bandwidth: np.ndarray
+    loss: np.ndarray
+    # Traffic of every step, mice flows in KB/s, the pattern of its four
+    # slots in KB/s and the timestamp in seconds it started at
+    mice_flows_kbs: np.ndarray
+    traffic_patterns: np.ndarray
+    traffic_start: np.ndarray
+
+
+def episode_rewards(trace: RewardTrace) -> np.ndarray:
+    """Rewards of every step of an episode, step_reward vectorized over the trace"""
+    elapsed_in_period = (trace.timestamps - trace.traffic_start) % TRAFFIC_PERIOD_S
+    # Slot of the pattern, including its upper bound, a remainder rounded up
+    # to the period falls in none and leaves the target whole
+    slots = np.maximum(np.ceil(elapsed_in_period / TRAFFIC_SLOT_S) - 1, 0).astype(np.intp)
+    slots[elapsed_in_period >= TRAFFIC_PERIOD_S] = trace.traffic_patterns.shape[1]
+    patterns = np.pad(trace.traffic_patterns, ((0, 0), (0, 1)))
+    targets = trace.bandwidth * 125 - trace.mice_flows_kbs - patterns[np.arange(len(slots)), slots]
+
+    intervals = np.diff(trace.timestamps, prepend=trace.start)
+    target_kbytes = np.cumsum(targets * intervals * (1 - trace.loss / 100))
+    acked_kbytes = np.cumsum(trace.acked_kbytes)
+    retransmissions_penalty = 1 + trace.retransmissions * (1 - trace.loss / 100)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(acked_kbytes > target_kbytes,
+                        - retransmissions_penalty / 2,
+                        - retransmissions_penalty / (1 + (acked_kbytes / target_kbytes)))
+
+
+def episode_trace(recording: Recording, index: int) -> RewardTrace:
+    """RewardTrace of the index-th episode of a recording"""
+    entry = recording.episodes[index]
+    columns = recording.episode(index, ("decision", "state", "bandwidth", "delay", "loss"))
+    states = columns["state"]
+    decisions = np.flatnonzero(columns["decision"])
+    timestamps = states[decisions, _TIMESTAMP] / constants.UNIT_FACTOR
+    steps = slice(1, len(decisions))
+
+    # The states of a step follow the last state of the previous one
+    step_starts = decisions[:-1] + 1
+    acked_kbytes = np.add.reduceat(states[:, _ACKED_BYTES_TIMEFRAME], step_starts) if len(step_starts) \
+        else np.zeros(0)
+    retransmissions = np.add.reduceat(states[:, _RETRANSMISSIONS], step_starts) if len(step_starts) \
+        else np.zeros(0)
+
+    link_start = entry.get("link_start")
+    if "variation_step" in entry:
+        variation_step = entry["variation_step"]
+    else:
+        # Recorded before the step was kept, the first one on a new link
+        varied = np.flatnonzero(np.any(np.stack([columns["bandwidth"], columns["delay"], columns["loss"]], axis=1)
+                                       [decisions[steps]] != link_start, axis=1))
+        variation_step = int(varied[0]) + 1 if len(varied) else None
+
+    count = max(len(decisions) - 1, 0)
+    mice_flows_kbs = np.full(count, entry["mice_flows_kbs"])
+    traffic_patterns = np.tile(np.asarray(entry["traffic_patterns"], dtype=np.float64), (count, 1))
+    traffic_start = np.full(count, timestamps[0] if len(timestamps) else 0.0)
+    if variation_step is not None and variation_step <= count:
+        varied_mice, varied_patterns = varied_traffic(link_start[0], entry["link_variation"][0],
+                                                      entry["mice_flows_kbs"])
+        mice_flows_kbs[variation_step - 1:] = varied_mice
+        traffic_patterns[variation_step - 1:] = varied_patterns
+        # Restarted by the variation, at the time of the previous step
+        traffic_start[variation_step - 1:] = timestamps[variation_step - 1]
+
+    return RewardTrace(start=float(timestamps[0]) if len(timestamps) else 0.0,
+                       timestamps=timestamps[steps],
+                       acked_kbytes=acked_kbytes,
+                       retransmissions=retransmissions,
+                       bandwidth=columns["bandwidth"][decisions[steps]],
+                       loss=columns["loss"][decisions[steps]],
+                       mice_flows_kbs=mice_flows_kbs,
+                       traffic_patterns=traffic_patterns,
+                       traffic_start=traffic_start)
+
+
+def parse_args(args: Optional[Iterable[str]] = None):
+    parser = argparse.ArgumentParser(description="Relabel the rewards of a recording of the env")
+    parser.add_argument("path", type=str)
+
+    return parser.parse_args(args)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    recording = Recording(args.path)
+    print(f"{'episode':>8}{'steps':>8}{'recorded':>12}{'relabeled':>12}{'max error':>12}")
+    for index, entry in enumerate(recording.episodes):
+        rewards = episode_rewards(episode_trace(recording, index))
+        recorded = recording.episode(index, ("decision", "reward"))
+        recorded = recorded["reward"][np.flatnonzero(recorded["decision"])[1:]]
+        error = np.abs(rewards - recorded).max() if len(rewards) else 0.0
+        print(f"{entry['episode']:>8}{len(rewards):>8}{recorded.sum():>12.4f}{rewards.sum():>12.4f}{error:>12.2e}")
@@ -0,0 +1,152 @@
+"""
+Streaming statistics computed over the state features of an episode
+"""
+from collections import deque
+from typing import Optional
+
+import numpy as np
+
+from envs.utils import constants
+from envs.utils.constants import Statistic
+from envs.utils.features import STATISTIC_INDEX
+
+_LAST = STATISTIC_INDEX[Statistic.LAST]
+_MEAN = STATISTIC_INDEX[Statistic.MEAN]
+_STD = STATISTIC_INDEX[Statistic.STD]
+_MIN = STATISTIC_INDEX[Statistic.MIN]
+_MAX = STATISTIC_INDEX[Statistic.MAX]
+_EMA = STATISTIC_INDEX[Statistic.EMA]
+_DIFF = STATISTIC_INDEX[Statistic.DIFF]
+
+
+class StreamingStatistics:
+    """
+    Incrementally tracks every ``Statistic`` of a fixed set of features.
+
+    Each update is O(1) per feature: mean and variance follow Welford's
+    algorithm, minimum and maximum are kept with monotonic deques when a
+    window is used, EMA and DIFF only need the previous values. The oldest
+    sample of a window is removed with the inverse update, whose rounding
+    errors would add up over an episode: mean and variance are recomputed
+    from the samples in the window every time it wraps around, O(1) per
+    update amortized. With
+    ``window=None`` the statistics cover the whole episode, otherwise only
+    the last ``window`` samples, and memory stays bounded either way.
+
+    Results are exposed through ``statistics``, an array of shape
+    ``(n_features, len(Statistic))`` whose columns follow the ``Statistic``
+    order. Until two samples are available every statistic but EMA equals
+    the last sample, as the per-step recomputation used to do.
+    """
+
+    def __init__(self,
+                 n_features: int,
+                 window: Optional[int] = None,
+                 alpha: float = constants.ALPHA):
+        if window is not None and window < 2:
+            raise ValueError(f"Statistics window must hold at least 2 "
+                             f"samples, got {window}")
+
+        self.n_features = n_features
+        self.window = window
+        self.alpha = alpha
+        self.statistics = np.zeros((n_features, len(Statistic)))
+        self.reset()
+
+    def reset(self):
+        self.count = 0
+        self.samples_seen = 0
+        self.statistics.fill(0.0)
+
+        self._mean = np.zeros(self.n_features)
+        self._m2 = np.zeros(self.n_features)
+        self._min = np.full(self.n_features, np.inf)
+        self._max = np.full(self.n_features, -np.inf)
+
+        if self.window is not None:
+            # Samples currently in the window, needed to evict the oldest one
+            self._samples = np.zeros((self.window, self.n_features))
+            # Monotonic deques of (sample index, value) per feature
+            self._min_deques = [deque() for _ in range(self.n_features)]
+            self._max_deques = [deque() for _ in range(self.n_features)]
+
+    def _push(self, values: np.ndarray):
+        self.count += 1
+        delta = values - self._mean
+        self._mean += delta / self.count
+        self._m2 += delta * (values - self._mean)
+
+    def _pop(self, values: np.ndarray):
+        self.count -= 1
+        delta = values - self._mean
+        self._mean -= delta / self.count
+        self._m2 -= delta * (values - self._mean)
+
+    def _recompute(self):
+        """Mean and sum of squared deviations of the full window, two-pass"""
+        self.count = self.window
+        np.mean(self._samples, axis=0, out=self._mean)
+        deviations = self._samples - self._mean
+        np.einsum("ij,ij->j", deviations, deviations, out=self._m2)
+
+    def _update_window_extremes(self, index: int, values: np.ndarray):
+        oldest_index = index - self.window
+        for feature, value in enumerate(values.tolist()):
+            min_deque = self._min_deques[feature]
+            while min_deque and min_deque[-1][1] >= value:
+                min_deque.pop()
+            min_deque.append((index, value))
+            if min_deque[0][0] <= oldest_index:
+                min_deque.popleft()
+            self._min[feature] = min_deque[0][1]
+
+            max_deque = self._max_deques[feature]
+            while max_deque and max_deque[-1][1] <= value:
+                max_deque.pop()
+            max_deque.append((index, value))
+            if max_deque[0][0] <= oldest_index:
+                max_deque.popleft()
+            self._max[feature] = max_deque[0][1]
+
+    def update(self, values: np.ndarray) -> np.ndarray:
+        """Add one sample per feature and refresh ``statistics``"""
+        statistics = self.statistics
+
+        if self.window is None:
+            self._push(values)
+            np.minimum(self._min, values, out=self._min)
+            np.maximum(self._max, values, out=self._max)
+        else:
+            slot = self.samples_seen % self.window
+            if self.samples_seen >= self.window:
+                self._pop(self._samples[slot])
+            self._samples[slot] = values
+            if slot == self.window - 1:
+                self._recompute()
+            else:
+                self._push(values)
+            self._update_window_extremes(self.samples_seen, values)
+        self.samples_seen += 1
+
+        np.subtract(values, statistics[:, _LAST], out=statistics[:, _DIFF])
+        statistics[:, _LAST] = values
+        ema = statistics[:, _EMA]
+        statistics[:, _EMA] = np.where(
+            ema == 0.0, values, (1 - self.alpha) * ema + self.alpha * values
+        )
+
+        if self.samples_seen < 2:
+            statistics[:, _MEAN] = values
+            statistics[:, _STD] = values
+            statistics[:, _MIN] = values
+            statistics[:, _MAX] = values
+            statistics[:, _DIFF] = values
+        else:
+            statistics[:, _MEAN] = self._mean
+            statistics[:, _STD] = np.sqrt(
+                np.maximum(self._m2, 0.0) / (self.count - 1)
+            )
+            statistics[:, _MIN] = self._min
+            statistics[:, _MAX] = self._max
+
+        return statistics
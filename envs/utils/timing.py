@@ -0,0 +1,85 @@
+"""
+Latency histograms of the stages of a step with fixed buckets
+"""
+from typing import Sequence
+
+import numpy as np
+
+# Every power of two of nanoseconds is split in 2 ** _SUB_BUCKET_BITS
+# buckets, values are known within 25%
+_SUB_BUCKET_BITS = 2
+_SUB_BUCKETS = 1 << _SUB_BUCKET_BITS
+# Longer latencies, above 18 minutes, fall in the last bucket
+_MAX_BIT_LENGTH = 40
+N_BUCKETS = (_MAX_BIT_LENGTH - _SUB_BUCKET_BITS + 1) * _SUB_BUCKETS
+
+
+def bucket(elapsed_ns: int) -> int:
+    """Histogram bucket of a latency"""
+    bits = elapsed_ns.bit_length()
+    if bits <= _SUB_BUCKET_BITS:
+        return elapsed_ns
+    if bits > _MAX_BIT_LENGTH:
+        return N_BUCKETS - 1
+
+    shift = bits - _SUB_BUCKET_BITS - 1
+    return (bits - _SUB_BUCKET_BITS) * _SUB_BUCKETS + ((elapsed_ns >> shift) & (_SUB_BUCKETS - 1))
+
+
+def _upper_edges_ns() -> np.ndarray:
+    edges = np.arange(1, N_BUCKETS + 1, dtype=np.float64)
+    for index in range(_SUB_BUCKETS, N_BUCKETS):
+        octave, sub_bucket = divmod(index, _SUB_BUCKETS)
+        shift = octave - 1
+        edges[index] = (_SUB_BUCKETS + sub_bucket + 1) << shift
+    return edges
+
+
+# Exclusive upper bound of every bucket
+UPPER_EDGES_NS = _upper_edges_ns()
+
+
+class StageTimer:
+    """
+    Histogram of the latencies of every stage, fed with nanosecond
+    durations from ``time.perf_counter_ns``.
+
+    Recording is a few integer operations on plain lists, numpy is only
+    used by ``summary`` to compute the percentiles.
+    """
+
+    def __init__(self, stages: Sequence[str]):
+        self.stages = tuple(stages)
+        self.counts = [[0] * N_BUCKETS for _ in self.stages]
+        self.total_ns = [0] * len(self.stages)
+        self.max_ns = [0] * len(self.stages)
+
+    def record(self, stage: int, elapsed_ns: int) -> None:
+        self.counts[stage][bucket(elapsed_ns)] += 1
+        self.total_ns[stage] += elapsed_ns
+        if elapsed_ns > self.max_ns[stage]:
+            self.max_ns[stage] = elapsed_ns
+
+    def reset(self) -> None:
+        self.counts = [[0] * N_BUCKETS for _ in self.stages]
+        self.total_ns = [0] * len(self.stages)
+        self.max_ns = [0] * len(self.stages)
+
+    def summary(self) -> dict:
+        """Count, mean, p50, p99 and max in microseconds of every stage"""
+        summary = {}
+        for stage, name in enumerate(self.stages):
+            cumulative_counts = np.cumsum(self.counts[stage])
+            count = int(cumulative_counts[-1])
+            if count == 0:
+                continue
+            p50, p99 = UPPER_EDGES_NS[np.searchsorted(cumulative_counts, (.5 * count, .99 * count))] / 1e3
+            summary[name] = {
+                'count': count,
+                'mean_us': self.total_ns[stage] / count / 1e3,
+                'p50_us': p50,
+                'p99_us': p99,
+                'max_us': self.max_ns[stage] / 1e3,
+            }
+
+        return summary
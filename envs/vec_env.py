@@ -0,0 +1,93 @@
+"""
+Several Mockets flows stepped together and served by a single gRPC process
+"""
+import logging
+from multiprocessing import Process
+from typing import Sequence
+
+import numpy as np
+from stable_baselines3.common.vec_env import DummyVecEnv
+from stable_baselines3.common.vec_env.base_vec_env import VecEnvStepReturn
+
+import grpc_server.congestion_control_server as cc_server
+from envs.env import CongestionControlEnv
+from grpc_server import state_record
+from grpc_server.channels import Demultiplexer, make_channel
+
+
+class CongestionControlVectorEnv(DummyVecEnv):
+    """
+    Vectorized CongestionControlEnv running every flow in the learner's
+    process.
+
+    A single hub process serves the gRPC streams of all the flows, one port
+    each, and shares one state and one action channel with the envs: states
+    are routed to their env by the env id the hub stamps on them, actions to
+    their stream by the stream id the env tags them with, every env being a
+    producer of the action channel. ``step_async`` sends the actions of
+    every flow right away, ``step_wait`` then collects the states, so the
+    flows wait for their next state concurrently.
+
+    :param env_kwargs: keyword arguments of each flow, each with its own
+        ``grpc_port``, containers and Mininet topology
+    :param common_kwargs: keyword arguments shared by every flow, the server
+        settings (transport, backpressure, deadline) are taken from the first
+    """
+
+    def __init__(self, env_kwargs: Sequence[dict], **common_kwargs):
+        env_fns = [
+            lambda kwargs=kwargs: CongestionControlEnv(**{**common_kwargs, **kwargs})
+            for kwargs in env_kwargs
+        ]
+        super().__init__(env_fns)
+
+        settings = self.envs[0]
+        self._state_queue = make_channel(settings.transport, state_record.RECORD_WIDTH,
+                                         settings.channel_capacity * self.num_envs)
+        # Actions are (stream id, sequence, cwnd) records
+        self._action_queue = make_channel(settings.transport, 3,
+                                          settings.channel_capacity * self.num_envs)
+        self._demultiplexer = Demultiplexer(self._state_queue, state_record.ENV_ID, self.num_envs)
+        for env_id, env in enumerate(self.envs):
+            env.attach_to_hub(self._demultiplexer.endpoint(env_id), self._action_queue)
+
+        ports = [env.grpc_port for env in self.envs]
+        self._hub_process = Process(
+            target=cc_server.run,
+            args=(self._action_queue,
+                  self._state_queue,
+                  ports) + settings._server_settings(), name='marlin_grpc_hub')
+        self._hub_process.daemon = True
+        self._hub_process.start()
+        logging.info(f"GRPC hub serving {self.num_envs} envs on ports {ports}")
+
+    def step_async(self, actions: np.ndarray) -> None:
+        for env, action in zip(self.envs, actions):
+            env._send_action(action)
+
+    def step_wait(self) -> VecEnvStepReturn:
+        for env_idx, env in enumerate(self.envs):
+            obs, self.buf_rews[env_idx], self.buf_dones[env_idx], self.buf_infos[env_idx] = env._receive_step()
+            if self.buf_dones[env_idx]:
+                # save final observation where user can get it, then reset
+                self.buf_infos[env_idx]["terminal_observation"] = obs.copy()
+                obs = env.reset()
+            self._save_obs(env_idx, obs)
+
+        return (self._obs_from_buf(), np.copy(self.buf_rews), np.copy(self.buf_dones),
+                [dict(info) for info in self.buf_infos])
+
+    def close(self) -> None:
+        for env in self.envs:
+            env.close()
+
+        if self._hub_process is not None:
+            logging.info("Closing GRPC Hub...")
+            self._hub_process.terminate()
+            self._hub_process.join()
+            self._hub_process.close()
+
+            self._action_queue.close()
+            self._state_queue.close()
+
+            self._hub_process = None
@@ -0,0 +1,93 @@
+"""States received from Mockets while the env is still busy with a previous one"""
+
+import asyncio
+import collections
+from typing import Iterable, Optional
+
+import numpy as np
+
+from grpc_server import state_record
+
+BLOCK = "block"
+DROP_OLDEST = "drop_oldest"
+COALESCE = "coalesce"
+POLICIES = (BLOCK, DROP_OLDEST, COALESCE)
+
+
+class PendingStates:
+    """
+    Bounded buffer of the states of a stream not yet published to the env.
+
+    When it is full the policy decides what happens to a new state:
+
+    - ``block``: wait for room, gRPC flow control then holds Mockets back
+    - ``drop_oldest``: discard the oldest pending state
+    - ``coalesce``: fold the newest pending state into the new one, see
+      ``state_record.coalesce``
+
+    Dropped and merged states are counted over the life of the stream.
+    """
+
+    def __init__(self, policy: str = BLOCK, capacity: int = 1):
+        if policy not in POLICIES:
+            raise ValueError(f"Unknown backpressure policy {policy}, "
+                             f"choose one of {POLICIES}")
+        if capacity < 1:
+            raise ValueError(f"State buffer size must be positive, got {capacity}")
+
+        self.policy = policy
+        self.capacity = capacity
+        self.dropped = 0
+        self.merged = 0
+        self._records = collections.deque()
+        self._closed = False
+        self._changed = asyncio.Condition()
+
+    def __len__(self) -> int:
+        return len(self._records)
+
+    def _has_room(self) -> bool:
+        return len(self._records) < self.capacity
+
+    async def push(self, record: np.ndarray) -> None:
+        async with self._changed:
+            await self._push(record)
+
+    async def extend(self, records: Iterable[np.ndarray]) -> None:
+        """Push several records in order, taking the lock once"""
+        async with self._changed:
+            for record in records:
+                await self._push(record)
+
+    async def _push(self, record: np.ndarray) -> None:
+        if not self._has_room():
+            if self.policy == BLOCK:
+                await self._changed.wait_for(self._has_room)
+            elif self.policy == DROP_OLDEST:
+                self._records.popleft()
+                self.dropped += 1
+            else:
+                record = state_record.coalesce(self._records.pop(), record)
+                self.merged += 1
+
+        self._records.append(record)
+        self._changed.notify_all()
+
+    async def close(self) -> None:
+        """No more states will be pushed"""
+        async with self._changed:
+            self._closed = True
+            self._changed.notify_all()
+
+    async def pop(self) -> Optional[np.ndarray]:
+        """Oldest pending state, None once closed and empty"""
+        async with self._changed:
+            await self._changed.wait_for(
+                lambda: self._records or self._closed)
+            if not self._records:
+                return None
+
+            record = self._records.popleft()
+            self._changed.notify_all()
+
+            return record
@@ -0,0 +1,314 @@
+"""Channels carrying states and actions between the server and the env"""
+
+import collections
+import multiprocessing
+import queue
+import threading
+import time
+from multiprocessing import Queue, shared_memory
+from typing import Optional, Union
+
+import numpy as np
+
+QUEUE_TRANSPORT = "queue"
+SHARED_MEMORY_TRANSPORT = "shared_memory"
+TRANSPORTS = (QUEUE_TRANSPORT, SHARED_MEMORY_TRANSPORT)
+
+# Header slots of a shared memory ring
+_WRITE_SEQUENCE = 0
+_READ_SEQUENCE = 1
+_HEADER_LENGTH = 2
+
+
+class RecordQueue:
+    """
+    ``multiprocessing.Queue`` of fixed-width float64 records.
+
+    Records cross the pipe as their raw bytes, the cheapest thing to pickle,
+    and come out as read-only arrays.
+    """
+
+    def __init__(self, width: int):
+        self.width = width
+        self._queue = Queue()
+
+    def qsize(self) -> int:
+        return self._queue.qsize()
+
+    def empty(self) -> bool:
+        return self._queue.empty()
+
+    def put(self, record, block: bool = True,
+            timeout: Optional[float] = None) -> None:
+        self._queue.put(
+            np.asarray(record, dtype=np.float64).tobytes(), block, timeout)
+
+    def get(self, block: bool = True,
+            timeout: Optional[float] = None) -> np.ndarray:
+        return np.frombuffer(self._queue.get(block, timeout), dtype=np.float64)
+
+    def get_nowait(self) -> np.ndarray:
+        return self.get(block=False)
+
+    def close(self) -> None:
+        self._queue.close()
+
+
+class SharedMemoryChannel:
+    """
+    Multi-producer single-consumer ring of fixed-width float64 records.
+
+    Records live in a shared memory block, each slot stores the sequence
+    number of its record in front of the values, so the consumer can check
+    it reads records in order. Two semaphores count the records ready and
+    the free slots: the consumer sleeps on the first one and is woken up as
+    soon as a record is written, nothing is pickled or sent through a pipe.
+    Producers, threads or processes, write their records one at a time
+    under a lock, as the envs of a vectorized env sharing the action ring.
+    ``get`` takes no lock: a ring must have a single consumer.
+
+    The interface is the one of ``RecordQueue`` so either can be used by the
+    server and the env: ``put`` and ``get`` accept ``block`` and ``timeout``
+    and raise ``queue.Full`` and ``queue.Empty``. Unlike the unbounded
+    ``RecordQueue``, a ring holds ``capacity`` records: once it is full a
+    blocking ``put`` waits, without a timeout for as long as the consumer
+    takes none. A producer that must not wait, the event loop of the server,
+    puts through a ``ChannelFeeder``.
+    """
+
+    def __init__(self, width: int, capacity: int = 64, spin: int = 0):
+        """
+        :param width: number of float64 values of each record
+        :param capacity: number of records the ring can hold
+        :param spin: non-blocking polls tried before sleeping in ``get``
+        """
+        self.width = width
+        self.capacity = capacity
+        self.spin = spin
+
+        size = np.dtype(np.float64).itemsize * (
+            _HEADER_LENGTH + capacity * (width + 1))
+        self._shared_memory = shared_memory.SharedMemory(create=True,
+                                                         size=size)
+        self._owner = True
+        self._ready = multiprocessing.Semaphore(0)
+        self._free = multiprocessing.Semaphore(capacity)
+        self._producer = multiprocessing.Lock()
+        self._map()
+        self._header[:] = 0
+
+    def _map(self):
+        self._header = np.ndarray((_HEADER_LENGTH,), dtype=np.int64,
+                                  buffer=self._shared_memory.buf)
+        self._slots = np.ndarray((self.capacity, self.width + 1),
+                                 dtype=np.float64,
+                                 buffer=self._shared_memory.buf,
+                                 offset=self._header.nbytes)
+
+    def __getstate__(self):
+        return (self._shared_memory.name, self.width, self.capacity,
+                self.spin, self._ready, self._free, self._producer)
+
+    def __setstate__(self, state):
+        name, self.width, self.capacity, self.spin, self._ready, \
+            self._free, self._producer = state
+        self._shared_memory = shared_memory.SharedMemory(name=name)
+        self._owner = False
+        self._map()
+
+    @property
+    def name(self) -> str:
+        return self._shared_memory.name
+
+    def qsize(self) -> int:
+        return int(self._header[_WRITE_SEQUENCE] - self._header[_READ_SEQUENCE])
+
+    def empty(self) -> bool:
+        return self.qsize() == 0
+
+    def put(self, record, block: bool = True,
+            timeout: Optional[float] = None) -> None:
+        """
+        Write a record, waiting for a free slot while the ring is full, up
+        to timeout seconds if given, or raise ``queue.Full`` right away when
+        not blocking
+        """
+        if not self._free.acquire(block, timeout):
+            raise queue.Full
+
+        with self._producer:
+            sequence = int(self._header[_WRITE_SEQUENCE])
+            slot = self._slots[sequence % self.capacity]
+            slot[0] = sequence
+            slot[1:] = record
+            # Publish the record only once its values are written
+            self._header[_WRITE_SEQUENCE] = sequence + 1
+        self._ready.release()
+
+    def get(self, block: bool = True,
+            timeout: Optional[float] = None) -> np.ndarray:
+        acquired = False
+        for _ in range(self.spin):
+            if self._ready.acquire(False):
+                acquired = True
+                break
+        if not acquired and not self._ready.acquire(block, timeout):
+            raise queue.Empty
+
+        sequence = int(self._header[_READ_SEQUENCE])
+        slot = self._slots[sequence % self.capacity]
+        if slot[0] != sequence:
+            raise RuntimeError(f"Shared memory channel out of order: expected "
+                               f"record {sequence}, found {int(slot[0])}")
+        record = slot[1:].copy()
+        self._header[_READ_SEQUENCE] = sequence + 1
+        self._free.release()
+
+        return record
+
+    def get_nowait(self) -> np.ndarray:
+        return self.get(block=False)
+
+    def close(self) -> None:
+        if self._shared_memory is None:
+            return
+        # Views on the buffer must be gone before it can be closed
+        self._header = None
+        self._slots = None
+        self._shared_memory.close()
+        if self._owner:
+            self._shared_memory.unlink()
+        self._shared_memory = None
+
+
+class ChannelFeeder:
+    """
+    Puts records into a channel from a background thread, ``put`` never
+    blocks.
+
+    Records the channel has no room for wait in an unbounded buffer, in the
+    order they were put, as a ``multiprocessing.Queue`` buffers them in
+    front of its pipe, so a full ``SharedMemoryChannel`` holds back the
+    feeder thread only. ``qsize`` counts the buffered records with the ones
+    in the channel and ``full`` the records that found the channel full.
+    """
+
+    def __init__(self, channel: "Channel", name: str = 'marlin_feeder'):
+        self.channel = channel
+        self.width = channel.width
+        self.full = 0
+        self._buffer = queue.SimpleQueue()
+        self._feeder = threading.Thread(target=self._feed, name=name,
+                                        daemon=True)
+        self._feeder.start()
+
+    def _feed(self) -> None:
+        while True:
+            record = self._buffer.get()
+            try:
+                self.channel.put(record, block=False)
+            except queue.Full:
+                self.full += 1
+                self.channel.put(record)
+
+    def qsize(self) -> int:
+        return self.channel.qsize() + self._buffer.qsize()
+
+    def empty(self) -> bool:
+        return self.qsize() == 0
+
+    def put(self, record, block: bool = True,
+            timeout: Optional[float] = None) -> None:
+        # Copied, the caller is free to reuse the record
+        self._buffer.put(np.array(record, dtype=np.float64))
+
+    def close(self) -> None:
+        # The channel belongs to whoever created the feeder
+        pass
+
+
+Channel = Union[RecordQueue, SharedMemoryChannel]
+
+
+class Demultiplexer:
+    """
+    Splits the records of a channel between consumers according to one of
+    their values, the key.
+
+    Each consumer reads from its own ``endpoint``, records of other consumers
+    read meanwhile are kept until they ask for them. Endpoints can be read
+    from different threads: one of them reads the channel at a time while
+    the others wait for it to hand them their records.
+    """
+
+    def __init__(self, channel: Channel, key_offset: int, n_keys: int):
+        self.channel = channel
+        self._key_offset = key_offset
+        self._pending = [collections.deque() for _ in range(n_keys)]
+        self._changed = threading.Condition()
+        self._reading = False
+
+    def endpoint(self, key: int) -> "DemultiplexedChannel":
+        return DemultiplexedChannel(self, key)
+
+    def get(self, key: int, block: bool = True,
+            timeout: Optional[float] = None) -> np.ndarray:
+        pending = self._pending[key]
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._changed:
+            # Wait for a record or for the channel to be free
+            while not pending and self._reading:
+                remaining = None if deadline is None \
+                    else deadline - time.monotonic()
+                if not block or (remaining is not None and remaining <= 0):
+                    raise queue.Empty
+                self._changed.wait(remaining)
+            if pending:
+                return pending.popleft()
+            self._reading = True
+
+        try:
+            while True:
+                remaining = None if deadline is None \
+                    else max(deadline - time.monotonic(), 0)
+                record = self.channel.get(block, remaining)
+                record_key = int(record[self._key_offset])
+                if record_key == key:
+                    return record
+                with self._changed:
+                    self._pending[record_key].append(record)
+                    self._changed.notify_all()
+        finally:
+            with self._changed:
+                self._reading = False
+                self._changed.notify_all()
+
+
+class DemultiplexedChannel:
+    """Records of a single key of a ``Demultiplexer``, read only"""
+
+    def __init__(self, demultiplexer: Demultiplexer, key: int):
+        self._demultiplexer = demultiplexer
+        self.key = key
+
+    def get(self, block: bool = True,
+            timeout: Optional[float] = None) -> np.ndarray:
+        return self._demultiplexer.get(self.key, block, timeout)
+
+    def get_nowait(self) -> np.ndarray:
+        return self.get(block=False)
+
+    def close(self) -> None:
+        # The channel belongs to whoever created the demultiplexer
+        pass
+
+
+def make_channel(transport: str, width: int, capacity: int = 64) -> Channel:
+    """Create a channel for records of ``width`` values over ``transport``"""
+    if transport == QUEUE_TRANSPORT:
+        return RecordQueue(width)
+    elif transport == SHARED_MEMORY_TRANSPORT:
+        return SharedMemoryChannel(width, capacity)
+    else:
+        raise ValueError(f"Unknown transport {transport}, "
+                         f"choose one of {TRANSPORTS}")
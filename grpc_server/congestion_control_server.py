@@ -3,90 +3,548 @@
 from __future__ import print_function
 import asyncio
 import concurrent.futures
+import itertools
 import logging
-from typing import AsyncIterable
+import signal
+import threading
+from typing import (AsyncIterable, Awaitable, Callable, Dict, Optional,
+                    Sequence, Tuple, Union)
 
 import grpc
 from protos import congestion_control_pb2, congestion_control_pb2_grpc
-from multiprocessing import Queue
+from grpc_server import state_record
+from grpc_server.backpressure import BLOCK, PendingStates
+from grpc_server.channels import Channel, ChannelFeeder, SharedMemoryChannel
+from grpc_server.fallback import DISCARD, HOLD, fallback_cwnd
+from grpc_server.interpolation import Interpolator, window_bytes
+from grpc_server.metrics import ServerMetrics, start_metrics_endpoint
+from grpc_server.tracing import (ACTION_KINDS, DECISION, FALLBACK,
+                                 INTERMEDIATE, LATE, SERVER_TRACE_DTYPE,
+                                 ClockOffset, TraceWriter, now_us)
+from grpc_server.update_interval import UpdateIntervalController
 from envs.utils.constants import Parameters
+from envs.utils.isolation import CpuSet, isolate
+
+_TIMESTAMP = state_record.OFFSET[Parameters.TIMESTAMP]
+
+
+class ActionRouter:
+    """
+    Routes the actions published by the env to the stream they answer.
+
+    Every Mockets connection is a stream with its own id, unique across the
+    envs served by the process. The env answers with (stream id, sequence,
+    cwnd) actions and a single thread hands them to the stream they belong
+    to, so the server can outlive an episode: actions answering a closed
+    stream are dropped instead of being taken by the next one.
+    """
+
+    def __init__(self, action_queue: Channel,
+                 metrics: Optional[ServerMetrics] = None):
+        self._action_queue = action_queue
+        metrics = metrics or ServerMetrics()
+        self._actions_routed = metrics.actions_routed.labels()
+        self._actions_orphaned = metrics.actions_orphaned.labels()
+        self._stream_ids = itertools.count(1)
+        # Pending actions of every open stream
+        self._streams: Dict[int, asyncio.Queue] = {}
+        self._loop = None
+
+    def start(self, loop: asyncio.AbstractEventLoop) -> None:
+        """Route the actions published by the env from a background thread"""
+        self._loop = loop
+        dispatcher = threading.Thread(target=self._dispatch_actions,
+                                      name='marlin_actions', daemon=True)
+        dispatcher.start()
+
+    def open_stream(self) -> Tuple[int, asyncio.Queue]:
+        """Id of a new stream and the queue its actions are routed to"""
+        stream_id = next(self._stream_ids)
+        actions = asyncio.Queue()
+        self._streams[stream_id] = actions
+
+        return stream_id, actions
+
+    def close_stream(self, stream_id: int) -> None:
+        del self._streams[stream_id]
+
+    def _dispatch_actions(self) -> None:
+        while True:
+            stream_id, sequence, action = self._action_queue.get()
+            self._loop.call_soon_threadsafe(self._route_action,
+                                            int(stream_id), int(sequence),
+                                            int(action))
+
+    def _route_action(self, stream_id: int, sequence: int,
+                      action: int) -> None:
+        actions = self._streams.get(stream_id)
+        if actions is None:
+            self._actions_orphaned.inc()
+            logging.debug(f"GRPC SERVER - Dropping action {action} of closed "
+                          f"stream {stream_id}")
+            return
+        self._actions_routed.inc()
+        actions.put_nowait((sequence, action))
 
 
 class CongestionControlService(congestion_control_pb2_grpc.
                                CongestionControlServicer):
-    """Implements methods for Communication during the Congestion Control"""
+    """
+    Implements methods for Communication during the Congestion Control
 
-    def __init__(self, action_queue: Queue, state_queue: Queue):
-        self._action_queue = action_queue
+    The states of every Mockets connection are stamped with the stream id
+    given by the ``ActionRouter``, the id of the env the servicer serves and
+    their sequence number in the stream.
+
+    A single state per stream is published to the env at a time, the states
+    Mockets sends meanwhile wait in a ``PendingStates`` buffer handled with
+    the backpressure policy.
+
+    With an action deadline, a state the env has not answered in time is
+    answered with a fallback action and the next state is published. The
+    action of the env arriving later is discarded or applied as soon as it
+    arrives, depending on ``late_actions``.
+
+    With a decision interval, of ``decision_interval`` states or
+    ``decision_period`` seconds whichever ends first, only the first state
+    of an interval waits for the env. The following ones are still
+    published, flagged as intermediate, and answered right away with the
+    windows of an ``Interpolator`` moving towards the last action.
+
+    With an adaptive update interval, the ``Action`` answering a state also
+    carries the interval between states Mockets is asked to switch to, set
+    by an ``UpdateIntervalController`` from the round trip of the actions
+    and the states waiting meanwhile.
+
+    Every ``Action`` echoes the sequence id of the state it answers. States
+    are stamped with the time they are received and the offset of the
+    server clock from the one of Mockets, estimated by a ``ClockOffset``
+    per stream. Given a ``TraceWriter``, the hops of the state every action
+    answers are traced, see ``grpc_server.tracing``.
+
+    States, actions, the wait for the env and the lifetime of the streams
+    are counted in the ``ServerMetrics`` of the process, labelled with the
+    env id.
+    """
+
+    def __init__(self, router: ActionRouter, state_queue: Channel,
+                 env_id: int = 0,
+                 backpressure: str = BLOCK, state_buffer_size: int = 1,
+                 action_deadline: Optional[float] = None,
+                 fallback: str = HOLD, late_actions: str = DISCARD,
+                 decision_interval: Optional[int] = None,
+                 decision_period: Optional[float] = None,
+                 interpolation: str = HOLD, ramp_limit: float = 0.1,
+                 adaptive_update_interval: bool = False,
+                 update_interval_ms: int = 0,
+                 min_update_interval_ms: int = 1,
+                 max_update_interval_ms: int = 1000,
+                 trace: Optional[TraceWriter] = None,
+                 metrics: Optional[ServerMetrics] = None):
+        if decision_interval is not None and decision_interval < 1:
+            raise ValueError(f"Decision interval must be positive, got {decision_interval}")
+        self._router = router
         self._state_queue = state_queue
+        self._env_id = env_id
+        self._backpressure = backpressure
+        self._state_buffer_size = state_buffer_size
+        self._action_deadline = action_deadline
+        self._fallback = fallback
+        self._late_actions = late_actions
+        self._decision_interval = decision_interval
+        self._decision_period = decision_period
+        self._interpolation = interpolation
+        self._ramp_limit = ramp_limit
+        self._adaptive_update_interval = adaptive_update_interval
+        self._update_interval_ms = update_interval_ms
+        self._min_update_interval_ms = min_update_interval_ms
+        self._max_update_interval_ms = max_update_interval_ms
+        self._trace = trace
+        # Buffers of the open streams
+        self._pending: Dict[int, PendingStates] = {}
+        metrics = metrics or ServerMetrics()
+        self._states_received = metrics.states_received.labels(env_id)
+        self._actions_sent = [metrics.actions_sent.labels(env_id, kind)
+                              for kind in ACTION_KINDS]
+        self._action_wait = metrics.action_wait.labels(env_id)
+        self._states_dropped = metrics.states_dropped.labels(env_id)
+        self._states_merged = metrics.states_merged.labels(env_id)
+        self._deadline_misses = metrics.deadline_misses.labels(env_id)
+        self._streams_opened = metrics.streams_opened.labels(env_id)
+        self._open_streams = metrics.open_streams.labels(env_id)
+        self._stream_lifetime = metrics.stream_lifetime.labels(env_id)
+
+    def pending_states(self) -> int:
+        """States buffered by the open streams"""
+        return sum(len(pending) for pending in self._pending.values())
+
+    def _decision_due(self, interval_states: int, elapsed: float) -> bool:
+        """Whether a state starts a new interval"""
+        if self._decision_interval is None and self._decision_period is None:
+            return True
+        return (self._decision_interval is not None and interval_states >= self._decision_interval) or \
+            (self._decision_period is not None and elapsed >= self._decision_period)
+
+    def _progress(self, interval_states: int, elapsed: float) -> float:
+        """Fraction of the interval elapsed once its last state is answered"""
+        if self._decision_interval is None and self._decision_period is None:
+            return 1.0
+        progress = 0.0
+        if self._decision_interval is not None:
+            progress = interval_states / self._decision_interval
+        if self._decision_period is not None:
+            progress = max(progress, elapsed / self._decision_period)
+        return progress
+
+    def _trace_action(self, record, kind: int, published_us: int,
+                      pending: PendingStates, cwnd: int) -> None:
+        self._trace.append(
+            int(record[state_record.STREAM_ID]), int(record[state_record.SEQUENCE]),
+            state_record.sequence_id(record), kind, int(record[_TIMESTAMP]),
+            int(record[state_record.CLOCK_OFFSET] * 1000), int(record[state_record.RECEIVED_US]),
+            published_us, now_us(), len(pending), cwnd)
 
     # Main async coroutine for Bidirectional CongestionControl communication
     # with JMockets
     async def OptimizeCongestionControl(self,
                                         request_iterator: AsyncIterable[
                                             congestion_control_pb2.CommunicationState],
-                                        unused_context) -> AsyncIterable[
+                                        context) -> AsyncIterable[
                                             congestion_control_pb2.Action]:
+        async for action in self._control(request_iterator,
+                                          self._receive_states, context):
+            yield action
 
-        parameter = dict((param, 0) for param in Parameters)
-        async for status in request_iterator:
-            loop = asyncio.get_event_loop()
+    # Same with batches of states, each state is still answered by an Action
+    async def OptimizeCongestionControlBatched(self,
+                                               request_iterator: AsyncIterable[
+                                                   congestion_control_pb2.CommunicationStateBatch],
+                                               context) -> AsyncIterable[
+                                                   congestion_control_pb2.Action]:
+        async for action in self._control(request_iterator,
+                                          self._receive_batches, context):
+            yield action
 
-            parameter[Parameters.CURR_WINDOW_SIZE] = status.curr_window_size
+    async def _control(self, request_iterator: AsyncIterable,
+                       receive: Callable[..., Awaitable[None]],
+                       context: grpc.aio.ServicerContext
+                       ) -> AsyncIterable[congestion_control_pb2.Action]:
+        """
+        Publish the states received by ``receive`` and answer them, the RPC
+        is aborted with INVALID_ARGUMENT once a message cannot be decoded
+        """
+        stream_id, actions = self._router.open_stream()
+        pending = PendingStates(self._backpressure, self._state_buffer_size)
+        self._pending[stream_id] = pending
+        receiver = asyncio.ensure_future(
+            receive(request_iterator, stream_id, self._env_id, pending))
+        loop = asyncio.get_running_loop()
+        opened = loop.time()
+        self._streams_opened.inc()
+        self._open_streams.inc()
+        actions_sent = self._actions_sent
+        dropped = 0
+        merged = 0
+        deadline_misses = 0
+        late_actions = 0
+        interpolator = Interpolator(self._interpolation, self._ramp_limit)
+        # States of the current interval and its start, the first state of a
+        # stream always starts one
+        interval_states = None
+        interval_start = None
+        update_interval = UpdateIntervalController(
+            self._update_interval_ms, self._min_update_interval_ms,
+            self._max_update_interval_ms, self._decision_interval or 1) \
+            if self._adaptive_update_interval else None
+        requested_interval = 0
+        # States answered by a fallback, whose late action is still to come
+        missed = {}
+        trace = self._trace
+        published_us = 0
+        logging.info(f"SERVER - Stream {stream_id} of env {self._env_id} "
+                     f"opened")
+        try:
+            for sequence in itertools.count(1):
+                record = await pending.pop()
+                if record is None:
+                    break
+                if pending.dropped != dropped or pending.merged != merged:
+                    self._states_dropped.inc(pending.dropped - dropped)
+                    self._states_merged.inc(pending.merged - merged)
+                    dropped, merged = pending.dropped, pending.merged
+                record[state_record.DROPPED_STATES] = pending.dropped
+                record[state_record.MERGED_STATES] = pending.merged
+                record[state_record.SEQUENCE] = sequence
+                record[state_record.DEADLINE_MISSES] = deadline_misses
 
-            parameter[Parameters.SENT_BYTES] = status.cumulative_sent_bytes
-            parameter[Parameters.RCV_BYTES] = status.cumulative_rcv_bytes
-            parameter[Parameters.SENT_GOOD_BYTES] = status.cumulative_sent_good_bytes
-            parameter[Parameters.SENT_BYTES_TIMEFRAME] = status.sent_bytes_timeframe
-            parameter[Parameters.SENT_GOOD_BYTES_TIMEFRAME] = status.sent_good_bytes_timeframe;
+                now = loop.time()
+                if interval_states is not None and \
+                        not self._decision_due(interval_states, now - interval_start):
+                    interval_states += 1
+                    record[state_record.INTERMEDIATE] = 1
+                    self._state_queue.put(record)
+                    if trace is not None:
+                        published_us = now_us()
+                    action = interpolator.cwnd(
+                        self._progress(interval_states, now - interval_start))
+                    logging.debug(f"GRPC SERVER - Intermediate state "
+                                  f"{sequence}, sending {action} to Mockets")
+                    if trace is not None:
+                        self._trace_action(record, INTERMEDIATE, published_us, pending, action)
+                    actions_sent[INTERMEDIATE].inc()
+                    yield congestion_control_pb2.Action(
+                        cwnd_update=action,
+                        sequence_id=state_record.sequence_id(record))
+                    continue
 
-            parameter[Parameters.UNACK_BYTES] = status.unack_bytes
-            parameter[Parameters.CUMULATIVE_RETRANSMISSIONS] = status.cumulative_retransmissions
-            parameter[Parameters.RETRANSMISSIONS] = status.retransmissions
-            parameter[Parameters.EMA_RETRANSMISSIONS] = status.ema_retransmissions;
+                interval_states = 1
+                interval_start = now
+                self._state_queue.put(record)
+                if trace is not None:
+                    published_us = now_us()
 
-            parameter[Parameters.LAST_RTT] = status.last_rtt
-            parameter[Parameters.MIN_RTT] = status.min_rtt
-            parameter[Parameters.MAX_RTT] = status.max_rtt
-            parameter[Parameters.SRTT] = status.srtt
-            parameter[Parameters.VAR_RTT] = status.var_rtt
+                published = loop.time()
+                deadline = None if self._action_deadline is None \
+                    else published + self._action_deadline
+                while True:
+                    timeout = None if deadline is None \
+                        else max(deadline - loop.time(), 0)
+                    try:
+                        answered, action = await asyncio.wait_for(
+                            actions.get(), timeout)
+                    except asyncio.TimeoutError:
+                        deadline_misses += 1
+                        self._deadline_misses.inc()
+                        kind = FALLBACK
+                        if self._late_actions != DISCARD or trace is not None:
+                            missed[sequence] = (record, published_us)
+                        action = fallback_cwnd(self._fallback, record)
+                        interpolator.decide(action, action)
+                        if update_interval is not None:
+                            # The round trip is at least the deadline
+                            requested_interval = update_interval.observe(
+                                self._action_deadline, len(pending))
+                        logging.debug(f"GRPC SERVER - Deadline of state "
+                                      f"{sequence} missed, sending fallback "
+                                      f"{action} to Mockets")
+                        break
+                    if answered == sequence:
+                        kind = DECISION
+                        self._action_wait.observe(loop.time() - published)
+                        if update_interval is not None:
+                            requested_interval = update_interval.observe(
+                                loop.time() - published, len(pending))
+                        interpolator.decide(window_bytes(record), action)
+                        action = interpolator.cwnd(self._progress(
+                            interval_states, loop.time() - interval_start))
+                        break
 
-            parameter[Parameters.TIMESTAMP] = status.timestamp
-            parameter[Parameters.FINISHED] = status.finished
+                    # Answer to a state a fallback was sent for
+                    late_actions += 1
+                    late_record, late_published_us = missed.pop(answered, (None, 0))
+                    if self._late_actions == DISCARD or late_record is None:
+                        continue
+                    interpolator.decide(action, action)
+                    logging.debug(f"GRPC SERVER - Late action of state "
+                                  f"{answered}, sending {action} to Mockets")
+                    if trace is not None:
+                        self._trace_action(late_record, LATE, late_published_us, pending, action)
+                    actions_sent[LATE].inc()
+                    yield congestion_control_pb2.Action(
+                        cwnd_update=action,
+                        sequence_id=state_record.sequence_id(late_record))
 
-            parameter[Parameters.ACKED_BYTES_TIMEFRAME] = status.acked_bytes_timeframe
+                logging.debug(f"GRPC SERVER - Action ready, sending {action} "
+                              f"to Mockets")
+                if requested_interval:
+                    logging.debug(f"GRPC SERVER - Requesting an update "
+                                  f"interval of {requested_interval} ms")
+                if trace is not None:
+                    self._trace_action(record, kind, published_us, pending, action)
+                actions_sent[kind].inc()
+                yield congestion_control_pb2.Action(
+                    cwnd_update=action, update_interval_ms=requested_interval,
+                    sequence_id=state_record.sequence_id(record))
+                requested_interval = 0
 
-            # Put in queue, note that queue is infinite aka doesn't block
-            self._state_queue.put(parameter)
-            # 2. Run in a custom thread pool:
-            # with concurrent.futures.ThreadPoolExecutor() as pool:
-            #     action = await loop.run_in_executor(
-            #         pool, self._action_queue.get)
+            # No more states: Mockets closed the stream or sent a message
+            # that could not be decoded
+            try:
+                await receiver
+            except ValueError as error:
+                logging.error(f"SERVER - Stream {stream_id} of env "
+                              f"{self._env_id} sent an invalid message: {error}")
+                await context.abort(grpc.StatusCode.INVALID_ARGUMENT, str(error))
+        finally:
+            receiver.cancel()
+            self._router.close_stream(stream_id)
+            del self._pending[stream_id]
+            self._states_dropped.inc(pending.dropped - dropped)
+            self._states_merged.inc(pending.merged - merged)
+            self._open_streams.dec()
+            self._stream_lifetime.observe(loop.time() - opened)
+            if trace is not None:
+                trace.flush()
+            logging.info(f"SERVER - Stream {stream_id} closed, "
+                         f"{pending.dropped} states dropped, "
+                         f"{pending.merged} merged, "
+                         f"{deadline_misses} deadlines missed, "
+                         f"{late_actions} late actions"
+                         + ("" if update_interval is None else
+                            f", update interval {update_interval.interval_ms} ms"))
 
-            action = await loop.run_in_executor(None,
-                                                self._action_queue.get)
+    async def _receive_states(self,
+                              request_iterator: AsyncIterable[
+                                  congestion_control_pb2.CommunicationState],
+                              stream_id: int,
+                              env_id: int,
+                              pending: PendingStates) -> None:
+        clock_offset = ClockOffset()
+        try:
+            async for status in request_iterator:
+                record = state_record.decode(status, stream_id, env_id)
+                received_us = now_us()
+                record[state_record.RECEIVED_US] = received_us
+                record[state_record.CLOCK_OFFSET] = clock_offset.observe(
+                    status.timestamp, received_us)
+                self._states_received.inc()
+                await pending.push(record)
+        finally:
+            await pending.close()
 
-            logging.debug(f"GRPC SERVER - Action ready, sending {action} "
-                              f"to Mockets")
-            yield congestion_control_pb2.Action(cwnd_update=action)
+    async def _receive_batches(self,
+                               request_iterator: AsyncIterable[
+                                   congestion_control_pb2.CommunicationStateBatch],
+                               stream_id: int,
+                               env_id: int,
+                               pending: PendingStates) -> None:
+        clock_offset = ClockOffset()
+        try:
+            async for batch in request_iterator:
+                records = state_record.decode_batch(batch, stream_id, env_id)
+                received_us = now_us()
+                records[:, state_record.RECEIVED_US] = received_us
+                for record in records:
+                    record[state_record.CLOCK_OFFSET] = clock_offset.observe(
+                        record[_TIMESTAMP], received_us)
+                self._states_received.inc(len(records))
+                await pending.extend(records)
+        finally:
+            await pending.close()
+
+
+def _close_trace(trace: TraceWriter) -> None:
+    trace.close()
+    raise SystemExit(0)
+
+
+async def serve(action_queue: Channel, state_queue: Channel,
+                port: Union[int, Sequence[int]],
+                backpressure: str = BLOCK, state_buffer_size: int = 1,
+                action_deadline: Optional[float] = None,
+                fallback: str = HOLD, late_actions: str = DISCARD,
+                decision_interval: Optional[int] = None,
+                decision_period: Optional[float] = None,
+                interpolation: str = HOLD, ramp_limit: float = 0.1,
+                adaptive_update_interval: bool = False,
+                update_interval_ms: int = 0,
+                min_update_interval_ms: int = 1,
+                max_update_interval_ms: int = 1000,
+                trace_path: Optional[str] = None,
+                metrics_port: Optional[int] = None) -> None:
+    """
+    Serve one env per port, the index of the port being the id of the env.
+    All of them share the state and action queues, the metrics of the
+    process, served on localhost:metrics_port when given, and, with a
+    trace_path, the trace of the server, written to trace_path + ".server".
+
+    States are published without blocking the event loop: a full shared
+    memory channel holds back a ChannelFeeder thread while the streams keep
+    answering Mockets, with fallback actions past the deadline.
+    """
+    ports = [port] if isinstance(port, int) else list(port)
+    feeder = None
+    if isinstance(state_queue, SharedMemoryChannel):
+        state_queue = feeder = ChannelFeeder(state_queue, name='marlin_states')
+    metrics = ServerMetrics()
+    router = ActionRouter(action_queue, metrics)
+    router.start(asyncio.get_running_loop())
+    trace = None
+    if trace_path is not None:
+        trace = TraceWriter(f"{trace_path}.server", SERVER_TRACE_DTYPE)
+        # The process is terminated with the streams of the episode still
+        # open, their rows are written on the way out
+        asyncio.get_running_loop().add_signal_handler(
+            signal.SIGTERM, _close_trace, trace)
+
+    servers = []
+    services = []
+    for env_id, env_port in enumerate(ports):
+        server = grpc.aio.server()
+        service = CongestionControlService(router, state_queue, env_id,
+                                     backpressure, state_buffer_size,
+                                     action_deadline, fallback,
+                                     late_actions, decision_interval,
+                                     decision_period, interpolation,
+                                     ramp_limit, adaptive_update_interval,
+                                     update_interval_ms,
+                                     min_update_interval_ms,
+                                     max_update_interval_ms, trace,
+                                     metrics)
+        congestion_control_pb2_grpc.add_CongestionControlServicer_to_server(
+            service, server)
+        server.add_insecure_port(f'[::]:{env_port}')
+        servers.append(server)
+        services.append(service)
 
+    if metrics_port is not None:
+        metrics.pending_states.function = lambda: sum(
+            service.pending_states() for service in services)
+        metrics.state_queue_size.function = state_queue.qsize
+        if feeder is not None:
+            metrics.state_channel_full.function = lambda: feeder.full
+        metrics.action_queue_size.function = action_queue.qsize
+        await start_metrics_endpoint(metrics, metrics_port)
 
-async def serve(action_queue: Queue, state_queue: Queue, port: int) -> None:
-    server = grpc.aio.server()
-    congestion_control_pb2_grpc.add_CongestionControlServicer_to_server(
-        CongestionControlService(action_queue, state_queue),
-        server
-    )
-    server.add_insecure_port(f'[::]:{port}')
-    logging.info('SERVER - Listening...')
-    await server.start()
-    await server.wait_for_termination()
+    logging.info(f'SERVER - Listening on {ports}...')
+    for server in servers:
+        await server.start()
+    await asyncio.gather(*(server.wait_for_termination()
+                           for server in servers))
 
 
-def run(action_queue: Queue,
-        state_queue: Queue,
-        port: int) -> None:
+def run(action_queue: Channel,
+        state_queue: Channel,
+        port: Union[int, Sequence[int]],
+        backpressure: str = BLOCK,
+        state_buffer_size: int = 1,
+        action_deadline: Optional[float] = None,
+        fallback: str = HOLD,
+        late_actions: str = DISCARD,
+        decision_interval: Optional[int] = None,
+        decision_period: Optional[float] = None,
+        interpolation: str = HOLD,
+        ramp_limit: float = 0.1,
+        adaptive_update_interval: bool = False,
+        update_interval_ms: int = 0,
+        min_update_interval_ms: int = 1,
+        max_update_interval_ms: int = 1000,
+        trace_path: Optional[str] = None,
+        metrics_port: Optional[int] = None,
+        cpus: Optional[CpuSet] = None,
+        nice: Optional[int] = None,
+        realtime_priority: Optional[int] = None) -> None:
+    """
+    Serve in the calling process, see serve, pinned to cpus and with the
+    given scheduling priority, see envs.utils.isolation.isolate
+    """
     logging.basicConfig()
+    isolate(cpus, nice, realtime_priority, name="gRPC server")
     loop = asyncio.get_event_loop()
     loop.run_until_complete(
-        serve(action_queue, state_queue, port))
+        serve(action_queue, state_queue, port, backpressure,
+              state_buffer_size, action_deadline, fallback, late_actions,
+              decision_interval, decision_period, interpolation, ramp_limit,
+              adaptive_update_interval, update_interval_ms,
+              min_update_interval_ms, max_update_interval_ms, trace_path,
+              metrics_port))
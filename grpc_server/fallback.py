@@ -0,0 +1,44 @@
+"""Actions the server sends on its own when the env misses the deadline of a state"""
+
+import math
+
+import numpy as np
+
+from envs.utils import constants
+from envs.utils.constants import Parameters
+from grpc_server import state_record
+
+# Fallback actions
+HOLD = "hold"
+AIMD = "aimd"
+FALLBACKS = (HOLD, AIMD)
+
+# What happens to the action of a state answered by a fallback
+DISCARD = "discard"
+APPLY = "apply"
+LATE_ACTIONS = (DISCARD, APPLY)
+
+_CURR_WINDOW_SIZE = state_record.OFFSET[Parameters.CURR_WINDOW_SIZE]
+_RETRANSMISSIONS = state_record.OFFSET[Parameters.RETRANSMISSIONS]
+
+
+def fallback_cwnd(fallback: str, record: np.ndarray) -> int:
+    """
+    CWND in Bytes for the state of a record, bounded as the env bounds its
+    actions
+
+    - ``hold``: keep the current window
+    - ``aimd``: one packet more without retransmissions in the timeframe,
+      half the window otherwise
+    """
+    # The window is in KB as every value of a state
+    cwnd = record[_CURR_WINDOW_SIZE]
+    if fallback == AIMD:
+        if record[_RETRANSMISSIONS] > 0:
+            cwnd /= 2
+        else:
+            cwnd += constants.PACKET_SIZE_KB
+    cwnd = math.ceil(cwnd * constants.UNIT_FACTOR)
+
+    return min(max(cwnd, math.ceil(constants.PACKET_SIZE_KB * constants.UNIT_FACTOR)),
+               constants.CWND_UPPER_LIMIT_BYTES)
@@ -0,0 +1,108 @@
+"""Batched forward passes of the policy over the states of concurrent flows"""
+
+import asyncio
+import time
+from typing import Callable, List, Optional
+
+import numpy as np
+
+from envs.utils.timing import StageTimer
+
+SCHEDULER_STAGES = ("queue", "forward")
+_QUEUE_STAGE, _FORWARD_STAGE = range(len(SCHEDULER_STAGES))
+
+
+class BatchScheduler:
+    """
+    Gathers the observations the flows decide on and answers them with one
+    forward pass of the policy per batch.
+
+    A batch runs as soon as ``max_batch_size`` observations are pending, or
+    ``max_delay`` seconds after the first of them was queued, so no decision
+    waits longer than that for others to join it. Everything happens in the
+    event loop of the server: ``decide`` is awaited by the stream handlers
+    and the forward pass runs in the loop, between two gRPC events.
+
+    Batches, the states they answered and the time the states spent queued
+    and in the forward pass are recorded for ``metrics``.
+    """
+
+    def __init__(self, policy: Callable[[np.ndarray], np.ndarray],
+                 observation_length: int, max_batch_size: int = 32,
+                 max_delay: float = 1e-3):
+        """
+        :param policy: actions of a batch of observations, one per row
+        :param observation_length: values of an observation
+        :param max_batch_size: observations answered by a forward pass
+        :param max_delay: longest time in seconds a decision waits for
+            the batch to fill
+        """
+        if max_batch_size < 1:
+            raise ValueError(f"Batch size must be positive, got {max_batch_size}")
+        if max_delay < 0:
+            raise ValueError(f"Maximum delay can't be negative, got {max_delay}")
+
+        self.policy = policy
+        self.max_batch_size = max_batch_size
+        self.max_delay = max_delay
+        # Observations are copied into the batch as they are queued, the
+        # flows reuse their observation buffers
+        self._observations = np.zeros((max_batch_size, observation_length), dtype=np.float32)
+        self._decisions: List[asyncio.Future] = []
+        self._queued_ns: List[int] = []
+        self._flush_handle: Optional[asyncio.TimerHandle] = None
+
+        self.batches = 0
+        self.decisions = 0
+        self.full_batches = 0
+        self.timer = StageTimer(SCHEDULER_STAGES)
+
+    async def decide(self, observation: np.ndarray) -> np.ndarray:
+        """Action of an observation, computed with the ones queued with it"""
+        loop = asyncio.get_running_loop()
+        decision = loop.create_future()
+        self._observations[len(self._decisions)] = observation
+        self._decisions.append(decision)
+        self._queued_ns.append(time.perf_counter_ns())
+
+        if len(self._decisions) == self.max_batch_size:
+            self._flush()
+        elif self._flush_handle is None:
+            self._flush_handle = loop.call_later(self.max_delay, self._flush)
+
+        return await decision
+
+    def _flush(self) -> None:
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        size = len(self._decisions)
+        if size == 0:
+            return
+
+        start_ns = time.perf_counter_ns()
+        actions = self.policy(self._observations[:size])
+        end_ns = time.perf_counter_ns()
+
+        for decision, queued_ns, action in zip(self._decisions, self._queued_ns, actions):
+            self.timer.record(_QUEUE_STAGE, start_ns - queued_ns)
+            # The stream may have been cancelled meanwhile
+            if not decision.done():
+                decision.set_result(action)
+        self.timer.record(_FORWARD_STAGE, end_ns - start_ns)
+        self._decisions = []
+        self._queued_ns = []
+
+        self.batches += 1
+        self.decisions += size
+        self.full_batches += size == self.max_batch_size
+
+    def metrics(self) -> dict:
+        """Batches run, their mean fill and the latency of their stages"""
+        return {
+            'batches': self.batches,
+            'mean_batch_size': self.decisions / self.batches if self.batches else 0.0,
+            'batch_fill': self.decisions / (self.batches * self.max_batch_size) if self.batches else 0.0,
+            'full_batches': self.full_batches,
+            'latency': self.timer.summary(),
+        }
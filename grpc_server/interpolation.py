@@ -0,0 +1,74 @@
+"""Windows the server sends on its own between two decisions of the env"""
+
+import math
+
+import numpy as np
+
+from envs.utils import constants
+from envs.utils.constants import Parameters
+from grpc_server import state_record
+from grpc_server.fallback import HOLD
+
+# How the window moves towards the last action of the env
+INTERPOLATE = "interpolate"
+RAMP = "ramp"
+INTERPOLATIONS = (HOLD, INTERPOLATE, RAMP)
+
+_CURR_WINDOW_SIZE = state_record.OFFSET[Parameters.CURR_WINDOW_SIZE]
+_PACKET_SIZE_BYTES = constants.PACKET_SIZE_KB * constants.UNIT_FACTOR
+
+
+def window_bytes(record: np.ndarray) -> int:
+    """Current window of the state of a record in Bytes"""
+    return math.ceil(record[_CURR_WINDOW_SIZE] * constants.UNIT_FACTOR)
+
+
+class Interpolator:
+    """
+    Window of every state of a decision interval, moving from the window of
+    the decision state to the action the env answered it with:
+
+    - ``hold``: the action right away, for every state of the interval
+    - ``interpolate``: linearly, the action is reached by the end of the
+      interval
+    - ``ramp``: by at most ``ramp_limit`` of the window, and at least a
+      packet, per state
+
+    Every window lies between the one of the decision state and the action,
+    so it is bounded as the env bounds its actions.
+    """
+
+    def __init__(self, interpolation: str = HOLD, ramp_limit: float = 0.1):
+        if interpolation not in INTERPOLATIONS:
+            raise ValueError(f"Unknown interpolation {interpolation}, "
+                             f"choose one of {INTERPOLATIONS}")
+        if ramp_limit <= 0:
+            raise ValueError(f"Ramp limit must be positive, got {ramp_limit}")
+
+        self.interpolation = interpolation
+        self.ramp_limit = ramp_limit
+        self._start = 0
+        self._target = 0
+        self._cwnd = 0
+
+    def decide(self, cwnd: int, target: int) -> None:
+        """Start an interval going from the window ``cwnd`` to ``target``"""
+        self._start = cwnd
+        self._target = target
+        self._cwnd = cwnd
+
+    def cwnd(self, progress: float) -> int:
+        """
+        Window in Bytes of the next state, ``progress`` being the fraction of
+        the interval elapsed once it is applied
+        """
+        if self.interpolation == HOLD:
+            return self._target
+
+        if self.interpolation == INTERPOLATE:
+            self._cwnd = self._start + (self._target - self._start) * min(progress, 1)
+        else:
+            limit = max(self._cwnd * self.ramp_limit, _PACKET_SIZE_BYTES)
+            self._cwnd += min(max(self._target - self._cwnd, -limit), limit)
+
+        return math.ceil(self._cwnd)
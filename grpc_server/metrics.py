@@ -0,0 +1,242 @@
+"""
+Prometheus metrics of the gRPC server process and a local endpoint serving them
+
+Metrics are plain Python counters updated from the event loop, a few
+attribute updates per state, and rendered in the Prometheus text format when
+scraped, so they can stay enabled for whole training runs. The endpoint only
+listens on the loopback interface:
+curl localhost:9100/metrics
+"""
+
+import abc
+import asyncio
+import bisect
+import logging
+import math
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+# Upper bounds in seconds of the latency buckets
+LATENCY_BUCKETS = (.0005, .001, .0025, .005, .01, .025, .05, .1, .25, .5, 1., 2.5, 5.)
+# Upper bounds in seconds of the stream lifetime buckets
+LIFETIME_BUCKETS = (1., 5., 10., 30., 60., 120., 300., 600., 1800.)
+
+
+class _Value:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0.0
+
+    def inc(self, amount: float = 1.0) -> None:
+        self.value += amount
+
+    def dec(self, amount: float = 1.0) -> None:
+        self.value -= amount
+
+    def set(self, value: float) -> None:
+        self.value = value
+
+
+class _Buckets:
+    __slots__ = ("bounds", "counts", "sum", "count")
+
+    def __init__(self, bounds: Sequence[float]):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    labels = [f'{name}="{value}"' for name, value in zip(names, values)]
+    if extra:
+        labels.append(extra)
+    return "{" + ",".join(labels) + "}" if labels else ""
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value))
+
+
+class Metric(abc.ABC):
+    """
+    A metric family, one child per combination of label values.
+
+    Children are created by ``labels`` and meant to be kept by the code
+    updating them, updating a child is then a single attribute update.
+    """
+
+    type = None
+
+    def __init__(self, name: str, documentation: str, label_names: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self._children: Dict[Tuple[str, ...], object] = {}
+
+    @abc.abstractmethod
+    def _new_child(self):
+        """Child updated by the code, rendered by ``_samples``"""
+
+    def labels(self, *values) -> object:
+        key = tuple(str(value) for value in values)
+        if len(key) != len(self.label_names):
+            raise ValueError(f"{self.name} has labels {self.label_names}, got {key}")
+        child = self._children.get(key)
+        if child is None:
+            child = self._children[key] = self._new_child()
+        return child
+
+    def _samples(self) -> List[str]:
+        return [f"{self.name}{_format_labels(self.label_names, key)} {_format_value(child.value)}"
+                for key, child in self._children.items()]
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}"]
+        lines.extend(self._samples())
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def _new_child(self) -> _Value:
+        return _Value()
+
+
+class Gauge(Metric):
+    """Gauge set by its children, or read from ``function`` when scraped"""
+
+    type = "gauge"
+
+    def __init__(self, name: str, documentation: str, label_names: Sequence[str] = (),
+                 function: Optional[Callable[[], float]] = None):
+        super().__init__(name, documentation, label_names)
+        self.function = function
+
+    def _new_child(self) -> _Value:
+        return _Value()
+
+    def _samples(self) -> List[str]:
+        if self.function is not None:
+            return [f"{self.name} {_format_value(self.function())}"]
+        return super()._samples()
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(self, name: str, documentation: str, label_names: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, documentation, label_names)
+        self.buckets = tuple(buckets)
+
+    def _new_child(self) -> _Buckets:
+        return _Buckets(self.buckets)
+
+    def _samples(self) -> List[str]:
+        samples = []
+        for key, child in self._children.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), child.counts):
+                cumulative += count
+                le = 'le="' + _format_value(bound) + '"'
+                samples.append(f"{self.name}_bucket{_format_labels(self.label_names, key, le)} {cumulative}")
+            labels = _format_labels(self.label_names, key)
+            samples.append(f"{self.name}_sum{labels} {_format_value(child.sum)}")
+            samples.append(f"{self.name}_count{labels} {child.count}")
+        return samples
+
+
+class ServerMetrics:
+    """
+    Metrics of a gRPC server process, labelled with the id of the env each
+    stream belongs to.
+
+    Restarts of the server, a new process every episode unless it is
+    persistent, show as changes of ``marlin_server_start_time_seconds``.
+    """
+
+    def __init__(self):
+        self.start_time = time.time()
+        self.states_received = Counter(
+            "marlin_states_received_total", "States received from Mockets", ("env",))
+        self.actions_sent = Counter(
+            "marlin_actions_sent_total", "Actions sent to Mockets by kind", ("env", "kind"))
+        self.action_wait = Histogram(
+            "marlin_action_wait_seconds", "Time from a state being published to the env answering it",
+            ("env",))
+        self.states_dropped = Counter(
+            "marlin_states_dropped_total", "States dropped by the backpressure policy", ("env",))
+        self.states_merged = Counter(
+            "marlin_states_merged_total", "States merged by the backpressure policy", ("env",))
+        self.deadline_misses = Counter(
+            "marlin_deadline_misses_total", "States answered by a fallback action", ("env",))
+        self.streams_opened = Counter(
+            "marlin_streams_opened_total", "Mockets connections, every reconnection opens one", ("env",))
+        self.open_streams = Gauge(
+            "marlin_open_streams", "Mockets connections currently open", ("env",))
+        self.stream_lifetime = Histogram(
+            "marlin_stream_lifetime_seconds", "Lifetime of the Mockets connections", ("env",),
+            LIFETIME_BUCKETS)
+        self.actions_routed = Counter(
+            "marlin_actions_routed_total", "Actions of the env handed to their stream")
+        self.actions_orphaned = Counter(
+            "marlin_actions_orphaned_total", "Actions of the env answering a closed stream")
+        self.pending_states = Gauge(
+            "marlin_pending_states", "States buffered by the streams waiting to be published")
+        self.state_queue_size = Gauge(
+            "marlin_state_queue_size", "States published and not yet taken by the env")
+        self.state_channel_full = Gauge(
+            "marlin_state_channel_full", "States published while the shared memory state channel was full")
+        self.action_queue_size = Gauge(
+            "marlin_action_queue_size", "Actions of the env not yet routed to their stream")
+        self.threads = Gauge(
+            "marlin_server_threads", "Threads of the server process", function=threading.active_count)
+        self.server_start_time = Gauge(
+            "marlin_server_start_time_seconds", "Start of the server process since the epoch",
+            function=lambda: self.start_time)
+
+    def families(self) -> List[Metric]:
+        return [metric for metric in vars(self).values() if isinstance(metric, Metric)]
+
+    def render(self) -> str:
+        return "\n".join(metric.render() for metric in self.families()) + "\n"
+
+
+async def _handle_scrape(metrics: ServerMetrics, reader: asyncio.StreamReader,
+                         writer: asyncio.StreamWriter) -> None:
+    try:
+        request = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), timeout=5)
+        path = request.split(b" ", 2)[1] if request.count(b" ") >= 2 else b""
+        if path in (b"/", b"/metrics"):
+            status, body = "200 OK", metrics.render().encode()
+        else:
+            status, body = "404 Not Found", b""
+        writer.write(f"HTTP/1.1 {status}\r\n"
+                     f"Content-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+                     f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode() + body)
+        await writer.drain()
+    except (asyncio.TimeoutError, asyncio.IncompleteReadError, asyncio.LimitOverrunError,
+            ConnectionError) as error:
+        logging.debug(f"SERVER - Metrics scrape failed: {error!r}")
+    finally:
+        writer.close()
+
+
+async def start_metrics_endpoint(metrics: ServerMetrics, port: int) -> asyncio.AbstractServer:
+    """Serve the metrics over HTTP on the loopback interface, from the running loop"""
+    server = await asyncio.start_server(
+        lambda reader, writer: _handle_scrape(metrics, reader, writer), "127.0.0.1", port)
+    logging.info(f"SERVER - Metrics on http://127.0.0.1:{port}/metrics")
+
+    return server
@@ -0,0 +1,471 @@
+"""
+Congestion control decided by a trained SAC actor inside the gRPC server,
+without the env, the state and action channels or torch in the path of a
+decision.
+
+The actor, its observation normalization and history horizon are exported
+once, where torch and Stable Baselines3 are installed, to a NumPy archive:
+
+    python -m grpc_server.policy_server export --model logs/sac/Marlin-v1_1/Marlin-v1.zip \
+        --normalization logs/sac/Marlin-v1_1/Marlin-v1/vecnormalize.pkl \
+        --history-horizon 10 --output marlin_policy.npz
+
+which is then served with NumPy alone:
+
+    python -m grpc_server.policy_server serve --policy marlin_policy.npz --port 50051
+
+Add ``--batch-size`` to decide on the states of concurrent flows with
+batched forward passes, see ``BatchScheduler``.
+"""
+import argparse
+import asyncio
+import logging
+import math
+import pickle
+import time
+from typing import AsyncIterable, Iterable, Optional, Sequence, Tuple, Union
+
+import grpc
+import numpy as np
+
+from envs.utils import constants
+from envs.utils.constants import State
+from envs.utils.features import OBSERVATION_LENGTH, STATE_INDEX, record_features
+from envs.utils.history import ObservationHistory, RunningNormalizer
+from envs.utils.isolation import CpuSet, isolate
+from envs.utils.statistics import StreamingStatistics
+from envs.utils.timing import StageTimer
+from grpc_server import state_record
+from grpc_server.inference_scheduler import BatchScheduler
+from protos import congestion_control_pb2, congestion_control_pb2_grpc
+
+_ACTIVATIONS = {
+    "ReLU": lambda x: np.maximum(x, 0, out=x),
+    "Tanh": lambda x: np.tanh(x, out=x),
+}
+
+_CURR_WINDOW_SIZE = STATE_INDEX[State.CURR_WINDOW_SIZE]
+
+SERVICE_STAGES = ("decision",)
+_DECISION_STAGE = 0
+
+
+class NumpyActor:
+    """
+    Deterministic action of a SAC actor, ``tanh(mu(latent_pi(observation)))``
+    rescaled to the action space as ``SAC.predict(deterministic=True)``
+    does, computed with float32 NumPy products as torch computes it.
+
+    Takes a single observation or a batch of them, one per row.
+    """
+
+    def __init__(self, weights: Sequence[np.ndarray], biases: Sequence[np.ndarray],
+                 activation: str, action_low: np.ndarray, action_high: np.ndarray):
+        if activation not in _ACTIVATIONS:
+            raise ValueError(f"Unsupported activation {activation}, choose one of {tuple(_ACTIVATIONS)}")
+
+        self.weights = [np.ascontiguousarray(weight, dtype=np.float32) for weight in weights]
+        self.biases = [np.asarray(bias, dtype=np.float32) for bias in biases]
+        self.activation = activation
+        self.action_low = np.asarray(action_low, dtype=np.float32)
+        self.action_high = np.asarray(action_high, dtype=np.float32)
+        self._activation = _ACTIVATIONS[activation]
+
+    @property
+    def observation_length(self) -> int:
+        return self.weights[0].shape[1]
+
+    @classmethod
+    def from_sac(cls, model) -> "NumpyActor":
+        """Weights of the actor of a loaded ``stable_baselines3.SAC``"""
+        import torch
+
+        actor = model.actor
+        if actor.use_sde:
+            raise ValueError("Actors using gSDE are not supported")
+
+        linears = [module for module in actor.latent_pi if isinstance(module, torch.nn.Linear)]
+        activations = {type(module).__name__ for module in actor.latent_pi
+                       if not isinstance(module, torch.nn.Linear)}
+        if len(activations) > 1:
+            raise ValueError(f"Actors mixing activations {activations} are not supported")
+
+        layers = linears + [actor.mu]
+        return cls([layer.weight.detach().cpu().numpy() for layer in layers],
+                   [layer.bias.detach().cpu().numpy() for layer in layers],
+                   activations.pop() if activations else "ReLU",
+                   model.action_space.low, model.action_space.high)
+
+    def __call__(self, observation: np.ndarray) -> np.ndarray:
+        hidden = np.asarray(observation, dtype=np.float32)
+        for weight, bias in zip(self.weights[:-1], self.biases[:-1]):
+            hidden = hidden @ weight.T
+            hidden += bias
+            self._activation(hidden)
+        action = np.tanh(hidden @ self.weights[-1].T + self.biases[-1])
+
+        action = self.action_low + 0.5 * (action + 1.0) * (self.action_high - self.action_low)
+        return np.clip(action, self.action_low, self.action_high)
+
+
+class ServedPolicy:
+    """
+    An actor with the settings of the observations it was trained on, saved
+    to and loaded from a NumPy archive
+    """
+
+    def __init__(self, actor: NumpyActor, history_horizon: Optional[int] = None,
+                 statistics_window: Optional[int] = None,
+                 normalizer: Optional[RunningNormalizer] = None):
+        observation_length = OBSERVATION_LENGTH if history_horizon is None \
+            else history_horizon * (OBSERVATION_LENGTH + len(actor.action_low))
+        if actor.observation_length != observation_length:
+            raise ValueError(f"The actor takes observations of {actor.observation_length} values, "
+                             f"{observation_length} with a history horizon of {history_horizon}")
+
+        self.actor = actor
+        self.history_horizon = history_horizon
+        self.statistics_window = statistics_window
+        self.normalizer = normalizer
+
+    def save(self, path: str) -> None:
+        arrays = {
+            "activation": np.array(self.actor.activation),
+            "action_low": self.actor.action_low,
+            "action_high": self.actor.action_high,
+            "history_horizon": np.array(self.history_horizon or 0),
+            "statistics_window": np.array(self.statistics_window or 0),
+        }
+        for layer, (weight, bias) in enumerate(zip(self.actor.weights, self.actor.biases)):
+            arrays[f"weight_{layer}"] = weight
+            arrays[f"bias_{layer}"] = bias
+        if self.normalizer is not None:
+            arrays.update(normalization_mean=self.normalizer.mean,
+                          normalization_var=self.normalizer.var,
+                          normalization_clip=np.array(self.normalizer.clip),
+                          normalization_epsilon=np.array(self.normalizer.epsilon))
+        np.savez(path, **arrays)
+
+    @classmethod
+    def load(cls, path: str) -> "ServedPolicy":
+        with np.load(path) as archive:
+            n_layers = sum(1 for name in archive.files if name.startswith("weight_"))
+            actor = NumpyActor([archive[f"weight_{layer}"] for layer in range(n_layers)],
+                               [archive[f"bias_{layer}"] for layer in range(n_layers)],
+                               str(archive["activation"]),
+                               archive["action_low"], archive["action_high"])
+            normalizer = None
+            if "normalization_mean" in archive.files:
+                normalizer = RunningNormalizer(archive["normalization_mean"].shape,
+                                               clip=float(archive["normalization_clip"]),
+                                               epsilon=float(archive["normalization_epsilon"]))
+                normalizer.mean = archive["normalization_mean"]
+                normalizer.var = archive["normalization_var"]
+
+            return cls(actor, int(archive["history_horizon"]) or None,
+                       int(archive["statistics_window"]) or None, normalizer)
+
+
+def load_normalizer(path: str) -> RunningNormalizer:
+    """
+    Observation normalization saved by ``VecNormalize.save``, or by the env
+    with ``normalization_path``
+    """
+    with open(path, "rb") as file_handler:
+        saved = pickle.load(file_handler)
+
+    if isinstance(saved, tuple):
+        mean, var, count = saved
+        normalizer = RunningNormalizer(mean.shape)
+    else:
+        mean, var, count = saved.obs_rms.mean, saved.obs_rms.var, saved.obs_rms.count
+        normalizer = RunningNormalizer(mean.shape, clip=saved.clip_obs, epsilon=saved.epsilon)
+    normalizer.mean, normalizer.var, normalizer.count = mean, var, count
+
+    return normalizer
+
+
+class ObservationBuilder:
+    """
+    Observations of a stream computed from its state records as a testing
+    ``CongestionControlEnv`` computes them: statistics of the State values
+    of every record, stacked with the previous actions and normalized with
+    frozen statistics.
+    """
+
+    def __init__(self, policy: ServedPolicy):
+        action_length = len(policy.actor.action_low)
+        self.statistics_engine = StreamingStatistics(len(State), window=policy.statistics_window)
+        self.history = None if policy.history_horizon is None else \
+            ObservationHistory(policy.history_horizon, OBSERVATION_LENGTH, action_length)
+        self.normalizer = policy.normalizer
+        self.last_state = np.zeros(len(State))
+        self.previous_timestamp = 0
+
+    def _output(self, observation: np.ndarray, action: Optional[np.ndarray]) -> np.ndarray:
+        if self.history is not None:
+            observation = self.history.reset(observation) if action is None \
+                else self.history.append(observation, action)
+        if self.normalizer is not None:
+            observation = self.normalizer.normalize(observation)
+        return observation
+
+    def reset(self) -> np.ndarray:
+        """Observation before the first state, that of ``env.reset()``"""
+        self.statistics_engine.reset()
+        self.last_state.fill(0.0)
+        self.previous_timestamp = 0
+
+        return self._output(np.zeros(OBSERVATION_LENGTH), None)
+
+    def update(self, record: np.ndarray) -> None:
+        """Fold the State values of a record in the statistics"""
+        # Same features as CongestionControlEnv
+        self.previous_timestamp = record_features(record, self.previous_timestamp, self.last_state)
+        self.statistics_engine.update(self.last_state)
+
+    def observation(self, action: np.ndarray) -> np.ndarray:
+        """Observation after the last update, ``action`` leading to it"""
+        # Cast to the observation space as the env does
+        return self._output(self.statistics_engine.statistics.reshape(-1).astype(np.float32), action)
+
+    def cwnd(self, action: np.ndarray) -> int:
+        """CWND in Bytes of an action, as CongestionControlEnv._cwnd_update_throttle"""
+        current_cwnd = self.last_state[_CURR_WINDOW_SIZE]
+        cwnd = math.ceil((current_cwnd + action[0] * current_cwnd) * constants.UNIT_FACTOR)
+
+        return min(max(cwnd, math.ceil(constants.PACKET_SIZE_KB * constants.UNIT_FACTOR)),
+                   constants.CWND_UPPER_LIMIT_BYTES)
+
+
+class PolicyEpisode:
+    """
+    Decisions of the policy over the states of one Mockets connection, an
+    episode of the env.
+
+    The first state is answered with the action of the reset observation,
+    as the first step of the env does, every following one with the action
+    of the observation it leads to.
+    """
+
+    def __init__(self, policy: ServedPolicy):
+        self.policy = policy
+        self.builder = ObservationBuilder(policy)
+        self.action = policy.actor(self.builder.reset())
+        self.states = 0
+
+    def observe(self, record: np.ndarray) -> Optional[np.ndarray]:
+        """
+        Fold a state record in, returns the observation to decide on or None
+        for the first state, answered with the action of the reset
+        """
+        self.builder.update(record)
+        self.states += 1
+
+        return None if self.states == 1 else self.builder.observation(self.action)
+
+    def answer(self, action: Optional[np.ndarray]) -> int:
+        """CWND in Bytes answering the last state, None keeps the last action"""
+        if action is not None:
+            self.action = action
+
+        return self.builder.cwnd(self.action)
+
+    def decide(self, record: np.ndarray) -> int:
+        """CWND in Bytes answering a state record"""
+        observation = self.observe(record)
+
+        return self.answer(None if observation is None else self.policy.actor(observation))
+
+
+class PolicyService(congestion_control_pb2_grpc.CongestionControlServicer):
+    """
+    Answers every state with the action of the policy, in the event loop.
+
+    Each state is decided on alone, or with a ``BatchScheduler`` together
+    with the states of the other flows waiting for an action. The flows
+    served and the latency of the decisions, from a state being received to
+    its action being ready, are recorded for ``metrics``.
+    """
+
+    def __init__(self, policy: ServedPolicy, scheduler: Optional[BatchScheduler] = None):
+        self._policy = policy
+        self._scheduler = scheduler
+        self.flows_served = 0
+        self.active_flows = 0
+        self.timer = StageTimer(SERVICE_STAGES)
+
+    async def OptimizeCongestionControl(self,
+                                        request_iterator: AsyncIterable[
+                                            congestion_control_pb2.CommunicationState],
+                                        unused_context) -> AsyncIterable[
+                                            congestion_control_pb2.Action]:
+        episode = self._open_episode()
+        try:
+            async for status in request_iterator:
+                yield await self._answer(episode, state_record.decode(status))
+        finally:
+            self._close_episode(episode)
+
+    async def OptimizeCongestionControlBatched(self,
+                                               request_iterator: AsyncIterable[
+                                                   congestion_control_pb2.CommunicationStateBatch],
+                                               context) -> AsyncIterable[
+                                                   congestion_control_pb2.Action]:
+        episode = self._open_episode()
+        try:
+            async for batch in request_iterator:
+                try:
+                    records = state_record.decode_batch(batch)
+                except ValueError as error:
+                    logging.error(f"SERVER - Invalid batch: {error}")
+                    await context.abort(grpc.StatusCode.INVALID_ARGUMENT, str(error))
+                for record in records:
+                    yield await self._answer(episode, record)
+        finally:
+            self._close_episode(episode)
+
+    def _open_episode(self) -> PolicyEpisode:
+        self.flows_served += 1
+        self.active_flows += 1
+        return PolicyEpisode(self._policy)
+
+    def _close_episode(self, episode: PolicyEpisode) -> None:
+        self.active_flows -= 1
+        logging.info(f"SERVER - Stream closed after {episode.states} states")
+
+    async def _answer(self, episode: PolicyEpisode,
+                      record: np.ndarray) -> congestion_control_pb2.Action:
+        start_ns = time.perf_counter_ns()
+        observation = episode.observe(record)
+        if observation is None:
+            action = None
+        elif self._scheduler is None:
+            action = self._policy.actor(observation)
+        else:
+            action = await self._scheduler.decide(observation)
+        cwnd = episode.answer(action)
+        self.timer.record(_DECISION_STAGE, time.perf_counter_ns() - start_ns)
+        record[state_record.SEQUENCE] = episode.states
+
+        return congestion_control_pb2.Action(cwnd_update=cwnd,
+                                             sequence_id=state_record.sequence_id(record))
+
+    def metrics(self) -> dict:
+        """Flows served, decision latency and batching since the start"""
+        metrics = {
+            'flows_served': self.flows_served,
+            'active_flows': self.active_flows,
+            'decision_latency': self.timer.summary().get(SERVICE_STAGES[_DECISION_STAGE], {}),
+        }
+        if self._scheduler is not None:
+            metrics['batching'] = self._scheduler.metrics()
+
+        return metrics
+
+
+async def _log_metrics(service: PolicyService, interval: float) -> None:
+    while True:
+        await asyncio.sleep(interval)
+        logging.info(f"SERVER - Metrics {service.metrics()}")
+
+
+def create_server(policy: ServedPolicy, port: Union[int, Sequence[int]],
+                  max_batch_size: int = 1, max_delay: float = 1e-3
+                  ) -> Tuple[grpc.aio.Server, PolicyService]:
+    """
+    Server of the policy on every port, the states of all the flows being
+    decided on in batches of up to ``max_batch_size``, waiting at most
+    ``max_delay`` seconds for a batch to fill
+    """
+    scheduler = None if max_batch_size == 1 else \
+        BatchScheduler(policy.actor, policy.actor.observation_length, max_batch_size, max_delay)
+    service = PolicyService(policy, scheduler)
+    server = grpc.aio.server()
+    congestion_control_pb2_grpc.add_CongestionControlServicer_to_server(service, server)
+    for server_port in [port] if isinstance(port, int) else port:
+        server.add_insecure_port(f'[::]:{server_port}')
+
+    return server, service
+
+
+async def serve(policy: ServedPolicy, port: Union[int, Sequence[int]],
+                max_batch_size: int = 1, max_delay: float = 1e-3,
+                metrics_interval: Optional[float] = None) -> None:
+    server, service = create_server(policy, port, max_batch_size, max_delay)
+    logging.info(f'SERVER - Serving the policy on {port}...')
+    await server.start()
+    if metrics_interval is not None:
+        asyncio.ensure_future(_log_metrics(service, metrics_interval))
+    try:
+        await server.wait_for_termination()
+    finally:
+        logging.info(f"SERVER - Metrics {service.metrics()}")
+
+
+def run(policy_path: str, port: Union[int, Sequence[int]],
+        max_batch_size: int = 1, max_delay: float = 1e-3,
+        metrics_interval: Optional[float] = None,
+        cpus: Optional[CpuSet] = None, nice: Optional[int] = None,
+        realtime_priority: Optional[int] = None) -> None:
+    logging.basicConfig(level=logging.INFO)
+    isolate(cpus, nice, realtime_priority, name="policy server")
+    loop = asyncio.get_event_loop()
+    loop.run_until_complete(serve(ServedPolicy.load(policy_path), port,
+                                  max_batch_size, max_delay, metrics_interval))
+
+
+def export(model_path: str, output_path: str,
+           normalization_path: Optional[str] = None,
+           history_horizon: Optional[int] = None,
+           statistics_window: Optional[int] = None) -> ServedPolicy:
+    """Save the actor of a trained SAC model with its observation settings"""
+    from stable_baselines3 import SAC
+
+    model = SAC.load(model_path, device="cpu")
+    policy = ServedPolicy(NumpyActor.from_sac(model), history_horizon, statistics_window,
+                          None if normalization_path is None else load_normalizer(normalization_path))
+    policy.save(output_path)
+
+    return policy
+
+
+def parse_args(args: Optional[Iterable[str]] = None):
+    parser = argparse.ArgumentParser()
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    export_parser = commands.add_parser("export", help="Export a trained SAC model")
+    export_parser.add_argument("--model", type=str, required=True)
+    export_parser.add_argument("--output", type=str, required=True)
+    export_parser.add_argument("--normalization", type=str, default=None,
+                               help="VecNormalize statistics, or the env's normalization_path")
+    export_parser.add_argument("--history-horizon", type=int, default=None)
+    export_parser.add_argument("--statistics-window", type=int, default=None)
+
+    serve_parser = commands.add_parser("serve", help="Serve an exported policy")
+    serve_parser.add_argument("--policy", type=str, required=True)
+    serve_parser.add_argument("--port", type=int, nargs="+", default=[50051])
+    serve_parser.add_argument("--batch-size", type=int, default=1,
+                              help="States of concurrent flows decided on by a forward pass")
+    serve_parser.add_argument("--max-delay-ms", type=float, default=1.0,
+                              help="Longest time a state waits for its batch to fill")
+    serve_parser.add_argument("--metrics-interval", type=float, default=None,
+                              help="Seconds between two logs of the metrics")
+    serve_parser.add_argument("--cpus", type=str, default=None,
+                              help="CPUs to run on, e.g. 0-1")
+    serve_parser.add_argument("--nice", type=int, default=None)
+    serve_parser.add_argument("--realtime-priority", type=int, default=None,
+                              help="SCHED_FIFO priority, from 1 to 99")
+
+    return parser.parse_args(args)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    if args.command == "export":
+        export(args.model, args.output, args.normalization,
+               args.history_horizon, args.statistics_window)
+    else:
+        run(args.policy, args.port, args.batch_size,
+            args.max_delay_ms / constants.UNIT_FACTOR, args.metrics_interval,
+            args.cpus, args.nice, args.realtime_priority)
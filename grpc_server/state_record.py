@@ -0,0 +1,150 @@
+"""
+Fixed layout of a CommunicationState packed into a float64 record
+
+The CommunicationState fields come first, in field number order, followed by
+the metadata added by the server.
+"""
+
+import operator
+
+import numpy as np
+
+from envs.utils.constants import COMMUNICATION_STATE_FIELDS, Parameters
+from protos import congestion_control_pb2
+
+# CommunicationState fields in field number order, the order of a record
+FIELD_NAMES = tuple(
+    field.name for field in sorted(
+        congestion_control_pb2.CommunicationState.DESCRIPTOR.fields,
+        key=lambda field: field.number)
+)
+# Metadata offsets: the stream the state was received on, the env the
+# stream belongs to, the states of that stream dropped or merged by the
+# server so far, the sequence number of the state in the stream, the
+# action deadlines missed so far, whether the state falls between two
+# decisions, answered by the server instead of the env, the time the server
+# received it, in microseconds since the epoch, and the estimated offset of
+# the clock of the server from the one of Mockets, in milliseconds
+STREAM_ID = len(FIELD_NAMES)
+ENV_ID = STREAM_ID + 1
+DROPPED_STATES = STREAM_ID + 2
+MERGED_STATES = STREAM_ID + 3
+SEQUENCE = STREAM_ID + 4
+DEADLINE_MISSES = STREAM_ID + 5
+INTERMEDIATE = STREAM_ID + 6
+RECEIVED_US = STREAM_ID + 7
+CLOCK_OFFSET = STREAM_ID + 8
+RECORD_WIDTH = CLOCK_OFFSET + 1
+
+# Offset of each Parameters value in a record
+OFFSET = dict(
+    (COMMUNICATION_STATE_FIELDS[name], offset)
+    for offset, name in enumerate(FIELD_NAMES)
+)
+
+# Counters over the last timeframe, the bytes and the retransmissions the
+# env sums over a decision interval
+_TIMEFRAME_OFFSETS = np.array([
+    offset for offset, name in enumerate(FIELD_NAMES)
+    if name.endswith("_timeframe") or name == "retransmissions"
+])
+
+# Counters a batch can delta encode
+_CUMULATIVE_OFFSETS = np.array([
+    offset for offset, name in enumerate(FIELD_NAMES)
+    if name.startswith("cumulative_")
+])
+
+_SEQUENCE_ID = OFFSET[Parameters.SEQUENCE_ID]
+# Integer fields of a CommunicationState
+_INTEGER_FIELDS = ("timestamp", "sequence_id")
+
+# A batch packs the first field_count CommunicationState fields of every
+# state. Fields are only ever appended, a client built against an older
+# CommunicationState packs fewer of them and the missing ones are 0, as
+# they are in a CommunicationState it sends. Fields of a newer one are
+# ignored. The first batch layout ended with acked_bytes_timeframe
+MIN_BATCH_FIELD_COUNT = FIELD_NAMES.index("acked_bytes_timeframe") + 1
+
+_read_fields = operator.attrgetter(*FIELD_NAMES)
+_EMPTY_METADATA = (0,) * (RECORD_WIDTH - ENV_ID - 1)
+
+
+def decode(status: congestion_control_pb2.CommunicationState,
+           stream_id: int = 0, env_id: int = 0) -> np.ndarray:
+    """Pack the fields of a CommunicationState in record order"""
+    return np.array(_read_fields(status) + (stream_id, env_id) + _EMPTY_METADATA,
+                    dtype=np.float64)
+
+
+def decode_batch(batch: congestion_control_pb2.CommunicationStateBatch,
+                 stream_id: int = 0, env_id: int = 0) -> np.ndarray:
+    """Records of the states of a batch, one per row, see MIN_BATCH_FIELD_COUNT"""
+    field_count = batch.field_count
+    if field_count < MIN_BATCH_FIELD_COUNT:
+        raise ValueError(f"Batch states have {field_count} fields, "
+                         f"at least {MIN_BATCH_FIELD_COUNT} are expected")
+    if len(batch.values) % field_count:
+        raise ValueError(f"Batch of {len(batch.values)} values does not "
+                         f"hold states of {field_count} fields")
+
+    values = np.array(batch.values, dtype=np.float64).reshape(-1, field_count)
+    known = min(field_count, len(FIELD_NAMES))
+    records = np.zeros((len(values), RECORD_WIDTH))
+    records[:, :known] = values[:, :known]
+    if batch.delta_encoded:
+        records[:, _CUMULATIVE_OFFSETS] = np.cumsum(records[:, _CUMULATIVE_OFFSETS], axis=0)
+    records[:, STREAM_ID] = stream_id
+    records[:, ENV_ID] = env_id
+
+    return records
+
+
+def encode_batch(records: np.ndarray, delta_encoded: bool = False,
+                 field_count: int = len(FIELD_NAMES)
+                 ) -> congestion_control_pb2.CommunicationStateBatch:
+    """
+    Pack records, one per row, in a CommunicationStateBatch, with the first
+    field_count fields as a client built against an older CommunicationState
+    """
+    values = np.array(records[:, :STREAM_ID], dtype=np.float64)
+    if delta_encoded:
+        values[1:, _CUMULATIVE_OFFSETS] = np.diff(values[:, _CUMULATIVE_OFFSETS], axis=0)
+
+    return congestion_control_pb2.CommunicationStateBatch(
+        values=values[:, :field_count].reshape(-1), field_count=field_count,
+        delta_encoded=delta_encoded)
+
+
+def sequence_id(record: np.ndarray) -> int:
+    """Id the Action answering a record echoes, the one Mockets gave the state or its sequence number"""
+    return int(record[_SEQUENCE_ID]) or int(record[SEQUENCE])
+
+
+def coalesce(older: np.ndarray, newer: np.ndarray) -> np.ndarray:
+    """
+    Fold a record into the one that followed it, in place: counters over the
+    timeframe add up so the merged record covers both timeframes, every
+    other field keeps its newest value
+    """
+    newer[_TIMEFRAME_OFFSETS] += older[_TIMEFRAME_OFFSETS]
+
+    return newer
+
+
+def encode(record: np.ndarray) -> congestion_control_pb2.CommunicationState:
+    """Build the CommunicationState a record was packed from, without metadata"""
+    status = congestion_control_pb2.CommunicationState()
+    for name, value in zip(FIELD_NAMES, record.tolist()):
+        if name in _INTEGER_FIELDS:
+            value = int(value)
+        elif name == "finished":
+            value = bool(value)
+        setattr(status, name, value)
+
+    return status
+
+
+assert set(FIELD_NAMES) == set(COMMUNICATION_STATE_FIELDS), \
+    "COMMUNICATION_STATE_FIELDS must match the CommunicationState fields"
+assert Parameters.TIMESTAMP in OFFSET and Parameters.FINISHED in OFFSET
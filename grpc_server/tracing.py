@@ -0,0 +1,203 @@
+"""
+Per-hop timestamps of the control loop written to compact binary traces
+
+Every state is traced at each hop it goes through: received on the wire and
+published to the env by the gRPC server, taken by the env, answered with an
+action put on the action channel and sent back to Mockets by the server. The
+server and the env each write their hops to their own trace as fixed-width
+rows, joined offline on the stream, the sequence number and the receive time
+of the state. All times are wall clock microseconds of the host, the
+timestamps of Mockets are brought to the host clock with a ``ClockOffset``.
+
+Summarize traces with:
+python -m grpc_server.tracing logs/trace.server logs/trace.env-50051
+"""
+
+import argparse
+import time
+from typing import Dict, Iterable, Optional, Tuple
+
+import numpy as np
+
+# What a server row answered: a state the env decided on, an intermediate
+# state between two decisions, a state whose deadline was missed and the
+# late action of the env for one of those
+DECISION, INTERMEDIATE, FALLBACK, LATE = range(4)
+ACTION_KINDS = ("decision", "intermediate", "fallback", "late")
+
+# Hops of a state at the server, one row per Action sent to Mockets.
+# pending_states are the newer states already received when the action was
+# sent: the action answers a stale state when there are some
+SERVER_TRACE_DTYPE = np.dtype([
+    ('stream_id', np.int64), ('sequence', np.int64), ('sequence_id', np.int64),
+    ('kind', np.int64), ('timestamp_ms', np.int64), ('clock_offset_us', np.int64),
+    ('received_us', np.int64), ('published_us', np.int64), ('sent_us', np.int64),
+    ('pending_states', np.int64), ('cwnd', np.int64),
+])
+
+# Hops of a state at the env, one row per action put on the channel
+ENV_TRACE_DTYPE = np.dtype([
+    ('stream_id', np.int64), ('sequence', np.int64), ('received_us', np.int64),
+    ('dequeued_us', np.int64), ('action_put_us', np.int64), ('cwnd', np.int64),
+])
+
+# Server and env hops of the states the env decided on
+JOINED_TRACE_DTYPE = np.dtype(
+    [(name, SERVER_TRACE_DTYPE[name]) for name in SERVER_TRACE_DTYPE.names]
+    + [('dequeued_us', np.int64), ('action_put_us', np.int64)]
+)
+
+# Latency of each hop as (name, from, to) columns of a joined trace
+HOPS = (
+    ("server_queue", "received_us", "published_us"),
+    ("channel", "published_us", "dequeued_us"),
+    ("agent", "dequeued_us", "action_put_us"),
+    ("action_return", "action_put_us", "sent_us"),
+    ("control_loop", "received_us", "sent_us"),
+)
+
+
+def now_us() -> int:
+    """Wall clock time of the host in microseconds, the time of every hop"""
+    return time.time_ns() // 1000
+
+
+class ClockOffset:
+    """
+    Offset of the host clock from the clock of a Mockets sender.
+
+    Mockets stamps its states with its own clock, in milliseconds, and the
+    server notes when it receives them. Each state bounds the offset from
+    above by its receive time minus its timestamp, which is the offset plus
+    the time the state travelled, queueing included. The smallest bound of
+    a connection, given by the state that travelled the fastest, is the
+    estimate: it is only off by the shortest transit time, in the order of
+    the delay between the containers and the host. The clocks drift by far
+    less than that over a connection.
+    """
+
+    def __init__(self):
+        self.offset_ms = None
+
+    def observe(self, timestamp_ms: float, received_us: int) -> float:
+        """Update the estimate with a state, returns it in milliseconds"""
+        bound = received_us / 1000 - timestamp_ms
+        if self.offset_ms is None or bound < self.offset_ms:
+            self.offset_ms = bound
+
+        return self.offset_ms
+
+
+class TraceWriter:
+    """
+    Appends rows of a structured dtype to a binary file.
+
+    Rows are filled in place in a preallocated buffer and written when it
+    is full or ``flush`` is called, so tracing a hop is a few integer
+    assignments. The file is opened in append mode: the servers and
+    episodes following each other add to the same trace.
+    """
+
+    def __init__(self, path: str, dtype: np.dtype, buffer_rows: int = 1024):
+        self.path = path
+        self._rows = np.zeros(buffer_rows, dtype=dtype)
+        self._size = 0
+        self._file = open(path, "ab")
+
+    def append(self, *values) -> None:
+        """Add a row, values follow the fields of the dtype"""
+        self._rows[self._size] = values
+        self._size += 1
+        if self._size == len(self._rows):
+            self.flush()
+
+    def flush(self) -> None:
+        if self._file.closed:
+            return
+        if self._size:
+            self._rows[:self._size].tofile(self._file)
+            self._size = 0
+        self._file.flush()
+
+    def close(self) -> None:
+        if not self._file.closed:
+            self.flush()
+            self._file.close()
+
+
+def read_trace(path: str, dtype: np.dtype) -> np.ndarray:
+    return np.fromfile(path, dtype=dtype)
+
+
+def join(server_rows: np.ndarray, env_rows: np.ndarray) -> np.ndarray:
+    """
+    Server rows of the actions computed by the env with the env hops of
+    their state, fallbacks and intermediate states are left out
+    """
+    # The receive time tells apart the streams of servers started one after
+    # the other, which number their streams from 1
+    env_hops: Dict[Tuple[int, int, int], Tuple[int, int]] = dict(
+        ((int(row['stream_id']), int(row['sequence']), int(row['received_us'])),
+         (int(row['dequeued_us']), int(row['action_put_us'])))
+        for row in env_rows
+    )
+
+    joined = []
+    for row in server_rows[np.isin(server_rows['kind'], (DECISION, LATE))]:
+        hops = env_hops.get((int(row['stream_id']), int(row['sequence']), int(row['received_us'])))
+        if hops is not None:
+            joined.append(tuple(row.tolist()) + hops)
+
+    return np.array(joined, dtype=JOINED_TRACE_DTYPE)
+
+
+def summary(server_rows: np.ndarray, env_rows: Optional[np.ndarray] = None) -> dict:
+    """
+    Actions of every kind, how many answered stale states, the transit of
+    the states from Mockets and, given the env trace, the latency of every
+    hop in microseconds
+    """
+    def percentiles(values: np.ndarray) -> dict:
+        return {
+            'count': len(values),
+            'mean_us': float(values.mean()),
+            'p50_us': float(np.percentile(values, 50)),
+            'p99_us': float(np.percentile(values, 99)),
+            'max_us': float(values.max()),
+        }
+
+    result = {
+        'actions': dict((name, int(np.count_nonzero(server_rows['kind'] == kind)))
+                        for kind, name in enumerate(ACTION_KINDS)),
+        'stale_actions': int(np.count_nonzero(server_rows['pending_states'])),
+    }
+    if len(server_rows):
+        # Above the fastest transit, the one the clock offset includes
+        transit = server_rows['received_us'] - server_rows['clock_offset_us'] - server_rows['timestamp_ms'] * 1000
+        result['transit'] = percentiles(transit)
+
+    if env_rows is not None:
+        joined = join(server_rows, env_rows)
+        if len(joined):
+            result['hops'] = dict((name, percentiles(joined[end] - joined[start]))
+                                  for name, start, end in HOPS)
+
+    return result
+
+
+def parse_args(args: Optional[Iterable[str]] = None):
+    parser = argparse.ArgumentParser(description="Summarize control loop traces")
+    parser.add_argument("server_trace", type=str)
+    parser.add_argument("env_traces", type=str, nargs="*")
+
+    return parser.parse_args(args)
+
+
+if __name__ == "__main__":
+    import pprint
+
+    args = parse_args()
+    env_rows = None
+    if args.env_traces:
+        env_rows = np.concatenate([read_trace(path, ENV_TRACE_DTYPE) for path in args.env_traces])
+    pprint.pprint(summary(read_trace(args.server_trace, SERVER_TRACE_DTYPE), env_rows))
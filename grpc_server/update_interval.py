@@ -0,0 +1,76 @@
+"""Interval between two states the server asks Mockets for"""
+
+import math
+
+# Weight of the newest round trip in the smoothed one, as for TCP's SRTT
+_ALPHA = 0.125
+# Interval over the smoothed round trip of an action
+_HEADROOM = 1.25
+# Interval growth when states pile up
+_BACKOFF = 1.5
+# Interval decrease per action otherwise, in milliseconds
+_STEP_MS = 1
+
+
+class UpdateIntervalController:
+    """
+    Shortest ``-congestionUpdate`` interval the env keeps up with.
+
+    It is fed with the round trip of every action, from its state being
+    published to the env to the action coming back, and with the states
+    waiting behind it. States piling up multiply the interval by
+    ``_BACKOFF``, otherwise it is brought down by ``_STEP_MS`` per action
+    towards the smoothed round trip with some headroom. With a decision
+    interval of several states the round trip is spread over them.
+
+    Intervals are whole milliseconds, as Mockets takes them.
+    """
+
+    def __init__(self, interval_ms: int = 0, min_interval_ms: int = 1,
+                 max_interval_ms: int = 1000, states_per_decision: int = 1):
+        """
+        :param interval_ms: interval Mockets was started with, 0 if unknown
+        :param min_interval_ms: shortest interval requested
+        :param max_interval_ms: longest interval requested
+        :param states_per_decision: states answered by every action
+        """
+        if min_interval_ms < 1 or max_interval_ms < min_interval_ms:
+            raise ValueError(f"Invalid update interval range [{min_interval_ms}, {max_interval_ms}] ms")
+
+        self.min_interval_ms = min_interval_ms
+        self.max_interval_ms = max_interval_ms
+        self.states_per_decision = states_per_decision
+        self.interval_ms = None if interval_ms <= 0 else self._bound(interval_ms)
+        self.round_trip_ms = None
+
+    def _bound(self, interval_ms: float) -> int:
+        return min(max(math.ceil(interval_ms), self.min_interval_ms), self.max_interval_ms)
+
+    def observe(self, round_trip: float, queue_depth: int) -> int:
+        """
+        Interval to request in the Action answering a state, 0 to keep the
+        current one
+
+        :param round_trip: seconds from the state being published to the
+            env to its action coming back
+        :param queue_depth: states received meanwhile and still waiting
+        """
+        round_trip_ms = round_trip * 1e3
+        if self.round_trip_ms is None:
+            self.round_trip_ms = round_trip_ms
+        else:
+            self.round_trip_ms += _ALPHA * (round_trip_ms - self.round_trip_ms)
+        target_ms = self.round_trip_ms * _HEADROOM / self.states_per_decision
+
+        if self.interval_ms is None:
+            interval_ms = target_ms
+        elif queue_depth > 0:
+            interval_ms = max(self.interval_ms * _BACKOFF, target_ms)
+        else:
+            interval_ms = max(self.interval_ms - _STEP_MS, target_ms)
+        interval_ms = self._bound(interval_ms)
+
+        if interval_ms == self.interval_ms:
+            return 0
+        self.interval_ms = interval_ms
+        return interval_ms
@@ -13,7 +13,7 @@ _sym_db = _symbol_database.Default()
 
 
 
-DESCRIPTOR = _descriptor_pool.Default().AddSerializedFile(b'\n\x1fprotos/congestion_control.proto\x12\x11\x63ongestioncontrol\"\xd6\x03\n\x12\x43ommunicationState\x12\x18\n\x10\x63urr_window_size\x18\x01 \x01(\x01\x12\x1d\n\x15\x63umulative_sent_bytes\x18\x02 \x01(\x01\x12\x1c\n\x14\x63umulative_rcv_bytes\x18\x03 \x01(\x01\x12\"\n\x1a\x63umulative_sent_good_bytes\x18\x04 \x01(\x01\x12\x1c\n\x14sent_bytes_timeframe\x18\x05 \x01(\x01\x12!\n\x19sent_good_bytes_timeframe\x18\x06 \x01(\x01\x12\x13\n\x0bunack_bytes\x18\x07 \x01(\x01\x12\"\n\x1a\x63umulative_retransmissions\x18\x08 \x01(\x01\x12\x17\n\x0fretransmissions\x18\t \x01(\x01\x12\x1b\n\x13\x65ma_retransmissions\x18\n \x01(\x01\x12\x10\n\x08last_rtt\x18\x0b \x01(\x01\x12\x0f\n\x07min_rtt\x18\x0c \x01(\x01\x12\x0f\n\x07max_rtt\x18\r \x01(\x01\x12\x0c\n\x04srtt\x18\x0e \x01(\x01\x12\x0f\n\x07var_rtt\x18\x0f \x01(\x01\x12\x11\n\ttimestamp\x18\x10 \x01(\x03\x12\x10\n\x08\x66inished\x18\x11 \x01(\x08\x12\x1d\n\x15\x61\x63ked_bytes_timeframe\x18\x12 \x01(\x01\"\x1d\n\x06\x41\x63tion\x12\x13\n\x0b\x63wnd_update\x18\x01 \x01(\x03\x32x\n\x11\x43ongestionControl\x12\x63\n\x19OptimizeCongestionControl\x12%.congestioncontrol.CommunicationState\x1a\x19.congestioncontrol.Action\"\x00(\x01\x30\x01\x42\x1a\x42\x16\x43ongestionControlProtoP\x01\x62\x06proto3')
+DESCRIPTOR = _descriptor_pool.Default().AddSerializedFile(b'\n\x1fprotos/congestion_control.proto\x12\x11\x63ongestioncontrol\"\xeb\x03\n\x12\x43ommunicationState\x12\x18\n\x10\x63urr_window_size\x18\x01 \x01(\x01\x12\x1d\n\x15\x63umulative_sent_bytes\x18\x02 \x01(\x01\x12\x1c\n\x14\x63umulative_rcv_bytes\x18\x03 \x01(\x01\x12\"\n\x1a\x63umulative_sent_good_bytes\x18\x04 \x01(\x01\x12\x1c\n\x14sent_bytes_timeframe\x18\x05 \x01(\x01\x12!\n\x19sent_good_bytes_timeframe\x18\x06 \x01(\x01\x12\x13\n\x0bunack_bytes\x18\x07 \x01(\x01\x12\"\n\x1a\x63umulative_retransmissions\x18\x08 \x01(\x01\x12\x17\n\x0fretransmissions\x18\t \x01(\x01\x12\x1b\n\x13\x65ma_retransmissions\x18\n \x01(\x01\x12\x10\n\x08last_rtt\x18\x0b \x01(\x01\x12\x0f\n\x07min_rtt\x18\x0c \x01(\x01\x12\x0f\n\x07max_rtt\x18\r \x01(\x01\x12\x0c\n\x04srtt\x18\x0e \x01(\x01\x12\x0f\n\x07var_rtt\x18\x0f \x01(\x01\x12\x11\n\ttimestamp\x18\x10 \x01(\x03\x12\x10\n\x08\x66inished\x18\x11 \x01(\x08\x12\x1d\n\x15\x61\x63ked_bytes_timeframe\x18\x12 \x01(\x01\x12\x13\n\x0bsequence_id\x18\x13 \x01(\x04\"U\n\x17\x43ommunicationStateBatch\x12\x0e\n\x06values\x18\x01 \x03(\x01\x12\x13\n\x0b\x66ield_count\x18\x02 \x01(\r\x12\x15\n\rdelta_encoded\x18\x03 \x01(\x08\"N\n\x06\x41\x63tion\x12\x13\n\x0b\x63wnd_update\x18\x01 \x01(\x03\x12\x1a\n\x12update_interval_ms\x18\x02 \x01(\r\x12\x13\n\x0bsequence_id\x18\x03 \x01(\x04\x32\xe9\x01\n\x11\x43ongestionControl\x12\x63\n\x19OptimizeCongestionControl\x12%.congestioncontrol.CommunicationState\x1a\x19.congestioncontrol.Action\"\x00(\x01\x30\x01\x12o\n OptimizeCongestionControlBatched\x12*.congestioncontrol.CommunicationStateBatch\x1a\x19.congestioncontrol.Action\"\x00(\x01\x30\x01\x42\x1a\x42\x16\x43ongestionControlProtoP\x01\x62\x06proto3')
 
 _builder.BuildMessageAndEnumDescriptors(DESCRIPTOR, globals())
 _builder.BuildTopDescriptorsAndMessages(DESCRIPTOR, 'protos.congestion_control_pb2', globals())
@@ -22,9 +22,11 @@ if _descriptor._USE_C_DESCRIPTORS == False:
   DESCRIPTOR._options = None
   DESCRIPTOR._serialized_options = b'B\026CongestionControlProtoP\001'
   _COMMUNICATIONSTATE._serialized_start=55
-  _COMMUNICATIONSTATE._serialized_end=525
-  _ACTION._serialized_start=527
-  _ACTION._serialized_end=556
-  _CONGESTIONCONTROL._serialized_start=558
-  _CONGESTIONCONTROL._serialized_end=678
+  _COMMUNICATIONSTATE._serialized_end=546
+  _COMMUNICATIONSTATEBATCH._serialized_start=548
+  _COMMUNICATIONSTATEBATCH._serialized_end=633
+  _ACTION._serialized_start=635
+  _ACTION._serialized_end=713
+  _CONGESTIONCONTROL._serialized_start=716
+  _CONGESTIONCONTROL._serialized_end=949
 # @@protoc_insertion_point(module_scope)
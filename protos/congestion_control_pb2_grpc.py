@@ -20,6 +20,11 @@ class CongestionControlStub(object):
                 request_serializer=protos_dot_congestion__control__pb2.CommunicationState.SerializeToString,
                 response_deserializer=protos_dot_congestion__control__pb2.Action.FromString,
                 )
+        self.OptimizeCongestionControlBatched = channel.stream_stream(
+                '/congestioncontrol.CongestionControl/OptimizeCongestionControlBatched',
+                request_serializer=protos_dot_congestion__control__pb2.CommunicationStateBatch.SerializeToString,
+                response_deserializer=protos_dot_congestion__control__pb2.Action.FromString,
+                )
 
 
 class CongestionControlServicer(object):
@@ -36,6 +41,14 @@ class CongestionControlServicer(object):
         context.set_details('Method not implemented!')
         raise NotImplementedError('Method not implemented!')
 
+    def OptimizeCongestionControlBatched(self, request_iterator, context):
+        """Same exchange with several states per message, each of them is
+        answered by an Action
+        """
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
 
 def add_CongestionControlServicer_to_server(servicer, server):
     rpc_method_handlers = {
@@ -44,6 +57,11 @@ def add_CongestionControlServicer_to_server(servicer, server):
                     request_deserializer=protos_dot_congestion__control__pb2.CommunicationState.FromString,
                     response_serializer=protos_dot_congestion__control__pb2.Action.SerializeToString,
             ),
+            'OptimizeCongestionControlBatched': grpc.stream_stream_rpc_method_handler(
+                    servicer.OptimizeCongestionControlBatched,
+                    request_deserializer=protos_dot_congestion__control__pb2.CommunicationStateBatch.FromString,
+                    response_serializer=protos_dot_congestion__control__pb2.Action.SerializeToString,
+            ),
     }
     generic_handler = grpc.method_handlers_generic_handler(
             'congestioncontrol.CongestionControl', rpc_method_handlers)
@@ -71,3 +89,20 @@ class CongestionControl(object):
             protos_dot_congestion__control__pb2.Action.FromString,
             options, channel_credentials,
             insecure, call_credentials, compression, wait_for_ready, timeout, metadata)
+
+    @staticmethod
+    def OptimizeCongestionControlBatched(request_iterator,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.stream_stream(request_iterator, target, '/congestioncontrol.CongestionControl/OptimizeCongestionControlBatched',
+            protos_dot_congestion__control__pb2.CommunicationStateBatch.SerializeToString,
+            protos_dot_congestion__control__pb2.Action.FromString,
+            options, channel_credentials,
+            insecure, call_credentials, compression, wait_for_ready, timeout, metadata)
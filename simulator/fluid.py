@@ -0,0 +1,326 @@
+"""
+Fluid model of a Mockets sender behind the bottleneck of the dumbbell
+topology of network_generator.py
+
+Bytes are treated as a fluid advanced in ticks of a millisecond: the sender
+puts up to its window in flight, the bottleneck serves a FIFO queue shared
+with the MGEN cross-traffic at the link rate and drops what does not fit in
+its buffer, the link loses a share of the bytes it delivers, and what gets
+through is acknowledged after the round trip propagation delay. Lost bytes
+are noticed one round trip after they were sent and retransmitted first. The
+model is deterministic, losses are applied as expected values.
+"""
+
+import collections
+import math
+from typing import NamedTuple, Optional
+
+from envs.utils import constants
+from envs.utils.traffic_generator import TrafficGenerator
+
+# Bytes of a Mockets packet
+PACKET_SIZE_BYTES = constants.PACKET_SIZE_KB * constants.UNIT_FACTOR
+# Bytes of the MGEN messages of the elephant and UDP mice flows, and of the
+# TCP mice flow
+MGEN_MESSAGE_BYTES = 1024
+MGEN_TCP_MICE_MESSAGE_BYTES = 32768
+# Period of the MGEN script and duration of each of its four slots, seconds
+TRAFFIC_PERIOD = 8.0
+TRAFFIC_SLOT = 2.0
+# Period and duration of the bursts of the UDP mice flow, seconds
+MICE_BURST_PERIOD = 2.5
+MICE_BURST = 0.333
+# Weight of a new sample in the smoothed RTT and RTT variation (RFC 6298) and
+# in the moving average of the retransmissions
+_RTT_ALPHA = 1 / 8
+_RTT_BETA = 1 / 4
+_RETRANSMISSIONS_ALPHA = 1 / 8
+
+
+class Link(NamedTuple):
+    """Settings of the bottleneck, as given to MininetService"""
+    bandwidth_mbps: float
+    delay_ms: float
+    loss_percent: float = 0.0
+
+
+def parse_delay(delay) -> float:
+    """Milliseconds of a Mininet delay like "100ms", or of a number"""
+    if isinstance(delay, str):
+        delay = delay.strip()
+        if delay.endswith("ms"):
+            return float(delay[:-2])
+        if delay.endswith("s"):
+            return float(delay[:-1]) * constants.UNIT_FACTOR
+    return float(delay)
+
+
+class CrossTraffic:
+    """
+    Rate of the MGEN traffic of a TrafficGenerator script over time.
+
+    The four patterns of the script take turns in slots of two seconds
+    every eight seconds, the TCP mice flow sends all along and the UDP mice
+    flow in short bursts. MGEN sends at the rates of the script whatever the
+    congestion, TCP flows included.
+    """
+
+    def __init__(self, generator: TrafficGenerator):
+        self.generator = generator
+        self.start_s = 0.0
+        self._slot_rates = (0.0,) * 4
+        self._tcp_mice_rate = 0.0
+        self._udp_mice_rate = 0.0
+
+    def restart(self, now_s: float, factor: Optional[float] = None) -> None:
+        """
+        Start the script again at now_s, the fixed evaluation script or, given
+        the ratio of the new bandwidth to the starting one, the script of a
+        varied link, as MininetService.exposed_timed_link_update does
+        """
+        if factor is None:
+            self.generator.generate_fixed_script(receiver_ip="10.0.2.2")
+        else:
+            self.generator.generate_script_new_link(receiver_ip="10.0.2.2", factor=factor)
+        self.start_s = now_s
+        # MGEN rates are in messages per second
+        self._slot_rates = tuple(pattern.packets * MGEN_MESSAGE_BYTES for pattern in self.generator.current_patterns)
+        self._tcp_mice_rate = self.generator.tcp_mice.packets * MGEN_TCP_MICE_MESSAGE_BYTES
+        self._udp_mice_rate = self.generator.udp_mice.packets * MGEN_MESSAGE_BYTES
+
+    def rate(self, now_s: float) -> float:
+        """Bytes per second sent at now_s"""
+        elapsed = now_s - self.start_s
+        if elapsed < 0:
+            return 0.0
+        rate = self._slot_rates[int(elapsed % TRAFFIC_PERIOD // TRAFFIC_SLOT)] + self._tcp_mice_rate
+        if elapsed % MICE_BURST_PERIOD < MICE_BURST:
+            rate += self._udp_mice_rate
+
+        return rate
+
+
+class FluidSimulation:
+    """
+    A window limited sender, always backlogged unless episode_bytes is set,
+    and the bottleneck between it and its receiver.
+
+    ``advance`` runs the model for an update interval and returns the
+    counters of a CommunicationState, ``set_cwnd`` applies an action, after
+    action_delay_ms of simulated time. Byte counters are in KB and times in
+    milliseconds, as Mockets sends them.
+
+    :param link: starting settings of the bottleneck
+    :param queue_packets: packets the bottleneck buffers, the netem default
+        of Mininet links
+    :param cross_traffic: MGEN traffic sharing the bottleneck, None for none
+    :param episode_bytes: bytes to deliver before finishing, None to send
+        forever
+    :param initial_cwnd: window before the first action, bytes
+    :param action_delay_ms: simulated time between a state and the window
+        of its action being applied
+    :param tick_ms: time step of the model
+    """
+
+    def __init__(self, link: Link, queue_packets: int = 1000,
+                 cross_traffic: Optional[CrossTraffic] = None,
+                 episode_bytes: Optional[float] = None,
+                 initial_cwnd: float = 10 * PACKET_SIZE_BYTES,
+                 action_delay_ms: float = 0.0, tick_ms: float = 1.0):
+        self.tick_ms = tick_ms
+        self._tick_s = tick_ms / constants.UNIT_FACTOR
+        self.queue_bytes = queue_packets * PACKET_SIZE_BYTES
+        self.cross_traffic = cross_traffic
+        self.episode_bytes = episode_bytes
+        self.action_delay_ms = action_delay_ms
+        self.tick = 0
+        self.set_link(link)
+        # Link applied at a tick, see schedule_link
+        self._next_link = None
+        self._next_link_tick = None
+        self._next_traffic_factor = None
+
+        self.cwnd = initial_cwnd
+        self._pending_cwnd = collections.deque()
+        # Bytes in flight, lost and not yet noticed, waiting to be
+        # retransmitted, and new bytes still to send
+        self.inflight = 0.0
+        self._retransmit_backlog = 0.0
+        self._data_left = math.inf if episode_bytes is None else float(episode_bytes)
+        # FIFO of [tick sent, bytes of the sender, bytes in all] at the
+        # bottleneck, and the bytes it holds
+        self._queue = collections.deque()
+        self._queued = 0.0
+        # Acked bytes, lost bytes and RTT sample reaching the sender at a tick
+        self._arrivals = collections.defaultdict(lambda: [0.0, 0.0, None])
+
+        self.cumulative_sent = 0.0
+        self.cumulative_good = 0.0
+        self.cumulative_acked = 0.0
+        self.cumulative_retransmissions = 0.0
+        self.ema_retransmissions = 0.0
+        # Fraction of a packet retransmitted and not yet counted
+        self._retransmitted_packets = 0.0
+        self.last_rtt = 0.0
+        self.min_rtt = 0.0
+        self.max_rtt = 0.0
+        self.srtt = 0.0
+        self.var_rtt = 0.0
+        self.finished = False
+
+    @property
+    def now_ms(self) -> float:
+        return self.tick * self.tick_ms
+
+    def set_link(self, link: Link) -> None:
+        self.link = link
+        # Bytes served per tick, ticks of the round trip propagation delay
+        self._service = link.bandwidth_mbps * 125000 * self.tick_ms / constants.UNIT_FACTOR
+        self._round_trip_ticks = max(1, round(2 * link.delay_ms / self.tick_ms))
+        self._loss = link.loss_percent / 100
+
+    def schedule_link(self, link: Link, after_s: float, traffic_factor: Optional[float] = None) -> None:
+        """Switch to link after_s seconds from now, restarting the cross-traffic with traffic_factor"""
+        self._next_link = link
+        self._next_link_tick = self.tick + round(after_s * constants.UNIT_FACTOR / self.tick_ms)
+        self._next_traffic_factor = traffic_factor
+
+    def set_cwnd(self, cwnd: float) -> None:
+        self._pending_cwnd.append((self.tick + round(self.action_delay_ms / self.tick_ms), cwnd))
+
+    def _sample_rtt(self, rtt: float) -> None:
+        self.last_rtt = rtt
+        if self.srtt == 0.0:
+            self.srtt = rtt
+            self.var_rtt = rtt / 2
+            self.min_rtt = self.max_rtt = rtt
+        else:
+            self.var_rtt = (1 - _RTT_BETA) * self.var_rtt + _RTT_BETA * abs(self.srtt - rtt)
+            self.srtt = (1 - _RTT_ALPHA) * self.srtt + _RTT_ALPHA * rtt
+            self.min_rtt = min(self.min_rtt, rtt)
+            self.max_rtt = max(self.max_rtt, rtt)
+
+    def _step(self, counters: list) -> None:
+        """Advance a tick, counters are the sent, good, acked and retransmitted bytes of the interval"""
+        tick = self.tick
+        if tick == self._next_link_tick:
+            self.set_link(self._next_link)
+            if self.cross_traffic is not None:
+                self.cross_traffic.restart(self.now_ms / constants.UNIT_FACTOR, self._next_traffic_factor)
+            self._next_link = self._next_link_tick = None
+        pending_cwnd = self._pending_cwnd
+        while pending_cwnd and pending_cwnd[0][0] <= tick:
+            self.cwnd = pending_cwnd.popleft()[1]
+        arrivals = self._arrivals
+        queue = self._queue
+        round_trip_ticks = self._round_trip_ticks
+        inflight = self.inflight
+
+        # Acks and losses noticed by the sender
+        arrival = arrivals.pop(tick, None)
+        if arrival is not None:
+            acked, lost, rtt = arrival
+            inflight -= acked + lost
+            self._retransmit_backlog += lost
+            self.cumulative_acked += acked
+            counters[2] += acked
+            if rtt is not None:
+                self._sample_rtt(rtt)
+            if self.episode_bytes is not None and self.cumulative_acked >= self.episode_bytes - 1e-6:
+                self.finished = True
+
+        # Retransmissions go first, then new bytes, as much as the window allows
+        sent = 0.0
+        room = self.cwnd - inflight
+        if room > 0:
+            retransmitted = min(room, self._retransmit_backlog)
+            good = min(room - retransmitted, self._data_left)
+            self._retransmit_backlog -= retransmitted
+            self._data_left -= good
+            sent = retransmitted + good
+            inflight += sent
+            counters[0] += sent
+            counters[1] += good
+            counters[3] += retransmitted
+        self.inflight = inflight
+
+        # Arrivals at the bottleneck, tail dropped past its buffer
+        arriving = sent
+        if self.cross_traffic is not None:
+            arriving += self.cross_traffic.rate(tick * self._tick_s) * self._tick_s
+        queued = self._queued
+        if arriving > 0:
+            kept = min(1.0, max(0.0, self.queue_bytes - queued) / arriving)
+            if kept < 1.0 and sent > 0:
+                # Noticed when the bytes behind them are acked
+                queueing_ticks = math.ceil(queued / self._service)
+                arrivals[tick + queueing_ticks + round_trip_ticks][1] += sent * (1 - kept)
+            if kept > 0:
+                if queue and (sent == 0 or queue[-1][0] == tick):
+                    # Only bytes of the sender need their own sending time
+                    tail = queue[-1]
+                    tail[1] += sent * kept
+                    tail[2] += arriving * kept
+                else:
+                    queue.append([tick, sent * kept, arriving * kept])
+                queued += arriving * kept
+
+        # Departures at the link rate, the link loses a share of them
+        budget = self._service
+        while budget > 0 and queue:
+            head = queue[0]
+            served = min(budget, head[2])
+            departed = head[1] * served / head[2]
+            head[1] -= departed
+            head[2] -= served
+            queued -= served
+            budget -= served
+            if head[2] <= 1e-9:
+                queue.popleft()
+            if departed > 0:
+                arrival = arrivals[tick + round_trip_ticks]
+                arrival[0] += departed * (1 - self._loss)
+                arrival[1] += departed * self._loss
+                arrival[2] = (tick - head[0] + round_trip_ticks) * self.tick_ms
+        self._queued = queued if queue else 0.0
+
+        self.tick = tick + 1
+
+    def advance(self, duration_ms: float) -> dict:
+        """Run the model for duration_ms, the CommunicationState fields at its end"""
+        counters = [0.0, 0.0, 0.0, 0.0]
+        end = self.tick + max(1, round(duration_ms / self.tick_ms))
+        while self.tick < end and not self.finished:
+            self._step(counters)
+        sent, good, acked, retransmitted = counters
+
+        # Mockets counts whole packets
+        self._retransmitted_packets += retransmitted / PACKET_SIZE_BYTES
+        retransmissions = math.floor(self._retransmitted_packets + 1e-9)
+        self._retransmitted_packets -= retransmissions
+        self.cumulative_sent += sent
+        self.cumulative_good += good
+        self.cumulative_retransmissions += retransmissions
+        self.ema_retransmissions = (1 - _RETRANSMISSIONS_ALPHA) * self.ema_retransmissions \
+            + _RETRANSMISSIONS_ALPHA * retransmissions
+        kb = constants.UNIT_FACTOR
+
+        return dict(
+            curr_window_size=self.cwnd / kb,
+            cumulative_sent_bytes=self.cumulative_sent / kb,
+            cumulative_rcv_bytes=self.cumulative_acked / kb,
+            cumulative_sent_good_bytes=self.cumulative_good / kb,
+            sent_bytes_timeframe=sent / kb,
+            sent_good_bytes_timeframe=good / kb,
+            unack_bytes=self.inflight / kb,
+            cumulative_retransmissions=self.cumulative_retransmissions,
+            retransmissions=retransmissions,
+            ema_retransmissions=self.ema_retransmissions,
+            last_rtt=self.last_rtt,
+            min_rtt=self.min_rtt,
+            max_rtt=self.max_rtt,
+            srtt=self.srtt,
+            var_rtt=self.var_rtt,
+            finished=self.finished,
+            acked_bytes_timeframe=acked / kb,
+        )
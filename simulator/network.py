@@ -0,0 +1,181 @@
+"""
+Local stand-ins for the Containernet topology of network_generator.py: the
+MininetService setting the link, the MGEN containers and the Mockets sender
+and receiver containers
+"""
+import abc
+import logging
+import multiprocessing
+from typing import Callable, List, Optional
+
+from simulator import replay, sender
+from simulator.fluid import Link, parse_delay
+
+# Networks a CongestionControlEnv runs on
+CONTAINERNET = "containernet"
+SIMULATOR = "simulator"
+REPLAY = "replay"
+NETWORK_BACKENDS = (CONTAINERNET, SIMULATOR, REPLAY)
+
+
+class SimulatedLinkUpdate:
+    """Stands for the rpyc AsyncResult of a timed link update, ready once the variation applied"""
+
+    def __init__(self, clock: Callable[[], float], at: float):
+        self._clock = clock
+        self._at = at
+
+    @property
+    def ready(self) -> bool:
+        return self._clock() >= self._at
+
+
+class LocalNetwork(abc.ABC):
+    """
+    Takes the link updates of MininetService and runs a local sender
+    process in place of the Mockets containers.
+
+    The link varies at the time of the states: a timed link update is ready
+    once the clock of the env, which follows the timestamps of the states,
+    is interval_sec past the moment it was asked for. The updates are kept
+    in ``link_updates``.
+
+    :param clock: time of the env in seconds, the timestamp of the last state
+    """
+
+    def __init__(self, clock: Callable[[], float]):
+        self._clock = clock
+        self.link = Link(1.0, 100.0)
+        self.link_updates: List[tuple] = []
+        self._sender = None
+
+    def _link_updated(self, new_link: Optional[Link] = None, interval_sec: Optional[float] = None) -> None:
+        """Called on every link update, with the link varied to and when for a timed one"""
+
+    @abc.abstractmethod
+    def _sender_process(self, grpc_port: int, update_interval_ms: Optional[float],
+                        episode_bytes: Optional[float]) -> multiprocessing.Process:
+        """Sender streaming to the server on grpc_port, not started yet"""
+
+    def manual_link_update(self, delay=None, bandwidth=None, loss=None) -> str:
+        self.link = Link(float(bandwidth), parse_delay(delay), float(loss or 0))
+        self.link_updates.append((self._clock(), self.link))
+        self._link_updated()
+
+        return f'Changed link to {delay} {bandwidth}Mbit {loss}%'
+
+    def timed_link_update(self, delay_start=None, bandwidth_start=None, loss_start=None,
+                          new_delay=None, new_bandwidth=None, new_loss=None,
+                          interval_sec=None) -> SimulatedLinkUpdate:
+        """Same arguments as MininetService.exposed_timed_link_update, returns without waiting"""
+        self.link = Link(float(bandwidth_start), parse_delay(delay_start), float(loss_start or 0))
+        new_link = Link(float(new_bandwidth), parse_delay(new_delay), float(new_loss or 0))
+        now = self._clock()
+        self.link_updates.append((now, self.link))
+        self.link_updates.append((now + interval_sec, new_link))
+        self._link_updated(new_link, interval_sec)
+
+        return SimulatedLinkUpdate(self._clock, now + interval_sec)
+
+    def start_sender(self, grpc_port: int, update_interval_ms: Optional[float] = None,
+                     episode_bytes: Optional[float] = None) -> None:
+        """Start a sender streaming to the server on grpc_port"""
+        self.stop_sender()
+        self._sender = self._sender_process(grpc_port, update_interval_ms, episode_bytes)
+        self._sender.daemon = True
+        self._sender.start()
+
+    def stop_sender(self) -> None:
+        if self._sender is not None:
+            self._sender.terminate()
+            self._sender.join()
+            self._sender.close()
+            self._sender = None
+
+
+class SimulatedNetwork(LocalNetwork):
+    """
+    Runs a simulated Mockets sender, see simulator.sender, on the link set
+    by the updates.
+
+    :param update_interval_ms: interval between states of the sender when
+        the env leaves it to Mockets
+    :param cross_traffic: share the bottleneck with the MGEN traffic
+    :param simulation_kwargs: further parameters of the FluidSimulation,
+        e.g. queue_packets or action_delay_ms
+    """
+
+    def __init__(self, clock: Callable[[], float], update_interval_ms: float = 100,
+                 cross_traffic: bool = True, **simulation_kwargs):
+        super().__init__(clock)
+        self.update_interval_ms = update_interval_ms
+        self.cross_traffic = cross_traffic
+        self.simulation_kwargs = simulation_kwargs
+        self._commands = None
+
+    def _link_updated(self, new_link: Optional[Link] = None, interval_sec: Optional[float] = None) -> None:
+        if self._sender is None:
+            return
+        if new_link is None:
+            self._commands.put((sender.LINK_UPDATE, tuple(self.link)))
+        else:
+            self._commands.put((sender.TIMED_LINK_UPDATE, tuple(self.link), tuple(new_link), interval_sec))
+
+    def _sender_process(self, grpc_port: int, update_interval_ms: Optional[float],
+                        episode_bytes: Optional[float]) -> multiprocessing.Process:
+        self._commands = multiprocessing.Queue()
+        logging.info(f"Simulated sender starting on {self.link}")
+        return multiprocessing.Process(
+            target=sender.run, name='marlin_simulator',
+            args=(grpc_port, tuple(self.link), self._commands),
+            kwargs=dict(update_interval_ms=update_interval_ms or self.update_interval_ms,
+                        episode_bytes=episode_bytes, cross_traffic=self.cross_traffic,
+                        **self.simulation_kwargs))
+
+    def stop_sender(self) -> None:
+        super().stop_sender()
+        if self._commands is not None:
+            self._commands.close()
+            self._commands = None
+
+
+class ReplayNetwork(LocalNetwork):
+    """
+    Replays the same states every episode, see simulator.replay, whatever
+    the link and the actions: an episode of a recording or, without one,
+    the states of a FluidSimulation holding a window. The link updates are
+    only kept.
+
+    :param recording: recording to replay an episode of
+    :param episode: episode of the recording
+    :param states: states simulated without a recording
+    :param realtime: send the states at the pace of their timestamps instead
+        of as soon as the previous one is answered
+    :param speed: speed up of the pace of the timestamps
+    :param simulation_kwargs: further parameters of simulated_states
+    """
+
+    def __init__(self, clock: Callable[[], float], recording: Optional[str] = None, episode: int = 0,
+                 states: int = 1000, realtime: bool = False, speed: float = 1.0, **simulation_kwargs):
+        super().__init__(clock)
+        self.records = replay.recorded_states(recording, episode) if recording is not None \
+            else replay.simulated_states(states, **simulation_kwargs)
+        self.realtime = realtime
+        self.speed = speed
+
+    def _sender_process(self, grpc_port: int, update_interval_ms: Optional[float],
+                        episode_bytes: Optional[float]) -> multiprocessing.Process:
+        # The states are replayed as they are, whatever the interval and
+        # bytes the env asks for
+        return multiprocessing.Process(
+            target=replay.replay, name='marlin_replay', args=(grpc_port, self.records),
+            kwargs=dict(realtime=self.realtime, speed=self.speed))
+
+
+def make_network(backend: str, clock: Callable[[], float], **kwargs) -> LocalNetwork:
+    """Local stand-in for the topology of a backend other than Containernet"""
+    if backend == SIMULATOR:
+        return SimulatedNetwork(clock, **kwargs)
+    if backend == REPLAY:
+        return ReplayNetwork(clock, **kwargs)
+    raise ValueError(f"Unknown local network backend {backend}, choose one of {(SIMULATOR, REPLAY)}")
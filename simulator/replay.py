@@ -0,0 +1,170 @@
+"""
+Replay of a fixed sequence of states to the gRPC server in place of Mockets
+
+The states come from an episode of a recording, see envs.utils.recorder, or
+from a FluidSimulation holding a window, and do not depend on the actions:
+an env answering them with a deterministic policy goes through the same
+steps every episode. They are sent as fast as the actions come back, each
+state waiting for the action answering it, or at the pace of their
+timestamps. Every action is matched to its state by sequence id, the states
+left unanswered are reported along with the states per second.
+
+Replay an episode against a running server:
+python -m simulator.replay --port 50051 --recording logs/recording/env-50051 --episode 0
+"""
+import argparse
+import logging
+import threading
+import time
+from typing import NamedTuple, Sequence
+
+import grpc
+import numpy as np
+
+from envs.utils.constants import Parameters
+from envs.utils.recorder import Recording
+from envs.utils.traffic_generator import TrafficGenerator
+from grpc_server import state_record
+from protos import congestion_control_pb2_grpc
+from simulator.fluid import CrossTraffic, FluidSimulation, Link
+
+_TIMESTAMP = state_record.OFFSET[Parameters.TIMESTAMP]
+
+
+class ReplayResult(NamedTuple):
+    states: int
+    # Actions received, late actions included
+    actions: int
+    # States sent and never answered, the last one excluded when it finishes
+    # the connection
+    unanswered: int
+    elapsed: float
+    # From sending a state to receiving its action
+    latencies_us: np.ndarray
+
+    @property
+    def states_per_second(self) -> float:
+        return self.states / self.elapsed if self.elapsed else 0.0
+
+
+def recorded_states(path: str, episode: int = 0) -> np.ndarray:
+    """State records of an episode of a recording"""
+    return np.array(Recording(path).episode(episode, ("state",))["state"])
+
+
+def simulated_states(count: int, link: Sequence[float] = (1.0, 100.0, 0.0), update_interval_ms: float = 100,
+                     cwnd: float = 25000, cross_traffic: bool = True, **simulation_kwargs) -> np.ndarray:
+    """State records of a FluidSimulation holding a window of cwnd bytes"""
+    link = Link(*link)
+    traffic = None
+    if cross_traffic:
+        traffic = CrossTraffic(TrafficGenerator(link_capacity_mbps=link.bandwidth_mbps))
+        traffic.restart(0.0)
+    simulation = FluidSimulation(link, cross_traffic=traffic, **simulation_kwargs)
+    simulation.set_cwnd(cwnd)
+    records = np.zeros((count, state_record.RECORD_WIDTH))
+    for row in range(count):
+        fields = simulation.advance(update_interval_ms)
+        records[row, :state_record.STREAM_ID] = [fields.get(name, 0) for name in state_record.FIELD_NAMES]
+        records[row, _TIMESTAMP] = simulation.now_ms
+
+    return records
+
+
+def replay(port: int, records: np.ndarray, realtime: bool = False, speed: float = 1.0,
+           finish: bool = True, action_timeout: float = 30.0, host: str = "localhost") -> ReplayResult:
+    """
+    Send the states of records, one per row, to the server on port.
+
+    Timestamps are the recorded ones, whatever the time of the replay, so
+    the env goes through the same values every time, and the states are
+    numbered from 1, the metadata of the records are left out.
+
+    :param realtime: send the states at the pace of their timestamps, sped
+        up by speed, whatever the actions, instead of each one as soon as
+        the action of the previous one is back
+    :param finish: mark the last state as finishing the connection, the
+        env then ends its episode, it is not waited for
+    :param action_timeout: time to wait for an action before giving up on it
+    """
+    states = [state_record.encode(record) for record in records]
+    first_timestamp = int(records[0, _TIMESTAMP]) if len(records) else 0
+    for sequence_id, (state, record) in enumerate(zip(states, records), 1):
+        state.timestamp = int(record[_TIMESTAMP])
+        state.sequence_id = sequence_id
+        state.finished = False
+    if finish and states:
+        states[-1].finished = True
+
+    sent = np.full(len(states) + 1, np.nan)
+    answered = np.full(len(states) + 1, np.nan)
+    actions = 0
+    condition = threading.Condition()
+
+    def wait_for(sequence_ids: slice) -> None:
+        with condition:
+            condition.wait_for(lambda: not np.isnan(answered[sequence_ids]).any(), timeout=action_timeout)
+
+    def requests():
+        start = time.perf_counter()
+        for sequence_id, state in enumerate(states, 1):
+            if realtime:
+                if sequence_id == len(states):
+                    # Leave the actions of the states before the last one
+                    # the time to come back
+                    wait_for(slice(1, sequence_id))
+                delay = start + (state.timestamp - first_timestamp) / 1000 / speed - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+            sent[sequence_id] = time.perf_counter()
+            yield state
+            if not realtime and not state.finished:
+                wait_for(slice(sequence_id, sequence_id + 1))
+
+    start = time.perf_counter()
+    with grpc.insecure_channel(f"{host}:{port}") as channel:
+        stub = congestion_control_pb2_grpc.CongestionControlStub(channel)
+        try:
+            for action in stub.OptimizeCongestionControl(requests(), wait_for_ready=True):
+                with condition:
+                    actions += 1
+                    if 0 < action.sequence_id <= len(states) and np.isnan(answered[action.sequence_id]):
+                        answered[action.sequence_id] = time.perf_counter()
+                    condition.notify_all()
+        except grpc.RpcError as error:
+            logging.info(f"REPLAY - Stream closed: {error.code()}")
+    elapsed = time.perf_counter() - start
+
+    expected = len(states) - 1 if finish else len(states)
+    latencies = (answered[1:] - sent[1:])[:expected]
+
+    return ReplayResult(states=len(states), actions=actions,
+                        unanswered=int(np.count_nonzero(np.isnan(latencies))), elapsed=elapsed,
+                        latencies_us=latencies[~np.isnan(latencies)] * 1e6)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Replay states to a gRPC server in place of Mockets")
+    parser.add_argument("--port", type=int, default=50051)
+    parser.add_argument("--host", type=str, default="localhost")
+    parser.add_argument("--recording", type=str, default=None,
+                        help="recording to replay an episode of, simulated states otherwise")
+    parser.add_argument("--episode", type=int, default=0)
+    parser.add_argument("--states", type=int, default=1000, help="simulated states")
+    parser.add_argument("--realtime", action="store_true")
+    parser.add_argument("--speed", type=float, default=1.0)
+
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    args = parse_args()
+    records = simulated_states(args.states) if args.recording is None \
+        else recorded_states(args.recording, args.episode)
+    result = replay(args.port, records, realtime=args.realtime, speed=args.speed, host=args.host)
+    print(f"{result.states} states, {result.actions} actions, {result.unanswered} unanswered, "
+          f"{result.states_per_second:.0f} states/s")
+    if len(result.latencies_us):
+        print(f"action latency (us): p50 {np.percentile(result.latencies_us, 50):.0f} "
+              f"p99 {np.percentile(result.latencies_us, 99):.0f} max {result.latencies_us.max():.0f}")
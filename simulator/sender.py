@@ -0,0 +1,143 @@
+"""
+Simulated Mockets sender talking to the gRPC server as Mockets does
+
+The sender runs a FluidSimulation in its own process and streams a
+CommunicationState every update interval of simulated time, stamped with a
+clock starting at the wall clock time the sender started. It waits for the
+action answering a state, matched by its sequence id, before simulating the
+next interval, so simulated time runs as fast as the server and the agent
+answer instead of in real time.
+
+Run it against a server on its own, e.g. a policy server:
+python -m simulator.sender --port 50051 --bandwidth 1 --delay 100 --states 1000
+"""
+import argparse
+import logging
+import queue
+import time
+from typing import Optional
+
+import grpc
+
+from envs.utils.traffic_generator import TrafficGenerator
+from protos import congestion_control_pb2, congestion_control_pb2_grpc
+from simulator.fluid import CrossTraffic, FluidSimulation, Link
+
+# Commands of a SimulatedNetwork to a running sender: switch to a link now,
+# and start the cross-traffic on a link varied after some time
+LINK_UPDATE = "link_update"
+TIMED_LINK_UPDATE = "timed_link_update"
+
+
+def _apply_command(simulation: FluidSimulation, command: tuple) -> None:
+    kind, *args = command
+    if kind == LINK_UPDATE:
+        simulation.set_link(Link(*args[0]))
+    elif kind == TIMED_LINK_UPDATE:
+        link_start, new_link, interval_sec = args
+        link_start, new_link = Link(*link_start), Link(*new_link)
+        simulation.set_link(link_start)
+        if simulation.cross_traffic is not None:
+            simulation.cross_traffic.restart(simulation.now_ms / 1000)
+        simulation.schedule_link(new_link, interval_sec, new_link.bandwidth_mbps / link_start.bandwidth_mbps)
+    else:
+        raise ValueError(f"Unknown simulator command {kind}")
+
+
+def run(port: int, link: tuple, commands=None, update_interval_ms: float = 100,
+        episode_bytes: Optional[float] = None, max_states: Optional[int] = None,
+        cross_traffic: bool = True, host: str = "localhost", **simulation_kwargs) -> int:
+    """
+    Stream the states of a simulated sender to the server on port until
+    episode_bytes are delivered, max_states are sent or the server closes
+    the stream, returns the number of states sent.
+
+    :param link: Link the sender starts on
+    :param commands: queue of LINK_UPDATE and TIMED_LINK_UPDATE commands,
+        applied before simulating each interval
+    :param update_interval_ms: simulated time between two states, until an
+        action asks for another one
+    :param cross_traffic: share the bottleneck with the MGEN traffic of a
+        TrafficGenerator sized on the starting link, as network_generator.py
+        does, started by a TIMED_LINK_UPDATE or right away without commands
+    :param simulation_kwargs: further parameters of the FluidSimulation
+    """
+    link = Link(*link)
+    simulation = FluidSimulation(
+        link,
+        cross_traffic=CrossTraffic(TrafficGenerator(link_capacity_mbps=link.bandwidth_mbps))
+        if cross_traffic else None,
+        episode_bytes=episode_bytes,
+        **simulation_kwargs)
+    if cross_traffic and commands is None:
+        simulation.cross_traffic.restart(0.0)
+    start_ms = int(time.time() * 1000)
+    # Actions received, None once the server closed the stream
+    actions = queue.Queue()
+    sent = 0
+
+    def states():
+        nonlocal sent
+        interval = update_interval_ms
+        while max_states is None or sent < max_states:
+            while commands is not None:
+                try:
+                    _apply_command(simulation, commands.get_nowait())
+                except queue.Empty:
+                    break
+            fields = simulation.advance(interval)
+            sent += 1
+            yield congestion_control_pb2.CommunicationState(
+                timestamp=start_ms + int(simulation.now_ms), sequence_id=sent, **fields)
+            if fields['finished']:
+                return
+            # Late actions of earlier states come first, they are applied too
+            while True:
+                action = actions.get()
+                if action is None:
+                    return
+                simulation.set_cwnd(action.cwnd_update)
+                if action.update_interval_ms:
+                    interval = action.update_interval_ms
+                if action.sequence_id >= sent:
+                    break
+
+    logging.info(f"SIMULATOR - Sending to {host}:{port} on {link}")
+    with grpc.insecure_channel(f"{host}:{port}") as channel:
+        stub = congestion_control_pb2_grpc.CongestionControlStub(channel)
+        try:
+            for action in stub.OptimizeCongestionControl(states(), wait_for_ready=True):
+                actions.put(action)
+        except grpc.RpcError as error:
+            logging.info(f"SIMULATOR - Stream closed: {error.code()}")
+        finally:
+            actions.put(None)
+    logging.info(f"SIMULATOR - Sent {sent} states, {simulation.now_ms / 1000:.1f}s simulated")
+
+    return sent
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Simulated Mockets sender")
+    parser.add_argument("--port", type=int, default=50051)
+    parser.add_argument("--host", type=str, default="localhost")
+    parser.add_argument("--bandwidth", type=float, default=1.0, help="Mbps")
+    parser.add_argument("--delay", type=float, default=100, help="one way, ms")
+    parser.add_argument("--loss", type=float, default=0, help="percent")
+    parser.add_argument("--update-interval-ms", type=float, default=100)
+    parser.add_argument("--states", type=int, default=None)
+    parser.add_argument("--episode-kbytes", type=float, default=None)
+    parser.add_argument("--queue-packets", type=int, default=1000)
+    parser.add_argument("--no-cross-traffic", action="store_true")
+
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    args = parse_args()
+    run(args.port, (args.bandwidth, args.delay, args.loss),
+        update_interval_ms=args.update_interval_ms,
+        episode_bytes=None if args.episode_kbytes is None else args.episode_kbytes * 1000,
+        max_states=args.states, cross_traffic=not args.no_cross_traffic, host=args.host,
+        queue_packets=args.queue_packets)
@@ -0,0 +1,77 @@
+"""Layouts of the batched states RPC and invalid batches"""
+import asyncio
+
+import grpc
+import numpy as np
+import pytest
+
+from envs.utils.constants import Parameters
+from grpc_server import state_record
+from grpc_server.channels import RecordQueue
+from grpc_server.congestion_control_server import ActionRouter, CongestionControlService
+from grpc_server.fallback import HOLD
+from protos import congestion_control_pb2, congestion_control_pb2_grpc
+
+STATES = 3
+CWND_KB = 10
+
+
+def _records() -> np.ndarray:
+    records = np.zeros((STATES, state_record.RECORD_WIDTH))
+    records[:, :state_record.STREAM_ID] = np.arange(STATES * state_record.STREAM_ID).reshape(STATES, -1) + 1
+    records[:, state_record.OFFSET[Parameters.CURR_WINDOW_SIZE]] = CWND_KB
+    return records
+
+
+@pytest.mark.parametrize("delta_encoded", [False, True])
+def test_batches_of_older_layouts_are_decoded(delta_encoded):
+    records = _records()
+    batch = state_record.encode_batch(records, delta_encoded, state_record.MIN_BATCH_FIELD_COUNT)
+    decoded = state_record.decode_batch(batch)
+
+    known = state_record.MIN_BATCH_FIELD_COUNT
+    np.testing.assert_array_equal(decoded[:, :known], records[:, :known])
+    # Fields the client did not know about are 0
+    np.testing.assert_array_equal(decoded[:, known:], 0)
+
+
+def test_fields_of_newer_layouts_are_ignored():
+    records = _records()
+    values = np.hstack([records[:, :state_record.STREAM_ID], np.full((STATES, 2), 7.0)])
+    batch = congestion_control_pb2.CommunicationStateBatch(
+        values=values.reshape(-1), field_count=state_record.STREAM_ID + 2)
+
+    np.testing.assert_array_equal(state_record.decode_batch(batch), records)
+
+
+async def _send_batches(batches) -> tuple:
+    router = ActionRouter(RecordQueue(3))
+    router.start(asyncio.get_running_loop())
+    # The env never answers, the states get the fallback of the deadline
+    service = CongestionControlService(router, RecordQueue(state_record.RECORD_WIDTH),
+                                       action_deadline=0.01, fallback=HOLD)
+    server = grpc.aio.server()
+    congestion_control_pb2_grpc.add_CongestionControlServicer_to_server(service, server)
+    port = server.add_insecure_port("127.0.0.1:0")
+    await server.start()
+    actions = []
+    try:
+        async with grpc.aio.insecure_channel(f"127.0.0.1:{port}") as channel:
+            stub = congestion_control_pb2_grpc.CongestionControlStub(channel)
+            try:
+                async for action in stub.OptimizeCongestionControlBatched(iter(batches)):
+                    actions.append(action)
+            except grpc.aio.AioRpcError as error:
+                return actions, error.code()
+            return actions, grpc.StatusCode.OK
+    finally:
+        await server.stop(None)
+
+
+def test_invalid_batch_aborts_the_rpc():
+    batches = [state_record.encode_batch(_records(), field_count=state_record.MIN_BATCH_FIELD_COUNT),
+               congestion_control_pb2.CommunicationStateBatch(values=[1.0] * 10, field_count=5)]
+    actions, code = asyncio.run(_send_batches(batches))
+
+    assert [action.cwnd_update for action in actions] == [CWND_KB * 1000] * STATES
+    assert code == grpc.StatusCode.INVALID_ARGUMENT
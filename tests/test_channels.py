@@ -0,0 +1,35 @@
+"""Several envs putting actions into one shared memory ring"""
+import multiprocessing
+
+import numpy as np
+
+from grpc_server.channels import SharedMemoryChannel
+
+PRODUCERS = 4
+RECORDS = 20000
+
+
+def _produce(channel: SharedMemoryChannel, producer: int) -> None:
+    for sequence in range(RECORDS):
+        channel.put((producer, sequence, producer * RECORDS + sequence))
+
+
+def test_producers_share_a_ring():
+    channel = SharedMemoryChannel(3, capacity=16)
+    producers = [multiprocessing.Process(target=_produce, args=(channel, producer))
+                 for producer in range(PRODUCERS)]
+    for producer in producers:
+        producer.start()
+    try:
+        # Out of order or overwritten records raise or are missing
+        records = np.array([channel.get(timeout=10) for _ in range(PRODUCERS * RECORDS)])
+    finally:
+        for producer in producers:
+            producer.terminate()
+            producer.join()
+        channel.close()
+
+    for producer in range(PRODUCERS):
+        sequences = records[records[:, 0] == producer, 1]
+        np.testing.assert_array_equal(sequences, np.arange(RECORDS))
+    np.testing.assert_array_equal(records[:, 2], records[:, 0] * RECORDS + records[:, 1])
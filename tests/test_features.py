@@ -0,0 +1,45 @@
+"""Observations of the policy server and of the dataset export from the same state records"""
+import numpy as np
+import pytest
+
+from envs.utils import dataset
+from envs.utils.constants import Parameters
+from envs.utils.features import RAW_STATE_OFFSETS
+from envs.utils.recorder import EpisodeRecorder, Recording
+from grpc_server import policy_server, state_record
+
+STATES = 60
+LINK = (10.0, 50.0, 0.0)
+
+_TIMESTAMP = state_record.OFFSET[Parameters.TIMESTAMP]
+
+
+@pytest.mark.parametrize("history_horizon, statistics_window", [(None, None), (4, 10)])
+def test_served_and_exported_observations_match(tmp_path, history_horizon, statistics_window):
+    rng = np.random.default_rng(0)
+    records = np.zeros((STATES, state_record.RECORD_WIDTH))
+    records[:, RAW_STATE_OFFSETS] = rng.uniform(0, 200, (STATES, len(RAW_STATE_OFFSETS)))
+    records[:, _TIMESTAMP] = 1000 + np.cumsum(rng.integers(0, 200, STATES))
+    actions = rng.uniform(-1, 1, STATES).astype(np.float32)
+
+    recorder = EpisodeRecorder(str(tmp_path))
+    recorder.start_episode()
+    for index, (record, action) in enumerate(zip(records, actions)):
+        recorder.record_state(record, *LINK)
+        recorder.record_step(np.nan if index == 0 else action, 10000, np.nan if index == 0 else -1.0)
+    recorder.close()
+    transitions = dataset.episode_transitions(Recording(str(tmp_path)), 0, history_horizon, statistics_window)
+
+    observation_length = dataset.observation_space(history_horizon).shape[0]
+    actor = policy_server.NumpyActor([np.zeros((1, observation_length))], [np.zeros(1)], "ReLU",
+                                     np.array([-1.0]), np.array([1.0]))
+    builder = policy_server.ObservationBuilder(
+        policy_server.ServedPolicy(actor, history_horizon, statistics_window))
+    observations = [builder.reset().copy()]
+    for index, (record, action) in enumerate(zip(records, actions)):
+        builder.update(record)
+        if index > 0:
+            observations.append(builder.observation(actions[index:index + 1]).copy())
+
+    np.testing.assert_array_equal(transitions.observations, observations[:-1])
+    np.testing.assert_array_equal(transitions.next_observations, observations[1:])
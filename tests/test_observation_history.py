@@ -0,0 +1,127 @@
+"""Stacking and normalization of CongestionControlEnv against the HistoryWrapper and VecNormalize stack, and the lifetime of its observations"""
+import gym
+import numpy as np
+import pytest
+from stable_baselines3.common.vec_env import DummyVecEnv, VecNormalize
+
+from envs.env import CongestionControlEnv
+from envs.utils.features import OBSERVATION_LENGTH
+from simulator.network import SIMULATOR
+
+HORIZON = 3
+STEPS = 120
+# Steps terminating an episode
+TERMINATED = {20, 21, 57, 90}
+
+
+class HistoryWrapper(gym.Wrapper):
+    """utils.wrappers.HistoryWrapper of RL Baselines3 Zoo, as configured in hyperparams/sac.yml"""
+
+    def __init__(self, env: gym.Env, horizon: int = 2):
+        wrapped_obs_space = env.observation_space
+        wrapped_action_space = env.action_space
+
+        low_obs = np.repeat(wrapped_obs_space.low, horizon, axis=-1)
+        high_obs = np.repeat(wrapped_obs_space.high, horizon, axis=-1)
+        low_action = np.repeat(wrapped_action_space.low, horizon, axis=-1)
+        high_action = np.repeat(wrapped_action_space.high, horizon, axis=-1)
+        low = np.concatenate((low_obs, low_action))
+        high = np.concatenate((high_obs, high_action))
+
+        env.observation_space = gym.spaces.Box(low=low, high=high, dtype=wrapped_obs_space.dtype)
+        super().__init__(env)
+
+        self.horizon = horizon
+        self.obs_history = np.zeros(low_obs.shape, low_obs.dtype)
+        self.action_history = np.zeros(low_action.shape, low_action.dtype)
+
+    def _create_obs_from_history(self):
+        return np.concatenate((self.obs_history, self.action_history))
+
+    def reset(self, **kwargs):
+        self.obs_history[...] = 0
+        self.action_history[...] = 0
+        obs = self.env.reset()
+        self.obs_history[..., -obs.shape[-1]:] = obs
+        return self._create_obs_from_history()
+
+    def step(self, action):
+        obs, reward, done, info = self.env.step(action)
+        last_ax_size = obs.shape[-1]
+
+        self.obs_history = np.roll(self.obs_history, shift=-last_ax_size, axis=-1)
+        self.obs_history[..., -obs.shape[-1]:] = obs
+
+        self.action_history = np.roll(self.action_history, shift=-action.shape[-1], axis=-1)
+        self.action_history[..., -action.shape[-1]:] = action
+        return self._create_obs_from_history(), reward, done, info
+
+
+class ScriptedEnv(gym.Env):
+    """Steps through the given states, reset returns zeros as CongestionControlEnv"""
+
+    def __init__(self, states: np.ndarray):
+        self.observation_space = gym.spaces.Box(low=-float("inf"), high=float("inf"), shape=(OBSERVATION_LENGTH,))
+        self.action_space = gym.spaces.Box(low=-1, high=+1, shape=(1,), dtype=np.float32)
+        self.states = states
+        self.step_index = 0
+
+    def reset(self, **kwargs):
+        return np.zeros(OBSERVATION_LENGTH)
+
+    def step(self, action):
+        state = self.states[self.step_index]
+        done = self.step_index in TERMINATED
+        self.step_index += 1
+        return state, 0.0, done, {}
+
+
+@pytest.mark.parametrize("history_horizon, normalize", [(HORIZON, False), (None, True), (HORIZON, True)])
+def test_observations_match_the_wrapper_stack(history_horizon, normalize):
+    rng = np.random.default_rng(0)
+    states = rng.normal(rng.uniform(-50, 50, OBSERVATION_LENGTH), rng.uniform(1, 30, OBSERVATION_LENGTH),
+                        (STEPS, OBSERVATION_LENGTH)).astype(np.float32)
+    actions = rng.uniform(-1, 1, (STEPS, 1)).astype(np.float32)
+
+    env = CongestionControlEnv(network_backend=SIMULATOR, history_horizon=history_horizon,
+                               normalize_observations=normalize)
+    wrapped = DummyVecEnv([lambda: ScriptedEnv(states) if history_horizon is None
+                           else HistoryWrapper(ScriptedEnv(states), history_horizon)])
+    if normalize:
+        wrapped = VecNormalize(wrapped, norm_reward=False)
+
+    # The observations of reset() and step(), the states are fed to the
+    # private stacking and normalization without a network
+    np.testing.assert_array_equal(env._observation(np.zeros(OBSERVATION_LENGTH), None, False), wrapped.reset()[0])
+    for step, (state, action) in enumerate(zip(states, actions)):
+        terminated = step in TERMINATED
+        observation = env._observation(state, action, terminated)
+        wrapped_observations, _, dones, infos = wrapped.step(action[None])
+        assert dones[0] == terminated
+
+        if terminated:
+            np.testing.assert_array_equal(observation, infos[0]["terminal_observation"], err_msg=f"step {step}")
+            observation = env._observation(np.zeros(OBSERVATION_LENGTH), None, False)
+        np.testing.assert_array_equal(observation, wrapped_observations[0], err_msg=f"step {step}")
+        if normalize:
+            np.testing.assert_array_equal(env.get_original_obs(), wrapped.get_original_obs()[0])
+
+    if normalize:
+        np.testing.assert_array_equal(env.normalizer.mean, wrapped.obs_rms.mean)
+        np.testing.assert_array_equal(env.normalizer.var, wrapped.obs_rms.var)
+
+
+@pytest.mark.parametrize("history_horizon, normalize", [(None, False), (HORIZON, False), (None, True)])
+def test_observations_outlive_the_next_steps(history_horizon, normalize):
+    env = CongestionControlEnv(network_backend=SIMULATOR, history_horizon=history_horizon,
+                               normalize_observations=normalize)
+    # No state is fetched, the statistics are set by hand
+    env.parameter_fetch_error = True
+    observations = []
+    snapshots = []
+    for step in range(4):
+        env.state_statistics[:] = step + 1
+        observations.append(env._observation(env._get_state(), np.array([step], np.float32), False))
+        snapshots.append(observations[-1].copy())
+
+    np.testing.assert_array_equal(observations, snapshots)
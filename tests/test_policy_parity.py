@@ -0,0 +1,108 @@
+"""Actions of the NumPy policy served by the gRPC server against the torch actor of SAC"""
+from typing import Optional
+
+import gym
+import numpy as np
+import pytest
+import torch
+from stable_baselines3 import SAC
+from stable_baselines3.common.vec_env import DummyVecEnv, VecNormalize
+
+from envs.utils.constants import Parameters
+from envs.utils.features import OBSERVATION_LENGTH, RAW_STATE_OFFSETS
+from grpc_server import policy_server, state_record
+
+# Torch computes in float32, unnormalized observations in the thousands
+# leave it errors past 1e-5
+TOLERANCE = 1e-4
+STATES = 200
+
+_TIMESTAMP = state_record.OFFSET[Parameters.TIMESTAMP]
+
+
+class SpacesEnv(gym.Env):
+    """Only carries the spaces of CongestionControlEnv"""
+
+    def __init__(self, observation_length):
+        self.observation_space = gym.spaces.Box(low=-float("inf"), high=float("inf"),
+                                                shape=(observation_length,))
+        self.action_space = gym.spaces.Box(low=-1, high=+1, shape=(1,), dtype=np.float32)
+
+
+def _model(observation_length: int) -> SAC:
+    torch.manual_seed(0)
+    return SAC("MlpPolicy", SpacesEnv(observation_length), buffer_size=1,
+               policy_kwargs=dict(net_arch=[400, 300]), device="cpu")
+
+
+def _torch_actions(model: SAC, observations: np.ndarray) -> np.ndarray:
+    """Deterministic actions of the SAC actor, one observation or a batch"""
+    observations = torch.as_tensor(observations, dtype=torch.float32)
+    with torch.no_grad():
+        actions = model.policy.actor(observations.reshape(-1, observations.shape[-1]), deterministic=True)
+    return actions.numpy().reshape(*observations.shape[:-1], -1)
+
+
+def _normalized(vec_normalize: Optional[VecNormalize], observation: np.ndarray) -> np.ndarray:
+    return observation if vec_normalize is None else vec_normalize.normalize_obs(observation)
+
+
+def _records(rng: np.random.Generator) -> np.ndarray:
+    records = np.zeros((STATES, state_record.RECORD_WIDTH))
+    records[:, RAW_STATE_OFFSETS] = rng.uniform(0, 200, (STATES, len(RAW_STATE_OFFSETS)))
+    records[:, _TIMESTAMP] = 1000 + 100 * np.arange(STATES)
+    return records
+
+
+def test_numpy_actor_matches_the_torch_actor():
+    model = _model(OBSERVATION_LENGTH)
+    actor = policy_server.NumpyActor.from_sac(model)
+    observations = np.random.default_rng(1).normal(0, 3, (STATES, OBSERVATION_LENGTH)).astype(np.float32)
+
+    batched = actor(observations)
+    single = np.array([actor(observation) for observation in observations])
+
+    torch_actions = _torch_actions(model, observations)
+    assert np.abs(batched - torch_actions).max() <= TOLERANCE
+    assert np.abs(single - torch_actions).max() <= TOLERANCE
+
+
+@pytest.mark.parametrize("history_horizon", [None, 10])
+@pytest.mark.parametrize("normalize", [False, True])
+def test_served_policy_matches_the_torch_actor(tmp_path, history_horizon, normalize):
+    observation_length = OBSERVATION_LENGTH if history_horizon is None \
+        else history_horizon * (OBSERVATION_LENGTH + 1)
+    model = _model(observation_length)
+    model_path = str(tmp_path / "model.zip")
+    model.save(model_path)
+
+    vec_normalize = None
+    normalization_path = None
+    if normalize:
+        rng = np.random.default_rng(0)
+        vec_normalize = VecNormalize(DummyVecEnv([lambda: SpacesEnv(observation_length)]), norm_reward=False)
+        vec_normalize.obs_rms.mean = rng.normal(0, 10, observation_length)
+        vec_normalize.obs_rms.var = rng.uniform(1, 100, observation_length)
+        normalization_path = str(tmp_path / "vecnormalize.pkl")
+        vec_normalize.save(normalization_path)
+
+    policy_path = str(tmp_path / "policy.npz")
+    policy_server.export(model_path, policy_path, normalization_path, history_horizon)
+    policy = policy_server.ServedPolicy.load(policy_path)
+
+    # Observations as the Zoo feeds them to the model: stacked by the env or
+    # HistoryWrapper, then normalized by VecNormalize
+    unnormalized = policy_server.ObservationBuilder(
+        policy_server.ServedPolicy(policy.actor, history_horizon, policy.statistics_window))
+    episode = policy_server.PolicyEpisode(policy)
+
+    torch_action = _torch_actions(model, _normalized(vec_normalize, unnormalized.reset()))
+    for index, record in enumerate(_records(np.random.default_rng(2))):
+        # The first state is answered with the action of the reset
+        # observation, every following one with that of its own
+        unnormalized.update(record)
+        if index > 0:
+            torch_action = _torch_actions(model, _normalized(vec_normalize, unnormalized.observation(torch_action)))
+        episode.decide(record)
+
+        assert np.abs(episode.action - torch_action).max() <= TOLERANCE, f"state {index}"
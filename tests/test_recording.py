@@ -0,0 +1,68 @@
+"""Recordings holding an episode without states and recordings across episode cleanups"""
+import numpy as np
+
+from envs.env import CongestionControlEnv
+from envs.utils import dataset, reward
+from envs.utils.constants import Parameters
+from envs.utils.recorder import EpisodeRecorder, Recording
+from grpc_server import state_record
+from simulator.network import SIMULATOR
+
+CHUNK_ROWS = 8
+LINK = [10.0, 50.0, 0.0]
+
+_TIMESTAMP = state_record.OFFSET[Parameters.TIMESTAMP]
+
+
+def _metadata(env_episode: int) -> dict:
+    traffic_patterns = [500.0, 1000.0, 500.0, 260.0]
+    return dict(env_episode=env_episode, link_start=LINK, link_variation=LINK, mice_flows_kbs=100.0,
+                traffic_patterns=traffic_patterns, variation_step=None)
+
+
+def _record_episode(recorder: EpisodeRecorder, env_episode: int, states: int, first_timestamp: int) -> None:
+    recorder.start_episode(_metadata(env_episode))
+    for index in range(states):
+        record = np.zeros(state_record.RECORD_WIDTH)
+        record[_TIMESTAMP] = first_timestamp + 100 * index
+        recorder.record_state(record, *LINK)
+        recorder.record_step(np.nan if index == 0 else .1, 10000, np.nan if index == 0 else -1.0)
+    # No states, as after a parameter fetch error
+    recorder.end_episode(dict(parameter_fetch_error=states == 0))
+
+
+def test_episode_without_states_on_a_chunk_boundary(tmp_path):
+    recorder = EpisodeRecorder(str(tmp_path), chunk_rows=CHUNK_ROWS)
+    # Fills the first chunk, the empty episode starts on the second one
+    # which is never written
+    _record_episode(recorder, 0, CHUNK_ROWS, 1000)
+    _record_episode(recorder, 1, 0, 0)
+    recorder.close()
+
+    recording = Recording(str(tmp_path))
+    assert recording.episodes[1]["start"] == recording.episodes[1]["stop"] == CHUNK_ROWS
+    empty = recording.episode(1)
+    assert empty["state"].shape == (0, state_record.RECORD_WIDTH)
+    assert empty["action"].dtype == np.float32
+    assert len(recording.column("state")) == CHUNK_ROWS
+
+    assert len(reward.episode_rewards(reward.episode_trace(recording, 1))) == 0
+    assert len(dataset.episode_transitions(recording, 1)) == 0
+    transitions = dataset.recording_transitions([str(tmp_path)])
+    assert len(transitions) == CHUNK_ROWS - 1
+
+
+def test_recording_outlives_the_episode_cleanup(tmp_path):
+    env = CongestionControlEnv(network_backend=SIMULATOR, record_path=str(tmp_path), record_chunk_rows=CHUNK_ROWS)
+    recorder = env._recorder
+    recorder.start_episode(_metadata(0))
+    recorder.record_state(np.zeros(state_record.RECORD_WIDTH), *LINK)
+    # As between two episodes of an env without a persistent server
+    env._cleanup()
+    recorder.record_state(np.zeros(state_record.RECORD_WIDTH), *LINK)
+    recorder.record_step(.1, 10000, -1.0)
+    env.close()
+
+    recording = Recording(recorder.path)
+    assert len(recording.episodes) == 1
+    assert len(recording.episode(0)["state"]) == 2
@@ -0,0 +1,45 @@
+"""Fallback actions keep flowing while the env takes no state"""
+import asyncio
+import threading
+
+from grpc_server import state_record
+from grpc_server.channels import ChannelFeeder, RecordQueue, SharedMemoryChannel
+from grpc_server.congestion_control_server import ActionRouter, CongestionControlService
+from grpc_server.fallback import HOLD
+from protos import congestion_control_pb2
+
+STATES = 20
+CWND_KB = 10
+
+
+async def _states():
+    for sequence_id in range(1, STATES + 1):
+        yield congestion_control_pb2.CommunicationState(
+            curr_window_size=CWND_KB, sequence_id=sequence_id, timestamp=sequence_id)
+
+
+async def _answer_stalled_env(state_queue) -> list:
+    router = ActionRouter(RecordQueue(3))
+    router.start(asyncio.get_running_loop())
+    service = CongestionControlService(router, state_queue, action_deadline=0.01, fallback=HOLD)
+    return [action async for action in service.OptimizeCongestionControl(_states(), None)]
+
+
+def test_fallbacks_flow_while_the_state_channel_is_full():
+    # Two slots, the env never takes a state
+    channel = SharedMemoryChannel(state_record.RECORD_WIDTH, capacity=2)
+    feeder = ChannelFeeder(channel)
+    actions = []
+    # A blocked event loop never returns, it runs in a thread the test can
+    # give up on
+    server = threading.Thread(target=lambda: actions.extend(asyncio.run(_answer_stalled_env(feeder))),
+                              daemon=True)
+    server.start()
+    server.join(timeout=10)
+
+    assert not server.is_alive(), "the event loop blocked on the full state channel"
+    assert [action.sequence_id for action in actions] == list(range(1, STATES + 1))
+    assert all(action.cwnd_update == CWND_KB * 1000 for action in actions)
+    assert channel.qsize() == 2
+    assert feeder.full > 0
+    channel.close()
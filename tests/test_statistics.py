@@ -0,0 +1,62 @@
+"""StreamingStatistics against the per-step recomputation over the whole history it replaced"""
+from statistics import fmean, stdev
+
+import numpy as np
+import pytest
+
+from envs.utils import constants
+from envs.utils.constants import Statistic
+from envs.utils.features import STATISTIC_INDEX
+from envs.utils.statistics import StreamingStatistics
+
+FEATURES = 4
+_STD = STATISTIC_INDEX[Statistic.STD]
+
+
+def _recomputed(history: list, ema: float, window) -> dict:
+    """Statistics of one feature as the env computed them from its history, which starts with 0.0"""
+    samples = history[1:] if window is None else history[1:][-window:]
+    if len(history) > 2:
+        return {
+            Statistic.LAST: history[-1],
+            Statistic.MEAN: fmean(samples),
+            Statistic.STD: stdev(samples),
+            Statistic.MIN: min(samples),
+            Statistic.MAX: max(samples),
+            Statistic.EMA: ema,
+            Statistic.DIFF: history[-1] - history[-2],
+        }
+    return dict((stat, ema if stat == Statistic.EMA else history[-1]) for stat in Statistic)
+
+
+@pytest.mark.parametrize("window", [None, 2, 7])
+def test_statistics_match_the_recomputation(window):
+    rng = np.random.default_rng(0)
+    # Features of very different scales, as the bytes and the RTTs
+    samples = rng.normal(1, 0.5, (1000, FEATURES)) * np.array([1e-3, 1.0, 1e3, 1e6])
+    engine = StreamingStatistics(FEATURES, window=window)
+    histories = [[0.0] for _ in range(FEATURES)]
+    emas = [0.0] * FEATURES
+
+    for step, values in enumerate(samples):
+        statistics = engine.update(values)
+        for feature, value in enumerate(values.tolist()):
+            histories[feature].append(value)
+            emas[feature] = value if emas[feature] == 0.0 \
+                else (1 - constants.ALPHA) * emas[feature] + constants.ALPHA * value
+            expected = _recomputed(histories[feature], emas[feature], window)
+            for stat, index in STATISTIC_INDEX.items():
+                assert statistics[feature, index] == pytest.approx(expected[stat], rel=1e-9, abs=1e-12), \
+                    f"{stat} of feature {feature} at step {step}"
+
+
+def test_window_does_not_drift():
+    rng = np.random.default_rng(0)
+    engine = StreamingStatistics(1, window=10)
+    for value in rng.uniform(0, 1e4, 20000):
+        engine.update(np.array([value]))
+    # Once the window only holds the same value its deviation is 0
+    for _ in range(20000):
+        statistics = engine.update(np.array([1234.5]))
+
+    assert statistics[0, _STD] == 0.0